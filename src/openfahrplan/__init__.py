@@ -1,11 +1,24 @@
 import os
+import tempfile
 from pathlib import Path
 
+from openfahrplan.lib.startup import StartupReport
+
+# Timings of everything between here and the first feed version being served, see /readyz
+startup = StartupReport()
+
 from dotenv import load_dotenv
 import pandas as pd
 import logging
-from openfahrplan.lib.gtfs import GTFSFeed
-from openfahrplan.lib.raptor import RaptorIndex
+from openfahrplan.lib.registry import FeedRegistry
+from openfahrplan.lib.realtime import RealtimePoller, DEFAULT_REALTIME_URL
+from openfahrplan.lib.history import RealtimeHistory
+from openfahrplan.lib.figures import FigureCache
+from openfahrplan.lib.metrics import metrics
+from openfahrplan.lib.memory import parse_size
+from openfahrplan.lib.slowlog import SlowQueryLog
+
+startup.record("imports", startup.elapsed())
 
 # Pandas Settings
 pd.set_option("display.max_rows", None)
@@ -19,17 +32,112 @@ load_dotenv()
 # Set data path
 data_folder = Path(os.getenv("OPENFAHRPLAN_DATA_DIR", Path(__file__).parent /".."/".."/ "data"))
 
-# Load the gtfs feed
+# GTFS-RT source: the gtfs.de feed, a local .pb or a replay server (python -m openfahrplan.lib.replay)
+realtime_url = os.getenv("OPENFAHRPLAN_REALTIME_URL", DEFAULT_REALTIME_URL)
+
+# Load the gtfs feed and precompute the raptor index in the background, the server
+# accepts connections right away and /readyz reports when the indexes are done.
+# A version larger than OPENFAHRPLAN_MEMORY_BUDGET (e.g. 2G) is never served.
 logging.info("Start init.")
-logging.info("Loading gtfs feed...")
-feed = GTFSFeed(data_folder)
-timetable = feed.stops.merge(feed.stop_times).merge(feed.trips).merge(feed.routes)
-station_labels = feed.stops[["stop_id", "stop_name"]].drop_duplicates(subset=["stop_name"]).rename(columns={"stop_name": "label", "stop_id": "value"}).to_dict("records")
+registry = FeedRegistry(data_folder, realtime_url=realtime_url, startup=startup,
+                        memory_budget=parse_size(os.getenv("OPENFAHRPLAN_MEMORY_BUDGET")), raptor_options={
+    "prune_unserved": os.getenv("OPENFAHRPLAN_RAPTOR_PRUNE", "0") == "1",
+    "collapse_stations": os.getenv("OPENFAHRPLAN_RAPTOR_COLLAPSE", "0") == "1",
+    "transfer_penalty": int(os.getenv("OPENFAHRPLAN_RAPTOR_TRANSFER_PENALTY", "120")),
+    # arc flags for large feeds, see python -m openfahrplan.lib.partition
+    "cells": int(os.getenv("OPENFAHRPLAN_RAPTOR_CELLS", "0")),
+})
+registry.start()
+
+# Hot reload: rebuild in the background whenever the feed on disk changes
+if os.getenv("OPENFAHRPLAN_RELOAD_INTERVAL"):
+    registry.watch(float(os.getenv("OPENFAHRPLAN_RELOAD_INTERVAL")))
+
+# GTFS-RT is polled in the background once the first page asks for a snapshot
+realtime = RealtimePoller(
+    realtime_url,
+    interval=float(os.getenv("OPENFAHRPLAN_REALTIME_INTERVAL", "60")),
+    stop_filter=lambda: registry.current().feed.realtime_stop_ids,
+)
+
+# Optional archive of every snapshot, finished days are compacted; recording needs the poller running from the start
+history = None
+if os.getenv("OPENFAHRPLAN_HISTORY_DIR"):
+    history = RealtimeHistory(Path(os.getenv("OPENFAHRPLAN_HISTORY_DIR")))
+    realtime.listeners.append(history.append)
+    realtime.start()
+
+# Static map figures per feed version, shared on disk between the workers of a pod
+figures = FigureCache(
+    Path(os.getenv("OPENFAHRPLAN_FIGURE_CACHE", Path(tempfile.gettempdir()) / "openfahrplan-figures")),
+    max_age=float(os.getenv("OPENFAHRPLAN_FIGURE_MAX_AGE", "3600")),
+    live=registry.live_versions,
+)
+
+# Queries slower than the threshold are logged for replay (python -m openfahrplan.lib.slowlog replay)
+slowlog = SlowQueryLog(
+    os.getenv("OPENFAHRPLAN_SLOWLOG"),
+    threshold=float(os.getenv("OPENFAHRPLAN_SLOWLOG_THRESHOLD", "0.5")),
+    sample=float(os.getenv("OPENFAHRPLAN_SLOWLOG_SAMPLE", "1.0")),
+    context=lambda: (registry.current() if registry.ready else None, realtime.latest().version),
+)
+
 
-logging.info("Precomputing raptor index...")
-raptor_index = RaptorIndex.from_feed(feed)
+# Gauges read when /metrics is scraped
+def _index_sizes():
+    if not registry.ready:
+        return None
+    version = registry.current()
+    return {
+        "raptor_stops": version.raptor_index.nstops,
+        "raptor_trips": len(version.raptor_index.trips),
+        "departures": len(version.departures),
+        "line_patterns": sum(len(version.lines.patterns(line)) for line in version.lines.lines()),
+        "search_stations": len(version.feed.search_index.stop_ids),
+    }
+
+
+def _memory_by_component():
+    if registry.memory is None:
+        return None
+    sizes = {}
+    for row in registry.memory["rows"]:
+        sizes[row["component"]] = sizes.get(row["component"], 0) + row["bytes"]
+    return sizes
+
+
+metrics.gauge("openfahrplan_ready", "1 once a feed version is served.", lambda: int(registry.ready))
+metrics.gauge("openfahrplan_feed_info", "The feed version that is served.",
+              lambda: {registry.current().version: 1} if registry.ready else None, labels=("version",))
+metrics.gauge("openfahrplan_feed_loaded_timestamp_seconds", "When the served feed version was built.",
+              lambda: registry.current().loaded_at if registry.ready else None)
+metrics.gauge("openfahrplan_index_entries", "Entries per precomputed index.", _index_sizes, labels=("index",))
+metrics.gauge("openfahrplan_feed_memory_bytes", "Deep size of the served feed version per component, with a budget set.",
+              _memory_by_component, labels=("component",))
+metrics.gauge("openfahrplan_feed_memory_budget_bytes", "Configured memory budget of a feed version.",
+              lambda: registry.memory_budget)
+metrics.gauge("openfahrplan_realtime_snapshot_version", "Version of the latest GTFS-RT snapshot.",
+              lambda: realtime.latest().version)
+metrics.gauge("openfahrplan_realtime_snapshot_age_seconds", "Seconds since the latest GTFS-RT snapshot was fetched.",
+              lambda: realtime.latest().age())
 
 logging.info("Init done.")
 
+
+def warm_up_worker():
+    """Run by every background job worker before its first job, see lib/jobs.py."""
+    registry.current()
+    realtime.snapshot(wait=realtime.timeout)
+
+
+def __getattr__(name):
+    # feed, raptor_index, ... always resolve to the version that is currently served.
+    # Request handlers should call registry.current() once and stick to that version.
+    # Until the first version is built this waits for it.
+    if name in ("feed", "raptor_index"):
+        return getattr(registry.current(), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 # Export everything
-__all__ = ["feed","timetable","station_labels","raptor_index", "data_folder"]
+__all__ = ["registry", "realtime", "history", "startup", "figures", "metrics", "slowlog", "feed", "raptor_index", "data_folder"]
@@ -1,9 +1,31 @@
+import os
+import tempfile
+from pathlib import Path
+
 from dash import dcc, html
 import dash
 
-app = dash.Dash(__name__, suppress_callback_exceptions=True, use_pages=True, title="OpenFahrplan",
-                external_stylesheets=["https://cdn.jsdelivr.net/npm/tailwindcss@2.2.19/dist/tailwind.min.css"])
+from openfahrplan import startup, realtime, metrics, registry, warm_up_worker
+from openfahrplan.api import api, ORJSONProvider
+from openfahrplan.lib.jobs import WorkerPoolManager
+
+# Routing runs in a pool of worker processes so a slow query doesn't block the web
+# threads, the pool is replaced when a new feed version is served
+jobs = WorkerPoolManager(
+    Path(os.getenv("OPENFAHRPLAN_JOB_CACHE", Path(tempfile.gettempdir()) / "openfahrplan-jobs")),
+    workers=int(os.getenv("OPENFAHRPLAN_WORKERS", "2")),
+    metrics=metrics,
+    version=lambda: registry.current().version if registry.ready else None,
+    warm_up=warm_up_worker,
+)
+
+with startup.phase("app"):
+    app = dash.Dash(__name__, suppress_callback_exceptions=True, use_pages=True, title="OpenFahrplan",
+                    background_callback_manager=jobs,
+                    external_stylesheets=["https://cdn.jsdelivr.net/npm/tailwindcss@2.2.19/dist/tailwind.min.css"])
 app._favicon = "favicon3.png"
+app.server.json = ORJSONProvider(app.server)
+app.server.register_blueprint(api)
 app.layout = html.Div(
     id="openfahrplan-root",
     className="flex flex-col flex h-screen",
@@ -13,6 +35,7 @@ app.layout = html.Div(
                 html.Li([dcc.Link("Linien", href="/lines")]),
                 html.Li([dcc.Link("Haltestellen", href="/stations")]),
                 html.Li([dcc.Link("Verbindungen", href="/connection")]),
+                html.Li([dcc.Link("Abfahrten", href="/departures")]),
                 html.Li([dcc.Link("Störungen", href="/disruptions")]),
             ])
         ]),
@@ -21,6 +44,9 @@ app.layout = html.Div(
     ])
 
 if __name__ == "__main__":
+    realtime.start()
+    # the workers load the feed while the first version is built here
+    jobs.start()
     app.run(
         host="0.0.0.0",
     )
@@ -0,0 +1,221 @@
+import gzip
+
+import orjson
+import pandas as pd
+from flask import Blueprint, Response, abort, jsonify, request
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.exceptions import HTTPException
+
+from openfahrplan import registry, realtime, startup, figures, metrics, slowlog
+from openfahrplan.lib.departures import seconds_of_day
+from openfahrplan.lib.display import build_route_map_data
+from openfahrplan.lib.raptor import _parse_gtfs_time
+
+api = Blueprint("api", __name__)
+
+
+class ORJSONProvider(DefaultJSONProvider):
+    """jsonify through orjson, which serializes the numpy values in results natively and fast."""
+
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, default=self.default,
+                            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+def _gzipped_json(body: bytes, etag: str) -> Response:
+    """Pre-gzipped JSON, revalidated by the browser via ETag."""
+    resp = Response(mimetype="application/json")
+    if "gzip" in request.accept_encodings:
+        resp.set_data(body)
+        resp.headers["Content-Encoding"] = "gzip"
+    else:
+        resp.set_data(gzip.decompress(body))
+    resp.headers["Vary"] = "Accept-Encoding"
+    resp.headers["Cache-Control"] = "public, no-cache"
+    resp.set_etag(etag)
+    return resp.make_conditional(request)
+
+
+@api.get("/healthz")
+def healthz():
+    """Liveness: the server answers, whether or not the feed is loaded yet."""
+    return jsonify({"status": "ok"})
+
+
+@api.get("/readyz")
+def readyz():
+    """Readiness: 200 once a feed version is served, 503 while it is still being built."""
+    body = {"ready": registry.ready, "startup": startup.as_dict()}
+    if registry.ready:
+        version = registry.current()
+        body["feed"] = version.version
+        body["loaded_at"] = version.loaded_at
+    elif registry.error is not None:
+        body["error"] = repr(registry.error)
+    return jsonify(body), 200 if registry.ready else 503
+
+
+@api.get("/metrics")
+def prometheus_metrics():
+    """Latencies, cache and fetch counters and index gauges in the Prometheus text format."""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@api.get("/api/memory")
+def memory_report():
+    """Deep size of every table and index of the served feed version, measured once per version."""
+    if not registry.ready:
+        abort(503)
+    return jsonify(registry.memory_report())
+
+
+@api.get("/api/stations.json")
+def station_bundle():
+    """Station bundle for the client-side autocomplete, revalidated by the browser via ETag."""
+    version = registry.current()
+    return _gzipped_json(version.station_bundle, version.version)
+
+
+def _parse_time(value, tz: str) -> int:
+    """HH:MM or HH:MM:SS as seconds of the day, now if not given."""
+    if not value:
+        return seconds_of_day(tz=tz)
+    value = str(value)
+    sec = _parse_gtfs_time(value if value.count(":") == 2 else f"{value}:00")
+    if sec == float("inf"):
+        abort(400, f"Invalid time {value!r}, expected HH:MM or HH:MM:SS")
+    return int(sec)
+
+
+def _limit(args, default=10, maximum=100) -> int:
+    return min(max(int(args.get("limit", default)), 1), maximum)
+
+
+def _records(frame: pd.DataFrame, columns: list[str]) -> list[dict]:
+    frame = frame[[c for c in columns if c in frame.columns]]
+    return frame.astype(object).where(frame.notna(), None).to_dict("records")
+
+
+STOP_COLUMNS = ["stop_id", "stop_name", "stop_lat", "stop_lon", "parent_station", "location_type"]
+
+
+# Queries take the request parameters as a dict and return what the endpoint returns,
+# so /api/batch can run many of them on one feed version.
+
+def route_query(version, args) -> dict:
+    """Same journey and map data as the connection page."""
+    stop_from, stop_to = args.get("from", ""), args.get("to", "")
+    for stop_id in (stop_from, stop_to):
+        if stop_id not in version.raptor_index.stop_to_idx:
+            abort(404, f"Unknown stop {stop_id!r}")
+    after = _parse_time(args.get("time"), version.departures.timezone)
+    journey = slowlog.route(version, stop_from, stop_to,
+                            departure_time=f"{after // 3600:02d}:{after % 3600 // 60:02d}:{after % 60:02d}",
+                            realtime=realtime.latest().version)
+    result = {"from": stop_from, "to": stop_to, "time": after, "journey": None}
+    if journey is None:
+        return result
+    data = build_route_map_data(version.feed, journey)
+    disrupted = version.disruptions(realtime.snapshot()).annotate(data["stops"])
+    result["journey"] = journey.to_dict()
+    result["map"] = {
+        "segments": data["segments"],
+        "stops": _records(data["stops"], ["stop_id", "stop_name", "stop_lat", "stop_lon", "time"]),
+        "disruptions": _records(disrupted, ["stop_id", "disruption_text", "disruption_type", "disruption_effect"]),
+    }
+    return result
+
+
+def stations_query(version, args) -> dict:
+    """Station search like the server side autocomplete, best match first."""
+    query = args.get("q", "")
+    found = version.feed.gtfs_find_station(query, limit=_limit(args)) if query else pd.DataFrame()
+    return {"q": query, "stations": _records(found, STOP_COLUMNS + ["score"])}
+
+
+def related_query(version, args) -> dict:
+    """Platforms, siblings and transfer partners of a stop, like the stations page shows."""
+    stop_id = args.get("stop", "")
+    if stop_id not in version.feed.stop_graph.pos:
+        abort(404, f"Unknown stop {stop_id!r}")
+    return {"stop_id": stop_id, "stops": _records(version.feed.gtfs_find_related_stops(stop_id), STOP_COLUMNS)}
+
+
+def departures_query(version, args) -> dict:
+    """Next departures at a station: stop=<stop_id>, time=HH:MM[:SS] (default now), limit=N."""
+    board = version.departures
+    stop_id = args.get("stop", "")
+    if stop_id not in board.graph.pos:
+        abort(404, f"Unknown stop {stop_id!r}")
+    after = _parse_time(args.get("time"), board.timezone)
+    delays = version.delays(realtime.snapshot())
+    return {
+        "stop_id": stop_id,
+        "time": after,
+        "departures": board.departures(stop_id, after, _limit(args), delays),
+    }
+
+
+QUERIES = {
+    "route": route_query,
+    "stations": stations_query,
+    "related": related_query,
+    "departures": departures_query,
+}
+MAX_BATCH = 100
+
+
+def _run(query, version, args) -> dict:
+    try:
+        return query(version, args)
+    except (TypeError, ValueError) as e:
+        abort(400, str(e))
+
+
+@api.get("/api/<any(route, stations, related, departures):kind>")
+def single(kind):
+    version = registry.current()
+    return jsonify({"feed": version.version, **_run(QUERIES[kind], version, request.args)})
+
+
+@api.post("/api/batch")
+def batch():
+    """
+    Many queries in one request, all answered from the same feed version:
+    {"queries": [{"type": "route", "from": ..., "to": ..., "time": ...}, ...]}.
+    Every query gets its own status, one bad query doesn't fail the batch.
+    """
+    body = request.get_json(silent=True) or {}
+    queries = body.get("queries")
+    if not isinstance(queries, list):
+        abort(400, "Expected {\"queries\": [...]}")
+    if len(queries) > MAX_BATCH:
+        abort(413, f"At most {MAX_BATCH} queries per batch")
+    version = registry.current()
+    results = []
+    for q in queries:
+        query = QUERIES.get(q.get("type")) if isinstance(q, dict) else None
+        if query is None:
+            results.append({"status": 400, "error": f"Unknown query type, expected one of {sorted(QUERIES)}"})
+            continue
+        try:
+            results.append({"status": 200, "result": _run(query, version, q)})
+        except HTTPException as e:
+            results.append({"status": e.code, "error": e.description})
+    return jsonify({"feed": version.version, "results": results})
+
+
+@api.get("/api/figures/<name>")
+def figure(name):
+    """Cached figure JSON of a static map page, see FigureCache."""
+    version = registry.current()
+    try:
+        body, path = figures.get(version, name, request.args.to_dict())
+    except KeyError:
+        abort(404, f"No figure {name!r} for {request.args.to_dict()}")
+    except (TypeError, ValueError):
+        abort(400, f"Invalid parameters for figure {name!r}")
+    return _gzipped_json(body, f"{version.version}-{path.name}")
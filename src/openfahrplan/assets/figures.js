@@ -0,0 +1,19 @@
+// Static map figures come pre-serialized from /api/figures/..., the browser revalidates
+// them via ETag so a repeat view is a 304 instead of a rebuilt figure.
+(function () {
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        openfahrplan: Object.assign({}, (window.dash_clientside || {}).openfahrplan, {
+            loadFigure: function (url) {
+                if (!url) {
+                    return window.dash_clientside.no_update;
+                }
+                return fetch(url, {cache: "no-cache"}).then(r => {
+                    if (!r.ok) {
+                        throw new Error(`${url}: ${r.status}`);
+                    }
+                    return r.json();
+                });
+            },
+        }),
+    });
+})();
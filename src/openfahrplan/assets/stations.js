@@ -0,0 +1,218 @@
+// Client-side station autocomplete.
+// The station bundle is fetched once per page load (the browser revalidates it via ETag)
+// and keystrokes are matched locally instead of calling back into the server.
+(function () {
+    let bundlePromise = null;
+    // a keystroke is only matched once typing pauses, the latest one per dropdown
+    const DEBOUNCE_MS = 120;
+    const latest = new Map();
+
+    // normalize_name, the trigram and prefix shortlist and rapidfuzz's token_set_ratio as in
+    // openfahrplan/lib/search.py, so the dropdown matches like the server does
+    function normalize(s) {
+        s = s.toLowerCase().replace(/ß/g, "ss").normalize("NFKD").replace(/[^\x00-\x7f]/g, "");
+        s = s.replace(/[-_/.,]+/g, " ");
+        s = s.replace(/\bstr\b/g, "strasse");
+        return s.replace(/[\s\x1c-\x1f]+/g, " ").trim();
+    }
+
+    function trigrams(s) {
+        const grams = new Set();
+        for (const token of s.split(" ")) {
+            const padded = " " + token + " ";
+            for (let i = 0; i < padded.length - 2; i++) {
+                grams.add(padded.slice(i, i + 3));
+            }
+        }
+        return grams;
+    }
+
+    function round6(x) {
+        return Math.floor(x * 1e6 + 0.5) / 1e6;
+    }
+
+    function loadBundle() {
+        if (!bundlePromise) {
+            bundlePromise = fetch("/api/stations.json", {cache: "no-cache"})
+                .then(r => r.json())
+                .then(bundle => {
+                    const postings = new Map();
+                    bundle.norm.forEach((name, i) => {
+                        trigrams(name).forEach(g => {
+                            let list = postings.get(g);
+                            if (!list) postings.set(g, list = []);
+                            list.push(i);
+                        });
+                    });
+                    bundle.postings = postings;
+                    bundle.weights = new Map([...postings].map(([g, list]) =>
+                        [g, round6(Math.log1p(bundle.norm.length / list.length))]));
+                    bundle.nameWords = bundle.norm.map(sortedWords);
+                    const words = [];
+                    bundle.norm.forEach((name, i) => new Set(name.split(" ")).forEach(w => words.push([w, i])));
+                    words.sort((a, b) => (a[0] < b[0] ? -1 : a[0] > b[0] ? 1 : a[1] - b[1]));
+                    bundle.words = words.map(([w]) => w);
+                    bundle.wordPos = words.map(([, i]) => i);
+                    bundle.byId = new Map(bundle.ids.map((id, i) => [id, i]));
+                    return bundle;
+                })
+                .catch(err => {
+                    bundlePromise = null;
+                    throw err;
+                });
+        }
+        return bundlePromise;
+    }
+
+    function popcount(x) {
+        x -= (x >>> 1) & 0x55555555;
+        x = (x & 0x33333333) + ((x >>> 2) & 0x33333333);
+        return (((x + (x >>> 4)) & 0x0f0f0f0f) * 0x01010101) >>> 24;
+    }
+
+    function indelDistance(a, b) {
+        // len(a) + len(b) - 2 * longest common subsequence
+        if (a.length <= 32) {
+            // bit-parallel LCS (Hyyrö) like rapidfuzz, one machine word for a
+            const masks = new Map();
+            for (let i = 0; i < a.length; i++) masks.set(a[i], (masks.get(a[i]) | 0) | (1 << i));
+            let v = 0xffffffff;
+            for (let j = 0; j < b.length; j++) {
+                const u = v & (masks.get(b[j]) | 0);
+                v = ((v + (u >>> 0)) | (v - (u >>> 0))) >>> 0;
+            }
+            const used = a.length === 32 ? 0xffffffff : (1 << a.length) - 1;
+            return a.length + b.length - 2 * popcount(~v & used);
+        }
+        let prev = new Array(b.length + 1).fill(0);
+        for (let i = 0; i < a.length; i++) {
+            const row = [0];
+            for (let j = 0; j < b.length; j++) {
+                row.push(a[i] === b[j] ? prev[j] + 1 : Math.max(prev[j + 1], row[j]));
+            }
+            prev = row;
+        }
+        return a.length + b.length - 2 * prev[b.length];
+    }
+
+    function normDistance(dist, lensum) {
+        return lensum ? 100 - 100 * dist / lensum : 100;
+    }
+
+    function sortedWords(s) {
+        return [...new Set(s.split(" ").filter(Boolean))].sort();
+    }
+
+    function tokenSetRatio(a, b) {
+        // a and b are the sortedWords of both strings, merged like sorted sets
+        if (!a.length || !b.length) return 0;
+        const diffAB = [], diffBA = [];
+        let common = 0, sectLen = -1;
+        for (let i = 0, j = 0; i < a.length || j < b.length;) {
+            if (j === b.length || (i < a.length && a[i] < b[j])) {
+                diffAB.push(a[i++]);
+            } else if (i === a.length || b[j] < a[i]) {
+                diffBA.push(b[j++]);
+            } else {
+                common++;
+                sectLen += a[i++].length + 1;
+                j++;
+            }
+        }
+        if (common && (!diffAB.length || !diffBA.length)) return 100;
+        const ab = diffAB.join(" "), ba = diffBA.join(" ");
+        sectLen = Math.max(sectLen, 0);
+        const sep = sectLen ? 1 : 0;
+        const sectABLen = sectLen + sep + ab.length, sectBALen = sectLen + sep + ba.length;
+        const result = normDistance(indelDistance(ab, ba), sectABLen + sectBALen);
+        if (!sectLen) return result;
+        return Math.max(result, normDistance(sep + ab.length, sectLen + sectABLen),
+            normDistance(sep + ba.length, sectLen + sectBALen));
+    }
+
+    function lowerBound(words, w) {
+        let lo = 0, hi = words.length;
+        while (lo < hi) {
+            const mid = (lo + hi) >> 1;
+            if (words[mid] < w) lo = mid + 1; else hi = mid;
+        }
+        return lo;
+    }
+
+    function prefixed(bundle, q) {
+        const last = q.slice(q.lastIndexOf(" ") + 1);
+        if (!last) return [];
+        const lo = lowerBound(bundle.words, last), hi = lowerBound(bundle.words, last + "\x7f");
+        const cand = [...new Set(bundle.wordPos.slice(lo, hi))];
+        const len = i => bundle.norm[i].length;
+        return cand.sort((a, b) => len(a) - len(b) || a - b).slice(0, bundle.prefix);
+    }
+
+    function shortlist(bundle, q) {
+        const grams = [...trigrams(q)].filter(g => bundle.postings.has(g)).sort();
+        const pre = prefixed(bundle, q);
+        if (!grams.length && !pre.length) return bundle.norm.map((_, i) => i);
+        const counts = bundle.counts || (bundle.counts = new Float64Array(bundle.norm.length));
+        let cand = [];
+        for (const g of grams) {
+            const w = bundle.weights.get(g);
+            for (const i of bundle.postings.get(g)) {
+                if (!counts[i]) cand.push(i);
+                counts[i] += w;
+            }
+        }
+        if (cand.length > bundle.shortlist) {
+            cand = cand.sort((a, b) => counts[b] - counts[a] || a - b).slice(0, bundle.shortlist);
+        }
+        for (const g of grams) {
+            for (const i of bundle.postings.get(g)) counts[i] = 0;
+        }
+        return [...new Set([...cand, ...pre])];
+    }
+
+    function search(bundle, query, limit) {
+        const q = normalize(query);
+        if (!q) return [];
+        const words = sortedWords(q);
+        let scored = shortlist(bundle, q).map(i => [i, tokenSetRatio(words, bundle.nameWords[i])]);
+        if (scored.length < bundle.norm.length && Math.max(...scored.map(([, s]) => s)) < bundle.fallback_score) {
+            // nothing shortlisted is even close, a name outside the shortlist may be
+            scored = bundle.nameWords.map((nameWords, i) => [i, tokenSetRatio(words, nameWords)]);
+        }
+        return scored
+            .sort((a, b) => b[1] - a[1] || a[0] - b[0])
+            .slice(0, limit)
+            .map(([i]) => i);
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        openfahrplan: Object.assign({}, (window.dash_clientside || {}).openfahrplan, {
+            filterStations: function (searchValue, value) {
+                const noUpdate = window.dash_clientside.no_update;
+                if (!searchValue) {
+                    return noUpdate;
+                }
+                // the context is only set while this function runs
+                const context = window.dash_clientside.callback_context;
+                const dropdown = JSON.stringify(context ? context.triggered_id : null);
+                const keystroke = {};
+                latest.set(dropdown, keystroke);
+                return new Promise(resolve => setTimeout(resolve, DEBOUNCE_MS)).then(() => {
+                    if (latest.get(dropdown) !== keystroke) {
+                        return noUpdate;
+                    }
+                    latest.delete(dropdown);
+                    return loadBundle().then(bundle => {
+                            const hits = search(bundle, searchValue, 10);
+                        // keep the selected station selectable even if it doesn't match the search
+                        const selected = bundle.byId.get(value);
+                        if (selected !== undefined && !hits.includes(selected)) {
+                            hits.unshift(selected);
+                        }
+                        return hits.map(i => ({value: bundle.ids[i], label: bundle.names[i]}));
+                    });
+                });
+            },
+        }),
+    });
+})();
@@ -0,0 +1,197 @@
+import datetime as dt
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pandas as pd
+
+from openfahrplan.lib.raptor import _parse_gtfs_time
+
+DAY = 86400
+# GTFS times of one service day run past 24:00, keys leave room for that
+_KEY_STRIDE = 3 * DAY
+
+
+def _codes(values) -> tuple[np.ndarray, list]:
+    codes, uniques = pd.factorize(pd.Series(values), use_na_sentinel=True)
+    return codes.astype(np.int32), [None if pd.isna(u) else u for u in uniques]
+
+
+def format_gtfs_time(sec: int) -> str:
+    sec = int(sec) % DAY
+    return f"{sec // 3600:02d}:{sec % 3600 // 60:02d}"
+
+
+class DelayIndex:
+    """
+    Realtime departure delays of one snapshot, keyed by (stop position, scheduled second of the day).
+
+    gtfs.de trip ids don't match the local feed, so updates are matched on stop and
+    scheduled departure instead: the stop through the vgn_id <-> de_id mapping, the
+    scheduled time as realtime time minus delay in the feed's local time zone.
+    """
+
+    def __init__(self, trip_updates: pd.DataFrame, mapping: pd.DataFrame | None, stop_pos: dict, tz: str):
+        tu = trip_updates[["stop_id", "dep_time", "dep_delay", "arr_time", "arr_delay"]]
+        when = tu["dep_time"].where(tu["dep_time"].notna(), tu["arr_time"])
+        delay = tu["dep_delay"].where(tu["dep_delay"].notna(), tu["arr_delay"])
+        tu = pd.DataFrame({"de_id": tu["stop_id"].astype("string"), "when": when, "delay": delay}).dropna()
+        if mapping is not None:
+            tu = tu.merge(mapping, on="de_id", how="inner")
+            local = tu["vgn_id"]
+        else:
+            local = tu["de_id"]
+        pos = local.map(stop_pos)
+        tu = tu.assign(pos=pos).dropna(subset=["pos"])
+
+        scheduled = pd.to_datetime((tu["when"] - tu["delay"]).astype(np.int64), unit="s", utc=True).dt.tz_convert(ZoneInfo(tz))
+        sec = (scheduled.dt.hour * 3600 + scheduled.dt.minute * 60 + scheduled.dt.second).to_numpy(np.int64)
+        pos = tu["pos"].to_numpy(np.int64)
+        delay = tu["delay"].to_numpy(np.int64)
+        # early morning departures may belong to the previous service day (24:xx:xx)
+        early = sec < 6 * 3600
+        keys = np.concatenate([pos * _KEY_STRIDE + sec, pos[early] * _KEY_STRIDE + sec[early] + DAY])
+        delay = np.concatenate([delay, delay[early]])
+
+        self.keys, first = np.unique(keys, return_index=True)
+        self.delays = delay[first]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup(self, pos: np.ndarray, sec: np.ndarray) -> np.ndarray:
+        """Delay in seconds per (stop, scheduled time), NaN where there is no realtime data."""
+        out = np.full(len(pos), np.nan)
+        if len(self.keys) == 0:
+            return out
+        keys = np.asarray(pos, dtype=np.int64) * _KEY_STRIDE + np.asarray(sec, dtype=np.int64)
+        i = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        hit = self.keys[i] == keys
+        out[hit] = self.delays[i[hit]]
+        return out
+
+
+class DepartureBoard:
+    """
+    Scheduled departures per stop, precomputed once per feed version.
+
+    Departures are stored CSR-style: one array sorted by (stop, time) with
+    `offsets[pos]:offsets[pos + 1]` being the slice of the stop at row `pos` of the
+    stop graph. Lines and headsigns are integer codes into small lookup lists, so a
+    request is a few binary searches and list lookups without touching pandas.
+    Like the router, service calendars are ignored.
+
+    A station is the stop with its parent's platforms and the stops of the same name
+    within `same_name_radius` metres; many platforms only share a name, while names
+    like "Bahnhof" or "Rathaus" recur in other towns.
+    """
+
+    def __init__(self, feed, same_name_radius: float = 500.0):
+        self.graph = feed.stop_graph
+        self.same_name_radius = same_name_radius
+        stops = self.graph.stops
+        agency = getattr(feed, "agency", None)
+        self.timezone = agency["agency_timezone"].iloc[0] if agency is not None and not agency.empty else "Europe/Berlin"
+
+        st = feed.stop_times[["trip_id", "stop_id", "departure_time", "stop_sequence"]].copy()
+        st["dep"] = st["departure_time"].map(_parse_gtfs_time)
+        st = st[np.isfinite(st["dep"])]
+        # nobody departs from the last stop of a trip
+        last = st.groupby("trip_id")["stop_sequence"].transform("max")
+        st = st[st["stop_sequence"] != last]
+        st = st.assign(pos=st["stop_id"].map(self.graph.pos)).dropna(subset=["pos"])
+
+        trips = feed.trips[["trip_id", "route_id", "trip_headsign"]].merge(
+            feed.routes[["route_id", "route_short_name", "route_type"]], on="route_id", how="left")
+        trips = trips.drop_duplicates("trip_id").set_index("trip_id")
+        # without a headsign the last stop of the trip is the direction
+        terminus = (feed.stop_times.sort_values("stop_sequence").groupby("trip_id")["stop_id"].last()
+                    .map(stops.set_index("stop_id")["stop_name"]))
+        headsign = trips["trip_headsign"].where(trips["trip_headsign"].notna(), terminus.reindex(trips.index))
+
+        self.trip_ids = trips.index.astype(str).tolist()
+        trip_pos = pd.Series(np.arange(len(trips), dtype=np.int32), index=trips.index)
+        self.trip_line, self.lines = _codes(trips["route_short_name"])
+        self.trip_headsign, self.headsigns = _codes(headsign)
+        self.trip_route_type = trips["route_type"].fillna(-1).astype(np.int32).to_numpy()
+
+        pos = st["pos"].to_numpy(np.int64)
+        dep = st["dep"].to_numpy(np.int64)
+        trip = st["trip_id"].map(trip_pos).fillna(-1).to_numpy(np.int64)
+        pos, dep, trip = pos[trip >= 0], dep[trip >= 0], trip[trip >= 0]
+        order = np.lexsort((dep, pos))
+        self.dep = dep[order].astype(np.int32)
+        self.trip = trip[order].astype(np.int32)
+        self.stop = pos[order].astype(np.int32)
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(pos, minlength=len(stops)))]).astype(np.int64)
+        # one sorted key per departure, so all platforms of a station are searched in one call
+        self._keys = self.stop.astype(np.int64) * _KEY_STRIDE + self.dep
+        self._stop_ids = stops["stop_id"].tolist()
+        self._stop_names = stops["stop_name"].tolist()
+        self._lat = np.radians(stops["stop_lat"].to_numpy(np.float64))
+        self._lon = np.radians(stops["stop_lon"].to_numpy(np.float64))
+        self._stations = {}
+
+    def __len__(self):
+        return len(self.dep)
+
+    def station_positions(self, stop_id: str) -> np.ndarray:
+        """The stop, all platforms of its station and nearby stops with the same name."""
+        pos = self._stations.get(stop_id)
+        if pos is None:
+            same = self.graph.same_name(stop_id, include_self=True)
+            i = self.graph.pos.get(stop_id)
+            if i is not None and len(same):
+                # equirectangular distance, plenty for a few hundred metres
+                x = (self._lon[same] - self._lon[i]) * np.cos((self._lat[same] + self._lat[i]) / 2)
+                y = self._lat[same] - self._lat[i]
+                same = same[6_371_000 * np.hypot(x, y) <= self.same_name_radius]
+            pos = np.union1d(self.graph.siblings(stop_id, include_self=True), same).astype(np.int64)
+            self._stations[stop_id] = pos
+        return pos
+
+    def next(self, stop_id: str, after: int, limit: int = 10) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Rows (into the departure arrays) of the next `limit` departures at a station
+        from second `after` of the day on, plus the time shift of each row, ordered by
+        actual departure. Late trips of the previous service day and early trips of the
+        next one are included.
+        """
+        pos = self.station_positions(stop_id)
+        shifts = np.array([-DAY, 0, DAY], dtype=np.int64)
+        # first departure per (platform, shift), then up to `limit` rows from each
+        starts = np.searchsorted(self._keys, (pos[:, None] * _KEY_STRIDE + np.maximum(after - shifts, 0)).ravel())
+        ends = np.repeat(self.offsets[pos + 1], len(shifts))
+        rows = starts[:, None] + np.arange(limit)
+        valid = rows < ends[:, None]
+        shift = np.repeat(shifts[np.arange(len(starts)) % len(shifts)], valid.sum(axis=1))
+        rows = rows[valid]
+        order = np.lexsort((rows, self.dep[rows] + shift))[:limit]
+        return rows[order], shift[order]
+
+    def departures(self, stop_id: str, after: int, limit: int = 10, delays: DelayIndex | None = None) -> list[dict]:
+        rows, shifts = self.next(stop_id, after, limit)
+        sched = self.dep[rows]
+        delay = delays.lookup(self.stop[rows], sched) if delays is not None else np.full(len(rows), np.nan)
+        out = []
+        for r, s, sh, d in zip(rows.tolist(), sched.tolist(), shifts.tolist(), delay.tolist()):
+            t = self.trip[r]
+            line, headsign = self.trip_line[t], self.trip_headsign[t]
+            realtime = d == d
+            out.append({
+                "time": format_gtfs_time(s),
+                "seconds": s + sh,
+                "delay": int(d) if realtime else None,
+                "expected": format_gtfs_time(s + d) if realtime else None,
+                "line": self.lines[line] if line >= 0 else None,
+                "route_type": int(self.trip_route_type[t]),
+                "headsign": self.headsigns[headsign] if headsign >= 0 else None,
+                "trip_id": self.trip_ids[t],
+                "stop_id": self._stop_ids[self.stop[r]],
+                "stop_name": self._stop_names[self.stop[r]],
+            })
+        return out
+
+
+def seconds_of_day(when: dt.datetime | None = None, tz: str = "Europe/Berlin") -> int:
+    when = when or dt.datetime.now(ZoneInfo(tz))
+    return when.hour * 3600 + when.minute * 60 + when.second
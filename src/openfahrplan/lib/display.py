@@ -2,6 +2,8 @@
 import pandas as pd
 import math, re
 
+from openfahrplan.lib.metrics import route_map_seconds
+
 map_style = {
     "marker_size": 10,
     "marker_color":"#666666",
@@ -119,50 +121,23 @@ def location_type_label(row):
     if has_type and not has_parent:     return "Station"
     return "-1"
 
-def build_route_map_data(feed, res):
+@route_map_seconds.timed
+def build_route_map_data(feed, journey):
     """
-    Convert a RAPTOR result into structured map data.
+    Convert a RAPTOR journey into structured map data.
     Returns:
       {
         "segments": [ { "lat": [...], "lon": [...], "color": str, "name": str, "type": "trip"|"walk" } ],
         "stops": DataFrame with columns: stop_id, stop_name, stop_lat, stop_lon, time, hover
       }
     """
-    if not res or not res.get("legs"):
+    if not journey or not journey.legs:
         return {"segments": [], "stops": feed.stops.iloc[0:0].copy()}
 
-    _TIME = re.compile(r"^\d{1,2}:\d{2}:\d{2}$")
-    def _parse(t):
-        if t is None: return None
-        s = str(t)
-        if not _TIME.match(s): return None
-        h,m,x = map(int, s.split(":"))
-        return h*3600 + m*60 + x
     def _fmt(sec):
         if sec is None or math.isinf(sec): return None
         sec = int(sec); h = sec//3600; m = (sec%3600)//60; s = sec%60
         return f"{h:02d}:{m:02d}:{s:02d}"
-    def _leg_coords(trip_id, a, b):
-        g = (feed.stop_times.loc[feed.stop_times["trip_id"] == trip_id,
-        ["stop_id","stop_sequence","arrival_time","departure_time"]]
-             .sort_values("stop_sequence").reset_index(drop=True))
-        ia = g.index[g["stop_id"] == a]
-        ib = g.index[g["stop_id"] == b]
-        if len(ia)==0 or len(ib)==0:
-            return [], [], [], []
-        ia, ib = int(ia[0]), int(ib[-1])
-        seg = g.iloc[ia:ib+1].copy()
-        stop_ids = seg["stop_id"].tolist()
-        times = [None]*len(stop_ids)
-        if len(times) > 0:
-            times[0] = _parse(seg.iloc[0]["departure_time"]) or _parse(seg.iloc[0]["arrival_time"])
-            for i in range(1, len(times)):
-                times[i] = _parse(seg.iloc[i]["arrival_time"]) or _parse(seg.iloc[i]["departure_time"])
-        coords = seg.merge(
-            feed.stops[["stop_id","stop_lat","stop_lon"]].drop_duplicates("stop_id"),
-            on="stop_id", how="left"
-        )
-        return coords["stop_lat"].tolist(), coords["stop_lon"].tolist(), stop_ids, times
     def _dashed_segment(a_lat, a_lon, b_lat, b_lon, parts=10):
         lat=[]; lon=[]
         for i in range(parts):
@@ -172,26 +147,18 @@ def build_route_map_data(feed, res):
             lon += [a_lon + (b_lon-a_lon)*t0, a_lon + (b_lon-a_lon)*t1, None]
         return lat, lon
 
-    stops_idx = (feed.stops[["stop_id","stop_name","stop_lat","stop_lon"]]
-                 .drop_duplicates("stop_id").set_index("stop_id"))
+    geo = feed.trip_geometry
     stop_time_sec = {}
     segments = []
     grouped = []
     cur = None
 
-    for kind, x, a, b in res["legs"]:
-        if kind == "trip":
-            trip_id = x
-            route_id = feed.trips.loc[feed.trips["trip_id"] == trip_id, "route_id"].iloc[0]
-            route_row = feed.routes.loc[feed.routes["route_id"] == route_id].iloc[0]
-            route_name = (str(route_row.get("route_short_name"))
-                          if pd.notna(route_row.get("route_short_name"))
-                          else str(route_row.get("route_long_name")))
-            color = get_route_color(route_name)
-            lat, lon, stop_ids, times = _leg_coords(trip_id, a, b)
-            if not lat:
-                continue
-            for sid, t in zip(stop_ids, times):
+    for leg in journey.legs:
+        a, b = leg.from_stop, leg.to_stop
+        if leg.kind == "trip":
+            route_id, route_name, color = geo.route(leg.trip_id)
+            lat, lon = geo.coords_many(leg.stops)
+            for sid, t in zip(leg.stops, leg.times):
                 if t is not None and sid not in stop_time_sec:
                     stop_time_sec[sid] = t
             if cur and cur["route_id"] == route_id:
@@ -204,16 +171,16 @@ def build_route_map_data(feed, res):
                     grouped.append(cur)
                 cur = {"route_id": route_id, "name": route_name, "color": color,
                        "lat": lat[:], "lon": lon[:]}
-        elif kind == "walk":
+        elif leg.kind == "walk":
             if cur:
                 grouped.append(cur); cur = None
-            if a in stops_idx.index and b in stops_idx.index:
-                a_lat, a_lon = stops_idx.at[a,"stop_lat"], stops_idx.at[a,"stop_lon"]
-                b_lat, b_lon = stops_idx.at[b,"stop_lat"], stops_idx.at[b,"stop_lon"]
+            a_coords, b_coords = geo.coords(a), geo.coords(b)
+            if a_coords and b_coords:
+                (a_lat, a_lon), (b_lat, b_lon) = a_coords, b_coords
                 lat, lon = _dashed_segment(a_lat, a_lon, b_lat, b_lon, parts=12)
                 segments.append({"lat": lat, "lon": lon, "color": "#9E9E9E",
                                  "name": "Walk", "type": "walk"})
-            dur = int(x)
+            dur = leg.duration
             if a in stop_time_sec and b not in stop_time_sec:
                 stop_time_sec[b] = stop_time_sec[a] + dur
     if cur:
@@ -223,9 +190,9 @@ def build_route_map_data(feed, res):
         segments.append({"lat": g["lat"], "lon": g["lon"],
                          "color": g["color"], "name": g["name"], "type": "trip"})
 
-    path_ids = [sid for sid in res.get("stops", []) if sid in stops_idx.index]
-    sp = stops_idx.loc[path_ids].reset_index()
-    sp["time"] = sp["stop_id"].map(stop_time_sec).map(lambda v: _fmt(v) if pd.notna(v) else None)
-    sp["hover"] = sp.apply(lambda r: f"{r['stop_name']}<br>{r['time']}" if r["time"] else r["stop_name"], axis=1)
+    path = [geo.stop_pos[sid] for sid in journey.stops if sid in geo.stop_pos]
+    sp = geo.stops.iloc[path].reset_index()
+    sp["time"] = [_fmt(stop_time_sec.get(sid)) for sid in sp["stop_id"]]
+    sp["hover"] = [f"{n}<br>{t}" if t else n for n, t in zip(sp["stop_name"], sp["time"])]
 
     return {"segments": segments, "stops": sp}
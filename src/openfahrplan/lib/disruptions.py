@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+
+def _objects(values) -> np.ndarray:
+    # 1-d object array even if the values are lists of equal length
+    values = list(values)
+    out = np.empty(len(values), dtype=object)
+    for i, v in enumerate(values):
+        out[i] = v
+    return out
+
+
+class DisruptionIndex:
+    """
+    Alerts aggregated per local stop_id, built once per realtime snapshot.
+
+    Realtime alerts reference gtfs.de stop ids; they are translated to the ids of the
+    loaded feed through the preloaded vgn_id <-> de_id mapping. Checking stops for
+    disruptions is then a single index lookup instead of a groupby and two merges.
+    """
+
+    def __init__(self, alerts: pd.DataFrame, mapping: pd.DataFrame | None = None):
+        alerts = alerts[alerts["stop_id"].notna()]
+        if mapping is not None:
+            alerts = alerts.merge(mapping, left_on="stop_id", right_on="de_id", how="inner")
+            local = alerts["vgn_id"]
+        else:
+            local = alerts["stop_id"]
+
+        texts, causes, effects = {}, {}, {}
+        for sid, header, cause, effect in zip(local, alerts["header"], alerts["cause"], alerts["effect"]):
+            # dicts as ordered sets, headers keep the order they appear in the feed
+            if pd.notna(header):
+                texts.setdefault(sid, {})[header] = None
+            else:
+                texts.setdefault(sid, {})
+            causes.setdefault(sid, set()).add(int(cause))
+            effects.setdefault(sid, set()).add(int(effect))
+
+        self.stop_ids = pd.Index(list(texts), dtype="string")
+        self.text = _objects(" | ".join(texts[s]) for s in texts)
+        self.causes = _objects(sorted(causes[s]) for s in texts)
+        self.effects = _objects(sorted(effects[s]) for s in texts)
+
+    def __len__(self):
+        return len(self.stop_ids)
+
+    def __contains__(self, stop_id):
+        return stop_id in self.stop_ids
+
+    def lookup(self, stop_ids) -> np.ndarray:
+        """Position of each stop in the index, -1 for undisrupted stops."""
+        return self.stop_ids.get_indexer(pd.Index(stop_ids, dtype="string"))
+
+    def annotate(self, stops: pd.DataFrame) -> pd.DataFrame:
+        """The disrupted rows of `stops`, with disruption_text, disruption_type and disruption_effect added."""
+        pos = self.lookup(stops["stop_id"])
+        hit = pos >= 0
+        out = stops[hit].copy()
+        out["disruption_text"] = self.text[pos[hit]]
+        out["disruption_type"] = self.causes[pos[hit]]
+        out["disruption_effect"] = self.effects[pos[hit]]
+        return out
@@ -0,0 +1,102 @@
+import gzip
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Callable
+from urllib.parse import quote, urlencode
+
+from openfahrplan.lib.metrics import cache_requests
+
+
+class FigureCache:
+    """
+    Plotly figures that only depend on the feed version, serialized and gzipped once
+    and kept on disk under `<root>/<feed version>/`, so every worker of a pod shares
+    them and a repeat view is a file read.
+
+    Pages register a builder `build(version, **params) -> go.Figure` under a name, the
+    browser loads the figure from /api/figures/<name>?<params> (see assets/figures.js).
+    Builders raise KeyError for things that don't exist.
+
+    A version directory is dropped once it is neither `live` in this process nor
+    used by any worker for `max_age` seconds: every worker refreshes the mtime of
+    the directories it serves from at least every `max_age / 4`.
+    """
+
+    def __init__(self, root: Path, max_age: float = 3600.0, live: Callable[[], set] | None = None):
+        self.root = Path(root)
+        self.max_age = max_age
+        self.live = live
+        self.builders = {}
+        self._lock = threading.Lock()
+        # version -> monotonic time this process last marked its directory as used
+        self._used = {}
+
+    def register(self, name: str):
+        def decorator(build):
+            self.builders[name] = build
+            return build
+        return decorator
+
+    def url(self, name: str, **params) -> str:
+        query = urlencode(sorted((k, str(v)) for k, v in params.items()))
+        return f"/api/figures/{quote(name)}" + (f"?{query}" if query else "")
+
+    def path(self, version: str, name: str, params: dict) -> Path:
+        key = name + "?" + urlencode(sorted(params.items()))
+        return self.root / version / f"{quote(key, safe='')}.json.gz"
+
+    def get(self, version, name: str, params: dict | None = None) -> tuple[bytes, Path]:
+        """Gzipped figure JSON for a feed version, built on the first request."""
+        params = params or {}
+        if name not in self.builders:
+            raise KeyError(name)
+        path = self.path(version.version, name, params)
+        self._mark_used(path.parent)
+        try:
+            body = path.read_bytes()
+            cache_requests.inc("figures", "hit")
+            return body, path
+        except FileNotFoundError:
+            cache_requests.inc("figures", "miss")
+
+        body = gzip.compress(self.builders[name](version, **params).to_json().encode(), compresslevel=6)
+        new_version = not path.parent.exists()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # write to a temp file and rename, other workers never see half a figure
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(body)
+        os.replace(tmp, path)
+        if new_version:
+            self.prune()
+        return body, path
+
+    def _mark_used(self, folder: Path):
+        now = time.monotonic()
+        if now - self._used.get(folder.name, -self.max_age) < self.max_age / 4:
+            return
+        try:
+            os.utime(folder)
+        except FileNotFoundError:
+            return
+        self._used[folder.name] = now
+
+    def prune(self):
+        """Drop the figures of feed versions not live here and unused for `max_age` seconds."""
+        with self._lock:
+            live = self.live() if self.live is not None else set()
+            cutoff = time.time() - self.max_age
+            for d in self.root.iterdir():
+                try:
+                    if not d.is_dir() or d.name in live or d.stat().st_mtime >= cutoff:
+                        continue
+                except FileNotFoundError:
+                    continue
+                logging.info(f"Dropping cached figures of feed version {d.name}")
+                shutil.rmtree(d, ignore_errors=True)
+                self._used.pop(d.name, None)
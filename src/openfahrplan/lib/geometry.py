@@ -0,0 +1,45 @@
+import numpy as np
+
+from openfahrplan.lib.display import get_route_color
+
+
+class TripGeometry:
+    """
+    Stop coordinates and trip -> route -> name/colour lookups, precomputed once per
+    feed so drawing a journey doesn't filter the stops, trips and routes tables.
+    Stop sequences and times come with the journey legs themselves.
+    """
+
+    def __init__(self, feed):
+        self.stops = (feed.stops[["stop_id", "stop_name", "stop_lat", "stop_lon"]]
+                      .drop_duplicates("stop_id").set_index("stop_id"))
+        self.stop_pos = {sid: i for i, sid in enumerate(self.stops.index)}
+        self._lat = self.stops["stop_lat"].to_numpy(dtype=np.float64, na_value=np.nan).tolist()
+        self._lon = self.stops["stop_lon"].to_numpy(dtype=np.float64, na_value=np.nan).tolist()
+
+        routes = feed.routes.drop_duplicates("route_id").set_index("route_id")
+        names = routes["route_short_name"].where(routes["route_short_name"].notna(), routes["route_long_name"])
+        self.route_name = {rid: str(n) for rid, n in names.items()}
+        self.route_color = {rid: get_route_color(n) for rid, n in self.route_name.items()}
+        self.trip_route = dict(zip(feed.trips["trip_id"], feed.trips["route_id"]))
+
+    def __len__(self):
+        return len(self.trip_route)
+
+    def route(self, trip_id):
+        """(route_id, display name, colour) of a trip."""
+        route_id = self.trip_route[trip_id]
+        return route_id, self.route_name[route_id], self.route_color[route_id]
+
+    def coords(self, stop_id):
+        i = self.stop_pos.get(stop_id)
+        if i is None:
+            return None
+        return self._lat[i], self._lon[i]
+
+    def coords_many(self, stop_ids) -> tuple[list, list]:
+        """lat and lon lists, NaN for unknown stops."""
+        pos = [self.stop_pos.get(sid) for sid in stop_ids]
+        nan = float("nan")
+        return ([nan if i is None else self._lat[i] for i in pos],
+                [nan if i is None else self._lon[i] for i in pos])
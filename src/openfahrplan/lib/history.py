@@ -0,0 +1,207 @@
+import datetime as dt
+import logging
+import threading
+import uuid
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from openfahrplan.lib.realtime import ALERT_COLUMNS, TRIP_UPDATE_COLUMNS, RealtimeSnapshot
+
+KINDS = {
+    "alerts": ALERT_COLUMNS,
+    "trip_updates": TRIP_UPDATE_COLUMNS,
+}
+
+# every column is optional in GTFS-RT, so everything is nullable
+SCHEMAS = {
+    "alerts": pa.schema([
+        ("fetched_at", pa.timestamp("s", tz="UTC")),
+        ("feed_timestamp", pa.int64()),
+        ("entity_id", pa.string()),
+        ("stop_id", pa.string()),
+        ("route_id", pa.string()),
+        ("trip_id", pa.string()),
+        ("agency_id", pa.string()),
+        ("effect", pa.int32()),
+        ("cause", pa.int32()),
+        ("header", pa.string()),
+    ]),
+    "trip_updates": pa.schema([
+        ("fetched_at", pa.timestamp("s", tz="UTC")),
+        ("feed_timestamp", pa.int64()),
+        ("entity_id", pa.string()),
+        ("trip_id", pa.string()),
+        ("route_id", pa.string()),
+        ("timestamp", pa.int64()),
+        ("stop_id", pa.string()),
+        ("seq", pa.int64()),
+        ("arr_time", pa.int64()),
+        ("dep_time", pa.int64()),
+        ("schedule_rel", pa.int32()),
+        ("arr_delay", pa.int64()),
+        ("dep_delay", pa.int64()),
+    ]),
+}
+
+# columns that change on every fetch while the row says the same
+VOLATILE = {
+    "alerts": [],
+    "trip_updates": ["timestamp"],
+}
+
+PARTITIONING = ds.partitioning(pa.schema([("date", pa.string())]), flavor="hive")
+
+
+def _day(ts: float) -> str:
+    return dt.datetime.fromtimestamp(ts, dt.UTC).strftime("%Y-%m-%d")
+
+
+def _to_utc(value) -> pd.Timestamp:
+    ts = pd.Timestamp(value)
+    return ts.tz_localize("UTC") if ts.tzinfo is None else ts.tz_convert("UTC")
+
+
+class RealtimeHistory:
+    """
+    Append-only archive of realtime snapshots as parquet, one directory per kind and
+    one hive partition per UTC day:
+
+        <root>/alerts/date=2025-10-09/<fetched_at>-<id>.parquet
+        <root>/trip_updates/date=2025-10-09/...
+
+    Rows that are identical to the previous snapshot (ignoring the timestamps) are
+    not written again, so a row means "first seen at fetched_at" and an alert that
+    stays active for a day costs one row instead of 1440. After a restart the first
+    snapshot is written in full.
+
+    Files are sorted by stop_id and route_id, so parquet row-group statistics let
+    per-stop and per-route queries skip most of a file. `compact` merges the many
+    small files of a finished day into one. With `auto_compact`, the first snapshot
+    of a day compacts the days before it in a background thread.
+    """
+
+    def __init__(self, root: Path, row_group_size: int = 64_000, compression: str = "zstd",
+                 auto_compact: bool = True):
+        self.root = Path(root)
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.auto_compact = auto_compact
+        self._seen = {kind: None for kind in KINDS}
+        self._day = None
+        self._compactor = None
+        self._lock = threading.Lock()
+
+    def append(self, snapshot: RealtimeSnapshot) -> dict[str, int]:
+        """Write the rows of `snapshot` that changed since the previous one. Returns rows written per kind."""
+        written = {}
+        with self._lock:
+            for kind, columns in KINDS.items():
+                df = getattr(snapshot, kind)[columns]
+                key = df.drop(columns=VOLATILE[kind])
+                hashes = pd.util.hash_pandas_object(key.astype("string"), index=False).to_numpy()
+                seen = self._seen[kind]
+                new = df if seen is None else df[~pd.Series(hashes).isin(seen).to_numpy()]
+                self._seen[kind] = set(hashes.tolist())
+                if not new.empty:
+                    self._write(kind, new, snapshot)
+                written[kind] = len(new)
+        day = _day(snapshot.fetched_at)
+        if self.auto_compact and day != self._day:
+            # nothing is written to the days before this one anymore
+            self._day = day
+            self._compactor = threading.Thread(target=self._compact_before, args=(day,), name="history-compact",
+                                               daemon=True)
+            self._compactor.start()
+        return written
+
+    def _compact_before(self, day: str):
+        try:
+            self.compact_finished(before=day)
+        except Exception:
+            logging.exception(f"Compacting the realtime history before {day} failed")
+
+    def _write(self, kind: str, df: pd.DataFrame, snapshot: RealtimeSnapshot):
+        df = df.assign(fetched_at=pd.Timestamp(int(snapshot.fetched_at), unit="s", tz="UTC"),
+                       feed_timestamp=snapshot.feed_timestamp)
+        df = df.sort_values(["stop_id", "route_id"], na_position="last")
+        table = pa.Table.from_pandas(df, schema=SCHEMAS[kind], preserve_index=False)
+        folder = self.root / kind / f"date={_day(snapshot.fetched_at)}"
+        folder.mkdir(parents=True, exist_ok=True)
+        name = f"{int(snapshot.fetched_at)}-{uuid.uuid4().hex[:8]}.parquet"
+        # write next to the target and rename, readers never see half a file
+        tmp = folder / f".{name}.tmp"
+        pq.write_table(table, tmp, row_group_size=self.row_group_size, compression=self.compression)
+        tmp.rename(folder / name)
+
+    def days(self, kind: str = "alerts") -> list[str]:
+        folder = self.root / kind
+        if not folder.exists():
+            return []
+        return sorted(p.name.removeprefix("date=") for p in folder.glob("date=*") if p.is_dir())
+
+    def query(self, kind: str, start=None, end=None, stop_ids=None, route_ids=None,
+              columns: list[str] | None = None) -> pd.DataFrame:
+        """
+        Rows of `kind` first seen in [start, end), optionally only for some stops or routes.
+        The day partitions outside the range are never opened.
+        """
+        folder = self.root / kind
+        schema = SCHEMAS[kind]
+        if not folder.exists() or not any(folder.glob("date=*/*.parquet")):
+            return schema.empty_table().to_pandas()
+
+        dataset = ds.dataset(folder, format="parquet", partitioning=PARTITIONING,
+                             schema=schema.append(pa.field("date", pa.string())))
+        cond = None
+
+        def add(c):
+            nonlocal cond
+            cond = c if cond is None else cond & c
+
+        if start is not None:
+            start = _to_utc(start)
+            add(ds.field("date") >= start.strftime("%Y-%m-%d"))
+            add(ds.field("fetched_at") >= pa.scalar(start.to_pydatetime(), pa.timestamp("s", tz="UTC")))
+        if end is not None:
+            end = _to_utc(end)
+            add(ds.field("date") <= end.strftime("%Y-%m-%d"))
+            add(ds.field("fetched_at") < pa.scalar(end.to_pydatetime(), pa.timestamp("s", tz="UTC")))
+        if stop_ids is not None:
+            add(ds.field("stop_id").isin(list(stop_ids)))
+        if route_ids is not None:
+            add(ds.field("route_id").isin(list(route_ids)))
+
+        df = dataset.to_table(columns=columns or schema.names, filter=cond).to_pandas()
+        if "fetched_at" in df:
+            df = df.sort_values("fetched_at", kind="stable").reset_index(drop=True)
+        return df
+
+    def compact(self, kind: str, day: str) -> Path | None:
+        """Merge all files of one day into a single sorted file. Only call this for finished days."""
+        folder = self.root / kind / f"date={day}"
+        files = sorted(folder.glob("*.parquet"))
+        if len(files) < 2:
+            return None
+        with self._lock:
+            table = pq.read_table(files, schema=SCHEMAS[kind])
+            table = table.sort_by([("stop_id", "ascending"), ("route_id", "ascending"), ("fetched_at", "ascending")])
+            target = folder / f"compacted-{uuid.uuid4().hex[:8]}.parquet"
+            tmp = folder / f".{target.name}.tmp"
+            pq.write_table(table, tmp, row_group_size=self.row_group_size, compression=self.compression)
+            tmp.rename(target)
+            for f in files:
+                f.unlink()
+        logging.info(f"Compacted {len(files)} {kind} files of {day} into {target.name}")
+        return target
+
+    def compact_finished(self, before: str | None = None):
+        """Compact every day before `before` (YYYY-MM-DD), by default before today (UTC)."""
+        before = before or _day(dt.datetime.now(dt.UTC).timestamp())
+        for kind in KINDS:
+            for day in self.days(kind):
+                if day < before:
+                    self.compact(kind, day)
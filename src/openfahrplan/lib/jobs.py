@@ -0,0 +1,244 @@
+import importlib
+import logging
+import os
+import sys
+import threading
+import uuid
+from pathlib import Path
+from typing import Callable
+
+import diskcache
+import multiprocess
+import psutil
+from dash import DiskcacheManager
+from dash.background_callback.managers import BaseBackgroundCallbackManager
+from dash.background_callback.managers.diskcache_manager import _make_job_fn
+
+from openfahrplan.lib.metrics import MetricsRegistry
+
+# job states in the cache, under the job id; a running job has its worker's pid there
+_QUEUED = "queued"
+_CANCELLED = "cancelled"
+
+# the registry a worker reports its jobs' observations from, set by _init_worker
+_worker_metrics = None
+
+
+def _global_name(obj) -> str:
+    """`module:attribute` of a module level object, how a spawned worker finds its own copy of it."""
+    for module_name, module in list(sys.modules.items()):
+        if module_name in ("__main__", "__mp_main__"):
+            continue
+        for name, value in list(getattr(module, "__dict__", {}).items()):
+            if value is obj:
+                return f"{module_name}:{name}"
+    raise ValueError(f"{obj!r} is not a module attribute")
+
+
+def _init_worker(ready, warm_up, metrics: str | None, app: str | None):
+    global _worker_metrics
+    if app is not None:
+        # registers the app's background callbacks in this process
+        importlib.import_module(app)
+    if metrics is not None:
+        module, name = metrics.split(":")
+        _worker_metrics = getattr(importlib.import_module(module), name)
+    if warm_up is not None:
+        try:
+            warm_up()
+        except Exception:
+            # the jobs report it, e.g. a feed that doesn't load
+            logging.exception("Warming up the job worker failed")
+    with ready.get_lock():
+        ready.value += 1
+
+
+class _Job:
+    """
+    A background callback as sent to a worker. Callbacks dash registered are sent by
+    their key and looked up among the ones the worker's own import of the app registered.
+    """
+
+    def __init__(self, fn, progress: bool, key: str | None, cache: diskcache.Cache):
+        self.fn = None if key else fn
+        self.key = key
+        self.progress = progress
+        self.cache = cache
+
+    def __call__(self, result_key, progress_key, args, context):
+        fn = self.fn
+        if fn is None:
+            fn = next(f for key, f, _ in BaseBackgroundCallbackManager.functions if key == self.key)
+        _make_job_fn(fn, self.cache, self.progress)(result_key, progress_key, args, context)
+
+
+def _run(job: _Job, job_id: str, result_key, progress_key, args, context):
+    cache = job.cache
+    with cache.transact():
+        if cache.get(job_id) != _QUEUED:
+            # cancelled before it started
+            cache.delete(job_id)
+            return
+        cache.set(job_id, os.getpid())
+    before = _worker_metrics.state() if _worker_metrics is not None else None
+    try:
+        job(result_key, progress_key, args, context)
+    finally:
+        if _worker_metrics is not None:
+            cache.push(_worker_metrics.diff(before), prefix="metrics")
+        with cache.transact():
+            if cache.get(job_id) == _CANCELLED:
+                cache.delete(result_key)
+                cache.delete(progress_key)
+            cache.delete(job_id)
+
+
+class _Pool:
+    """The worker processes of one feed version."""
+
+    def __init__(self, context, workers: int, version: str | None, warm_up, metrics: str | None, app: str | None):
+        self.version = version
+        self._ready = context.Value("i", 0)
+        self.pool = context.Pool(workers, initializer=_init_worker, initargs=(self._ready, warm_up, metrics, app))
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.value > 0
+
+    def retire(self):
+        # the workers exit once the jobs already queued are done
+        self.pool.close()
+        threading.Thread(target=self.pool.join, name="job-pool-retire", daemon=True).start()
+
+
+class WorkerPoolManager(DiskcacheManager):
+    """
+    Dash background callbacks in a pool of `workers` long-lived processes.
+
+    The workers are spawned, not forked from the threaded web server, so they don't
+    inherit locks other server threads held at the time. Each imports the app, which
+    registers the callbacks, and runs `warm_up` (e.g. loading the feed) before it takes
+    jobs, at the price of a copy of the feed per worker.
+
+    When `version()` reports another feed version, a new pool is started next to the
+    old one. The old one keeps taking jobs until a new worker is warm, then exits after
+    its queued jobs.
+
+    Cancelling a job (new inputs, "Abbrechen") drops it if it hasn't started. A running
+    job finishes and its result is discarded: killing the worker would cost its
+    replacement a feed load. Results and progress go through a diskcache on local disk,
+    and so do the observations a job made on `metrics`, which are merged into the
+    server's registry when it is scraped.
+    """
+
+    def __init__(self, folder: Path, workers: int = 2, expire: int = 300, metrics: MetricsRegistry | None = None,
+                 version: Callable[[], str | None] | None = None, warm_up: Callable[[], None] | None = None):
+        self.workers = workers
+        self.metrics = metrics
+        self.version = version
+        self.warm_up = warm_up
+        self._metrics_name = _global_name(metrics) if metrics is not None else None
+        self._context = multiprocess.get_context("spawn")
+        self._lock = threading.Lock()
+        self._pool = None
+        self._next = None
+        super().__init__(diskcache.Cache(str(folder)), expire=expire)
+        if metrics is not None:
+            metrics.add_source(self._pull_metrics)
+
+    def start(self):
+        """Start the workers now instead of with the first job."""
+        self._current_pool()
+
+    @property
+    def ready(self) -> bool:
+        """True once a worker is warm and takes jobs."""
+        pool = self._pool
+        return pool is not None and pool.ready
+
+    def shutdown(self):
+        """Stop all workers, running jobs included."""
+        with self._lock:
+            for pool in (self._pool, self._next):
+                if pool is not None:
+                    pool.pool.terminate()
+            self._pool = self._next = None
+
+    def _start_pool(self, version: str | None) -> _Pool:
+        return _Pool(self._context, self.workers, version, self.warm_up, self._metrics_name, self._app_module())
+
+    def _app_module(self) -> str | None:
+        """The module holding this manager, and so the app. An app run as __main__ is imported by spawn itself."""
+        try:
+            return _global_name(self).split(":")[0]
+        except ValueError:
+            return None
+
+    def _current_pool(self) -> _Pool:
+        version = self.version() if self.version is not None else None
+        with self._lock:
+            if self._pool is None:
+                self._pool = self._start_pool(version)
+            elif self._pool.version is None:
+                # started before the server had a version, the workers load the same one
+                self._pool.version = version
+            elif version is not None and version != self._pool.version:
+                if self._next is None or self._next.version != version:
+                    if self._next is not None:
+                        self._next.retire()
+                    logging.info(f"Starting job workers for feed version {version}")
+                    self._next = self._start_pool(version)
+            elif self._next is not None:
+                # swapped back before the new workers were warm
+                self._next.retire()
+                self._next = None
+            if self._next is not None and self._next.ready:
+                logging.info(f"Job workers of feed version {self._pool.version} retire")
+                self._pool.retire()
+                self._pool, self._next = self._next, None
+            return self._pool
+
+    def make_job_fn(self, fn, progress, key=None):
+        return _Job(fn, progress, key, self.handle)
+
+    def call_job_fn(self, key, job_fn, args, context):
+        job_id = f"job-{uuid.uuid4().hex}"
+        self.handle.set(job_id, _QUEUED)
+        self._current_pool().pool.apply_async(
+            _run, (job_fn, job_id, key, self._make_progress_key(key), args, context),
+            error_callback=lambda e: self._failed(job_id, e))
+        logging.debug(f"Queued background job {job_id} for {key}")
+        return job_id
+
+    def _failed(self, job_id, error):
+        # the job never reached a worker, e.g. arguments that don't pickle
+        logging.error(f"Background job {job_id} failed: {error!r}")
+        self.handle.delete(job_id)
+
+    def _pull_metrics(self):
+        while True:
+            key, diff = self.handle.pull(prefix="metrics")
+            if key is None:
+                return
+            yield diff
+
+    def job_running(self, job):
+        state = self.handle.get(job) if job else None
+        if isinstance(state, int):
+            return psutil.pid_exists(state)
+        return state == _QUEUED
+
+    def terminate_job(self, job):
+        if not job:
+            return
+        with self.handle.transact():
+            if self.handle.get(job) is not None:
+                self.handle.set(job, _CANCELLED)
+
+    def terminate_unhealthy_job(self, job):
+        # a worker that died during a job leaves its pid behind
+        state = self.handle.get(job) if job else None
+        if isinstance(state, int) and not psutil.pid_exists(state):
+            self.handle.delete(job)
+            return True
+        return False
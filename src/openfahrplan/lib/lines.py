@@ -0,0 +1,121 @@
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+from openfahrplan.lib.raptor import _parse_gtfs_time
+
+
+class LinePattern:
+    """
+    One distinct stop sequence of a line in one direction, with the trips that follow
+    it ordered by departure. `dep` and `arr` are trips x stops matrices of seconds
+    since midnight of the service day, -1 where a time is missing.
+    """
+
+    __slots__ = ("line", "direction_id", "stop_ids", "stop_names", "lat", "lon", "trip_ids", "dep", "arr")
+
+    def __init__(self, line, direction_id, stop_ids, stop_names, lat, lon, trip_ids, dep, arr):
+        self.line = line
+        self.direction_id = direction_id
+        self.stop_ids = stop_ids
+        self.stop_names = stop_names
+        self.lat = lat
+        self.lon = lon
+        self.trip_ids = trip_ids
+        self.dep = dep
+        self.arr = arr
+
+    def __len__(self):
+        return len(self.trip_ids)
+
+    @property
+    def headsign(self) -> str:
+        return self.stop_names[-1]
+
+    def __repr__(self):
+        return f"<LinePattern {self.line} dir={self.direction_id} {self.stop_names[0]} -> {self.headsign} trips={len(self)}>"
+
+
+class LineIndex:
+    """
+    Stop patterns of every line by route_short_name and direction, built once per feed.
+
+    Replaces querying the merged stops x stop_times x trips x routes frame on every
+    line page view: a page only picks its patterns and reads arrays.
+    """
+
+    def __init__(self, feed):
+        stops = feed.stops.drop_duplicates("stop_id").set_index("stop_id")
+        trips = (feed.trips[["trip_id", "route_id", "direction_id"]]
+                 .merge(feed.routes[["route_id", "route_short_name"]], on="route_id")
+                 .drop_duplicates("trip_id"))
+        st = feed.stop_times[["trip_id", "stop_id", "stop_sequence", "arrival_time", "departure_time"]]
+        st = st[st["stop_id"].isin(stops.index)].merge(trips, on="trip_id")
+        st = st.sort_values(["route_short_name", "direction_id", "trip_id", "stop_sequence"], kind="stable")
+
+        stop_code = stops.index.get_indexer(st["stop_id"]).astype(np.int32)
+        dep = np.fromiter((_parse_gtfs_time(t) for t in st["departure_time"]), dtype=np.float64, count=len(st))
+        arr = np.fromiter((_parse_gtfs_time(t) for t in st["arrival_time"]), dtype=np.float64, count=len(st))
+        dep = np.where(np.isfinite(dep), dep, -1).astype(np.int32)
+        arr = np.where(np.isfinite(arr), arr, -1).astype(np.int32)
+
+        trip_ids = st["trip_id"].to_numpy()
+        starts = np.flatnonzero(np.r_[True, trip_ids[1:] != trip_ids[:-1]]) if len(st) else np.empty(0, dtype=np.int64)
+        ends = np.r_[starts[1:], len(st)]
+        lines = st["route_short_name"].to_numpy()[starts]
+        # a missing direction_id is direction None, NaN keys would never group
+        directions = [None if pd.isna(d) else int(d) for d in st["direction_id"].to_numpy()[starts]]
+
+        # (line, direction) -> pattern stop codes -> trip rows
+        groups = defaultdict(dict)
+        for i, (a, b) in enumerate(zip(starts, ends)):
+            key = stop_code[a:b].tobytes()
+            groups[(lines[i], directions[i])].setdefault(key, []).append(i)
+
+        names = stops["stop_name"].to_numpy(dtype=object)
+        lat = stops["stop_lat"].to_numpy(dtype=np.float64, na_value=np.nan)
+        lon = stops["stop_lon"].to_numpy(dtype=np.float64, na_value=np.nan)
+        stop_ids = stops.index.to_numpy(dtype=object)
+
+        self._patterns = defaultdict(dict)
+        for (line, direction), patterns in groups.items():
+            built = []
+            for rows in patterns.values():
+                a0, b0 = starts[rows[0]], ends[rows[0]]
+                codes = stop_code[a0:b0]
+                dep_m = np.stack([dep[starts[r]:ends[r]] for r in rows])
+                arr_m = np.stack([arr[starts[r]:ends[r]] for r in rows])
+                first = np.where(dep_m >= 0, dep_m, np.iinfo(np.int32).max).min(axis=1)
+                order = np.argsort(first, kind="stable")
+                built.append((first[order[0]], LinePattern(
+                    line, direction,
+                    stop_ids[codes].tolist(), names[codes].tolist(), lat[codes], lon[codes],
+                    [str(trip_ids[starts[rows[k]]]) for k in order], dep_m[order], arr_m[order],
+                )))
+            built.sort(key=lambda x: x[0])
+            self._patterns[line][direction] = [p for _, p in built]
+
+    def __contains__(self, line):
+        return line in self._patterns
+
+    def lines(self) -> list:
+        return list(self._patterns)
+
+    def directions(self, line) -> list:
+        return sorted(self._patterns.get(line, {}), key=lambda d: -1 if d is None else d)
+
+    def patterns(self, line, direction=None) -> list[LinePattern]:
+        """Patterns of a line ordered by first departure, of one or all directions."""
+        by_direction = self._patterns.get(line, {})
+        if direction is not None:
+            return by_direction.get(direction, [])
+        return [p for d in self.directions(line) for p in by_direction[d]]
+
+    def stops(self, line, direction=None) -> pd.DataFrame:
+        """Every stop served by a line, once, with stop_id, stop_name, stop_lat and stop_lon."""
+        seen = {}
+        for p in self.patterns(line, direction):
+            for sid, name, la, lo in zip(p.stop_ids, p.stop_names, p.lat.tolist(), p.lon.tolist()):
+                seen.setdefault(sid, (sid, name, la, lo))
+        return pd.DataFrame(list(seen.values()), columns=["stop_id", "stop_name", "stop_lat", "stop_lon"])
@@ -0,0 +1,411 @@
+"""
+Load test the running app with realistic user sessions, sent through the same HTTP
+endpoints the browser uses: page loads, Dash callbacks (background ones polled
+until done), the station bundle and cached figures.
+
+    python -m openfahrplan.lib.loadtest http://localhost:8050 --users 20 --duration 120
+    python -m openfahrplan.lib.loadtest --recordings data/recordings --users 20 --json run.json
+
+Without a URL a local instance is started on --port, with its realtime feed served
+from the recordings by a ReplayServer (see openfahrplan.lib.replay).
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from urllib.parse import quote, unquote
+
+import numpy as np
+import requests
+
+from openfahrplan.lib.replay import ReplayServer
+
+
+class RequestFailed(Exception):
+    pass
+
+
+class Stats:
+    """Latencies and errors per request name, shared by all simulated users."""
+
+    def __init__(self):
+        self._latencies = defaultdict(list)
+        self._errors = defaultdict(lambda: defaultdict(int))
+        self._sessions = defaultdict(lambda: {"completed": 0, "failed": 0})
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def record(self, name: str, seconds: float, error: str | None = None):
+        with self._lock:
+            self._latencies[name].append(seconds)
+            if error is not None:
+                self._errors[name][error] += 1
+
+    def session(self, kind: str, ok: bool):
+        with self._lock:
+            self._sessions[kind]["completed" if ok else "failed"] += 1
+
+    def summary(self) -> dict:
+        duration = (self.finished or time.perf_counter()) - self.started
+        with self._lock:
+            latencies = {name: np.array(v) for name, v in self._latencies.items()}
+            errors = {name: dict(e) for name, e in self._errors.items()}
+            sessions = {kind: dict(s) for kind, s in self._sessions.items()}
+        endpoints = {}
+        for name, lat in sorted(latencies.items()):
+            failed = sum(errors.get(name, {}).values())
+            p50, p90, p95, p99 = np.percentile(lat, [50, 90, 95, 99]).tolist()
+            endpoints[name] = {"count": len(lat), "rps": len(lat) / duration, "errors": errors.get(name, {}),
+                               "error_rate": failed / len(lat), "mean": float(lat.mean()),
+                               "p50": p50, "p90": p90, "p95": p95, "p99": p99, "max": float(lat.max())}
+        total = sum(e["count"] for e in endpoints.values())
+        failed = sum(sum(e["errors"].values()) for e in endpoints.values())
+        return {"duration": duration, "requests": total, "rps": total / duration if duration else 0.0,
+                "errors": failed, "error_rate": failed / total if total else 0.0,
+                "sessions": sessions, "endpoints": endpoints}
+
+
+def _stringify_id(id) -> str:
+    # like dash-renderer: pattern-matching ids are JSON with sorted keys
+    return json.dumps(id, sort_keys=True, separators=(",", ":")) if isinstance(id, dict) else id
+
+
+def _find(tree, id) -> dict | None:
+    """Props of the component with `id` in a serialized layout."""
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, dict):
+            props = node.get("props")
+            if isinstance(props, dict):
+                if props.get("id") == id:
+                    return props
+                stack.extend(props.values())
+    return None
+
+
+def _links(tree, prefix: str) -> list[str]:
+    found = []
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, dict) and isinstance(node.get("props"), dict):
+            href = node["props"].get("href")
+            if isinstance(href, str) and href.startswith(prefix):
+                found.append(href)
+            stack.extend(node["props"].values())
+    return found
+
+
+class DashClient:
+    """
+    One simulated browser tab: a keep-alive session with its own ETag cache, sending
+    requests the way dash-renderer does. Every request is timed into `stats`, a
+    failed one raises RequestFailed and ends the session.
+    """
+
+    def __init__(self, base_url: str, stats: Stats, timeout: float = 30.0, poll_interval: float = 0.25):
+        self.base_url = base_url.rstrip("/")
+        self.stats = stats
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._session = requests.Session()
+        self._etags = {}
+
+    def _request(self, name: str, method: str, path: str, **kwargs) -> requests.Response:
+        start = time.perf_counter()
+        try:
+            r = self._session.request(method, self.base_url + path, timeout=self.timeout, **kwargs)
+        except requests.RequestException as e:
+            self.stats.record(name, time.perf_counter() - start, type(e).__name__)
+            raise RequestFailed(f"{name}: {e!r}") from e
+        seconds = time.perf_counter() - start
+        if r.status_code >= 400:
+            self.stats.record(name, seconds, f"HTTP {r.status_code}")
+            raise RequestFailed(f"{name}: HTTP {r.status_code}")
+        self.stats.record(name, seconds)
+        return r
+
+    def get(self, name: str, path: str, revalidate: bool = False) -> requests.Response:
+        """GET, with If-None-Match for resources the browser keeps and revalidates."""
+        headers = {"If-None-Match": self._etags[path]} if revalidate and path in self._etags else {}
+        r = self._request(name, "GET", path, headers=headers)
+        if revalidate and "ETag" in r.headers:
+            self._etags[path] = r.headers["ETag"]
+        return r
+
+    def callback(self, name: str, outputs: list[tuple], inputs: list[tuple], state: list[tuple] = (),
+                 changed: list[tuple] | None = None) -> dict:
+        """
+        POST to /_dash-update-component. Outputs are (id, property), inputs and state
+        (id, property, value); all inputs count as changed unless given. Background
+        callbacks are polled until they finish, timed as one request. Returns the
+        response dict, empty if the callback prevented the update.
+        """
+        outs = [{"id": i, "property": p} for i, p in outputs]
+        keys = [f"{_stringify_id(i)}.{p}" for i, p in outputs]
+        payload = {
+            "output": keys[0] if len(keys) == 1 else ".." + "...".join(keys) + "..",
+            "outputs": outs[0] if len(outs) == 1 else outs,
+            "inputs": [{"id": i, "property": p, "value": v} for i, p, v in inputs],
+            "state": [{"id": i, "property": p, "value": v} for i, p, v in state],
+            "changedPropIds": [f"{_stringify_id(i)}.{p}" for i, p, *_ in (changed or inputs)],
+        }
+        start = time.perf_counter()
+        r = self._request(f"callback {name}", "POST", "/_dash-update-component", json=payload)
+        body = r.json() if r.status_code == 200 else {}
+        if "cacheKey" not in body:
+            return body
+        # background callback: the job runs in a worker, poll like the renderer does
+        query = f"?cacheKey={body['cacheKey']}&job={body['job']}"
+        while True:
+            if time.perf_counter() - start > self.timeout:
+                self.stats.record(f"job {name}", time.perf_counter() - start, "Timeout")
+                raise RequestFailed(f"job {name}: timed out")
+            time.sleep(self.poll_interval)
+            r = self._request(f"poll {name}", "POST", "/_dash-update-component" + query, json=payload)
+            body = r.json() if r.status_code == 200 else {}
+            if r.status_code != 200 or "response" in body:
+                self.stats.record(f"job {name}", time.perf_counter() - start)
+                return body
+
+    def load(self, path: str, search: str = "") -> dict:
+        """A new tab: the page itself, layout and callback graph, then the page content."""
+        self.get("GET page", path + search)
+        self.get("GET /_dash-layout", "/_dash-layout")
+        self.get("GET /_dash-dependencies", "/_dash-dependencies")
+        return self.open(path, search)
+
+    def open(self, path: str, search: str = "", name: str | None = None) -> dict:
+        """Navigation within the app, a dcc.Link click. Returns the page layout."""
+        body = self.callback(f"page {name or path}",
+                             [("_pages_content", "children"), ("_pages_store", "data")],
+                             [("_pages_location", "pathname", path), ("_pages_location", "search", search)])
+        return body.get("response", {}).get("_pages_content", {}).get("children")
+
+    def stations(self) -> dict | None:
+        """The station bundle, fetched once per page load and revalidated via ETag."""
+        r = self.get("GET /api/stations.json", "/api/stations.json", revalidate=True)
+        return r.json() if r.status_code == 200 else None
+
+
+class Targets:
+    """Stations and lines to pick from, discovered from the app like a user would find them."""
+
+    def __init__(self, stations: list[str], lines: list[str]):
+        if not stations or not lines:
+            raise Exception("Found no stations or lines to test with")
+        self.stations = stations
+        self.lines = lines
+
+    @classmethod
+    def discover(cls, base_url: str, timeout: float = 60.0) -> "Targets":
+        client = DashClient(base_url, Stats(), timeout=timeout)
+        bundle = client.stations()
+        stations = [i for i, platform in zip(bundle["ids"], bundle["platform"]) if not platform]
+        lines = [unquote(href.removeprefix("/lines/")) for href in _links(client.open("/lines"), "/lines/")]
+        return cls(stations, lines)
+
+
+class Session:
+    """What one user does in one visit, `think` is the mean pause between actions."""
+
+    def __init__(self, client: DashClient, rng: random.Random, targets: Targets, think: float = 1.0):
+        self.client = client
+        self.rng = rng
+        self.targets = targets
+        self.think = think
+
+    def pause(self):
+        if self.think > 0:
+            time.sleep(self.rng.expovariate(1 / self.think))
+
+    def station(self):
+        """Look up a few stations: the default one on page load, then picks from the search."""
+        layout = self.client.load("/stations")
+        self.client.stations()
+        station = (_find(layout, "station") or {}).get("value")
+        for _ in range(1 + self.rng.randint(1, 3)):
+            self.client.callback("stations", [("stations-loading", "children")], [("station", "value", station)])
+            self.pause()
+            station = self.rng.choice(self.targets.stations)
+
+    def connection(self):
+        """Route between random stations, each query a background job."""
+        layout = self.client.load("/connection")
+        self.client.stations()
+        from_id, to_id = {"type": "station", "key": "from"}, {"type": "station", "key": "to"}
+        a, b = (_find(layout, from_id) or {}).get("value"), (_find(layout, to_id) or {}).get("value")
+        t = (_find(layout, "time_dropdown") or {}).get("value", "08:00:00")
+        times = [o["value"] for o in (_find(layout, "time_dropdown") or {}).get("options", [])] or [t]
+        for _ in range(1 + self.rng.randint(1, 2)):
+            self.client.callback("connection", [("connection-loading", "children")],
+                                 [(from_id, "value", a), (to_id, "value", b), ("time_dropdown", "value", t)])
+            self.pause()
+            a, b = self.rng.sample(self.targets.stations, 2)
+            t = self.rng.choice(times)
+
+    def line(self):
+        """Browse the line list, open a line's map and sometimes its timetable."""
+        self.client.load("/lines")
+        for _ in range(self.rng.randint(1, 3)):
+            self.pause()
+            line = self.rng.choice(self.targets.lines)
+            layout = self.client.open(f"/lines/{quote(line)}", name="/lines/<line>")
+            url = (_find(layout, "line-figure-url") or {}).get("data")
+            if url:
+                self.client.get("GET /api/figures/line", url, revalidate=True)
+            if self.rng.random() < 0.3:
+                self.pause()
+                self.client.open(f"/lines/{quote(line)}", "?view=timetable", name="/lines/<line>?view=timetable")
+
+    def disruptions(self):
+        """Watch the disruption map for a few refresh intervals."""
+        layout = self.client.load("/disruptions")
+        state = (_find(layout, "disruptions-state") or {}).get("data")
+        for n in range(1, 1 + self.rng.randint(1, 3)):
+            self.pause()
+            body = self.client.callback("disruptions", [("disruptions-map", "figure"), ("disruptions-state", "data")],
+                                        [("disruptions-interval", "n_intervals", n)],
+                                        state=[("disruptions-state", "data", state)])
+            state = body.get("response", {}).get("disruptions-state", {}).get("data", state)
+
+
+SCENARIOS = ("station", "connection", "line", "disruptions")
+DEFAULT_MIX = {"station": 3, "connection": 3, "line": 2, "disruptions": 1}
+
+
+def parse_mix(value: str) -> dict[str, float]:
+    """'station=3,connection=1' -> weights per scenario."""
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in SCENARIOS:
+            raise ValueError(f"Unknown scenario {name!r}, expected one of {SCENARIOS}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def run(base_url: str, users: int = 10, duration: float = 60.0, mix: dict[str, float] | None = None,
+        think: float = 1.0, ramp: float = 0.0, seed: int | None = None, timeout: float = 30.0,
+        targets: Targets | None = None) -> Stats:
+    """
+    `users` simulated users, each running one session after the other for `duration`
+    seconds, started evenly over the first `ramp` seconds.
+    """
+    mix = mix or DEFAULT_MIX
+    targets = targets or Targets.discover(base_url, timeout=timeout)
+    stats = Stats()
+    deadline = time.perf_counter() + duration
+    kinds, weights = list(mix), list(mix.values())
+
+    def user(i: int):
+        rng = random.Random(None if seed is None else seed + i)
+        time.sleep(ramp * i / users)
+        while time.perf_counter() < deadline:
+            kind = rng.choices(kinds, weights)[0]
+            session = Session(DashClient(base_url, stats, timeout=timeout), rng, targets, think)
+            try:
+                getattr(session, kind)()
+                stats.session(kind, True)
+            except RequestFailed as e:
+                logging.debug(f"{kind} session of user {i} failed: {e}")
+                stats.session(kind, False)
+            except Exception:
+                logging.exception(f"{kind} session of user {i} broke")
+                stats.session(kind, False)
+
+    threads = [threading.Thread(target=user, args=(i,), name=f"loadtest-user-{i}", daemon=True) for i in range(users)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stats.finished = time.perf_counter()
+    return stats
+
+
+def format_summary(summary: dict) -> str:
+    lines = [f"{'request':<44} {'count':>7} {'rps':>7} {'err%':>6} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}"]
+    for name, e in summary["endpoints"].items():
+        lines.append(f"{name:<44} {e['count']:>7} {e['rps']:>7.1f} {100 * e['error_rate']:>6.1f} "
+                     + " ".join(f"{1000 * e[k]:>6.0f}ms" for k in ("p50", "p90", "p99", "max")))
+    lines.append(f"{summary['requests']} requests in {summary['duration']:.1f}s, {summary['rps']:.1f}/s, "
+                 f"{100 * summary['error_rate']:.2f}% errors")
+    lines.append("sessions: " + ", ".join(f"{kind} {s['completed']} ok / {s['failed']} failed"
+                                          for kind, s in sorted(summary["sessions"].items())))
+    return "\n".join(lines)
+
+
+def wait_ready(base_url: str, timeout: float = 600.0):
+    """Wait for /readyz, measuring a half-loaded server would only measure the feed build."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(base_url.rstrip("/") + "/readyz", timeout=5).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(1)
+    raise TimeoutError(f"{base_url} not ready after {timeout:.0f}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m openfahrplan.lib.loadtest", description=__doc__.splitlines()[1])
+    parser.add_argument("url", nargs="?", help="running instance, default: start one locally")
+    parser.add_argument("--recordings", type=Path, help="GTFS-RT recordings to replay to the local instance")
+    parser.add_argument("--port", type=int, default=8050, help="port of the local instance")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=60.0)
+    parser.add_argument("--ramp", type=float, default=0.0, help="start the users over this many seconds")
+    parser.add_argument("--think", type=float, default=1.0, help="mean pause between actions, 0 for none")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="e.g. station=3,connection=3,line=2")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--json", type=Path, help="write the summary here")
+    parser.add_argument("--max-error-rate", type=float, help="exit 1 if more requests fail")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    replay = server = None
+    url = args.url
+    try:
+        if url is None:
+            env = dict(os.environ, PORT=str(args.port))
+            if args.recordings:
+                replay = ReplayServer(args.recordings, port=0).start()
+                env["OPENFAHRPLAN_REALTIME_URL"] = replay.url
+            server = subprocess.Popen([sys.executable, "-m", "openfahrplan"], env=env)
+            url = f"http://127.0.0.1:{args.port}"
+        wait_ready(url)
+        stats = run(url, users=args.users, duration=args.duration, mix=args.mix, think=args.think,
+                    ramp=args.ramp, seed=args.seed, timeout=args.timeout)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if replay is not None:
+            replay.stop()
+
+    summary = stats.summary()
+    print(format_summary(summary))
+    if args.json:
+        args.json.write_text(json.dumps(summary, indent=2))
+    if args.max_error_rate is not None and summary["error_rate"] > args.max_error_rate:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,200 @@
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import types
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# never followed: shared by everything, not owned by any index
+_SKIP = (type, bool, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType)
+
+_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+def parse_size(value: str | int | None) -> int | None:
+    """'512M', '2G', '1.5GiB' or plain bytes."""
+    if value in (None, ""):
+        return None
+    if isinstance(value, int):
+        return value
+    m = re.fullmatch(r"\s*([\d.]+)\s*([KMGT]?)(i?B)?\s*", str(value), re.IGNORECASE)
+    if not m:
+        raise ValueError(f"Invalid size {value!r}, expected e.g. 512M or 2G")
+    return int(float(m.group(1)) * _UNITS[m.group(2).upper()])
+
+
+def format_size(n: int) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(n) < 1024 or unit == "GiB":
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+
+
+def deep_size(obj, seen: set) -> int:
+    """
+    Bytes held by `obj` and everything it references, Python object headers included.
+    Objects already in `seen` count zero, so a structure shared by two indexes is
+    attributed to the first one measured.
+    """
+    size = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if o is None or id(o) in seen or isinstance(o, _SKIP):
+            continue
+        seen.add(id(o))
+        if isinstance(o, (pd.DataFrame, pd.Series, pd.Index)):
+            # pandas counts object columns (strings) deeply, arrow columns by their buffers
+            usage = o.memory_usage(deep=True)
+            size += int(usage.sum() if isinstance(usage, pd.Series) else usage)
+        elif isinstance(o, np.ndarray):
+            # includes the buffer if the array owns it, a view's buffer is counted with its base
+            size += sys.getsizeof(o)
+            if o.base is not None:
+                stack.append(o.base)
+            if o.dtype == object:
+                stack.extend(o.ravel().tolist())
+        elif isinstance(o, (str, bytes, int, float, complex, range)):
+            size += sys.getsizeof(o)
+        elif isinstance(o, dict):
+            size += sys.getsizeof(o)
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            size += sys.getsizeof(o)
+            stack.extend(o)
+        else:
+            size += sys.getsizeof(o)
+            if hasattr(o, "__dict__"):
+                stack.append(o.__dict__)
+            for slot in getattr(type(o), "__slots__", ()):
+                stack.append(getattr(o, slot, None))
+    return size
+
+
+# Attributes worth their own line, the rest of an index is summed into "<name>.*"
+_PARTS = {
+    "raptor_index": ["trips", "events_dep", "events_tid", "events_idx", "foot", "stop2tripidx", "stop_to_idx", "stop_ids",
+                     "platform_ids", "partition"],
+    "feed.search_index": None,
+    "feed.stop_graph": None,
+    "feed.trip_geometry": None,
+    "departures": None,
+    "lines": None,
+    "transfer_network": None,
+    "station_bundle": None,
+}
+
+
+def _resolve(version, path: str):
+    obj = version
+    for name in path.split("."):
+        # only what is built already, measuring must not build lazy indexes
+        obj = obj.__dict__.get(name) if hasattr(obj, "__dict__") else getattr(obj, name, None)
+        if obj is None:
+            return None
+    return obj
+
+
+def account(version) -> list[dict]:
+    """
+    Deep size of every table of the feed and every index of a FeedVersion, as rows of
+    {"component", "part", "bytes"}. Shared objects are counted once.
+    """
+    seen = set()
+    rows = []
+    # the parquet tables, plus derived frames like stop_mapping once they are built
+    for table, frame in vars(version.feed).items():
+        if isinstance(frame, pd.DataFrame):
+            rows.append({"component": "feed", "part": table, "bytes": deep_size(frame, seen)})
+    for path, parts in _PARTS.items():
+        obj = _resolve(version, path)
+        if obj is None:
+            continue
+        for part in parts or []:
+            if getattr(obj, part, None) is not None:
+                rows.append({"component": path, "part": part, "bytes": deep_size(getattr(obj, part), seen)})
+        rows.append({"component": path, "part": "*" if parts else "", "bytes": deep_size(obj, seen)})
+    # whatever else hangs off the version: cached per-snapshot indexes, stop mapping, ...
+    rows.append({"component": "other", "part": "", "bytes": deep_size(version, seen)})
+    return rows
+
+
+def process_rss() -> int | None:
+    """Resident set size of this process in bytes, None where /proc isn't available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def report(version, budget: int | None = None) -> dict:
+    rows = account(version)
+    total = sum(r["bytes"] for r in rows)
+    return {
+        "feed": version.version,
+        "total": total,
+        "rss": process_rss(),
+        "budget": budget,
+        "over_budget": budget is not None and total > budget,
+        "rows": rows,
+    }
+
+
+class MemoryBudgetExceeded(RuntimeError):
+    pass
+
+
+def check_budget(version, budget: int | None) -> dict | None:
+    """Log the memory report of a version and raise if it doesn't fit into `budget` bytes."""
+    if budget is None:
+        return None
+    r = report(version, budget)
+    logging.info(f"Feed version {version.version} holds {format_size(r['total'])} of {format_size(budget)} budget")
+    if r["over_budget"]:
+        top = sorted(r["rows"], key=lambda row: -row["bytes"])[:5]
+        biggest = ", ".join(f"{row['component']}.{row['part']} {format_size(row['bytes'])}" for row in top)
+        raise MemoryBudgetExceeded(f"Feed version {version.version} needs {format_size(r['total'])}, "
+                                   f"budget is {format_size(budget)} (largest: {biggest})")
+    return r
+
+
+def format_report(r: dict) -> str:
+    lines = [f"{'component':<22} {'part':<16} {'size':>12}"]
+    for row in sorted(r["rows"], key=lambda row: -row["bytes"]):
+        lines.append(f"{row['component']:<22} {row['part']:<16} {format_size(row['bytes']):>12}")
+    lines.append(f"{'total':<39} {format_size(r['total']):>12}")
+    if r["rss"] is not None:
+        lines.append(f"{'process rss':<39} {format_size(r['rss']):>12}")
+    if r["budget"] is not None:
+        lines.append(f"{'budget':<39} {format_size(r['budget']):>12}{'  EXCEEDED' if r['over_budget'] else ''}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m openfahrplan.lib.memory",
+                                     description="Build a feed version and report the memory of its tables and indexes")
+    parser.add_argument("--data", type=Path, default=Path(os.getenv("OPENFAHRPLAN_DATA_DIR", "data")))
+    parser.add_argument("--name", default="vgn")
+    parser.add_argument("--budget", default=os.getenv("OPENFAHRPLAN_MEMORY_BUDGET"), help="e.g. 2G, exit 1 if exceeded")
+    parser.add_argument("--prune", action="store_true", help="build the raptor index with prune_unserved")
+    parser.add_argument("--collapse", action="store_true", help="build the raptor index with collapse_stations")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+
+    from openfahrplan.lib.registry import FeedVersion
+
+    version = FeedVersion(args.data, args.name, {"prune_unserved": args.prune, "collapse_stations": args.collapse})
+    r = report(version, parse_size(args.budget))
+    print(json.dumps(r, indent=2) if args.json else format_report(r))
+    return 1 if r["over_budget"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,234 @@
+import bisect
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# seconds, from a cached lookup to a slow nationwide route
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+def _value(v) -> str:
+    if v == math.inf:
+        return "+Inf"
+    if v == -math.inf:
+        return "-Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def get(self, *label_values) -> float:
+        return self._values.get(label_values, 0)
+
+    def _state(self) -> dict:
+        with self._lock:
+            return dict(self._values)
+
+    def _diff(self, before: dict) -> dict:
+        return {k: v - before.get(k, 0) for k, v in self._state().items() if v != before.get(k, 0)}
+
+    def _merge(self, diff: dict):
+        with self._lock:
+            for k, v in diff.items():
+                self._values[k] = self._values.get(k, 0) + v
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for values, v in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labels, values)} {_value(v)}")
+        return lines
+
+
+class Gauge:
+    """A value read when scraped, `read` returns a number or a {label values: number} dict."""
+
+    def __init__(self, name: str, help: str, read, labels: tuple = ()):
+        self.name, self.help, self.labels, self.read = name, help, tuple(labels), read
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        value = self.read()
+        if value is None:
+            return lines
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        for values, v in items:
+            values = values if isinstance(values, tuple) else (values,)
+            lines.append(f"{self.name}{_labels(self.labels, values)} {_value(v)}")
+        return lines
+
+
+class Histogram:
+    """Latency histogram, observing is a binary search and two additions under a lock."""
+
+    def __init__(self, name: str, help: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name, self.help = name, help
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += seconds
+
+    @property
+    def count(self) -> int:
+        return sum(self._counts)
+
+    def _state(self) -> tuple[list, float]:
+        with self._lock:
+            return list(self._counts), self._sum
+
+    def _diff(self, before: tuple[list, float]) -> tuple[list, float] | None:
+        counts, total = self._state()
+        if counts == before[0]:
+            return None
+        return [c - b for c, b in zip(counts, before[0])], total - before[1]
+
+    def _merge(self, diff: tuple[list, float]):
+        with self._lock:
+            for i, c in enumerate(diff[0]):
+                self._counts[i] += c
+            self._sum += diff[1]
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def timed(self, func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.observe(time.perf_counter() - start)
+        return wrapper
+
+    def render(self) -> list[str]:
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, c in zip(self.buckets + (math.inf,), counts):
+            cumulative += c
+            lines.append(f'{self.name}_bucket{{le="{_value(bound)}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {_value(total)}")
+        lines.append(f"{self.name}_count {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    All metrics of the process, rendered in the Prometheus text format by /metrics.
+
+    Job worker processes (see lib/jobs.py) take a `state` before every job and hand
+    the `diff` of their counters and histograms back through a source, which
+    returns the diffs that arrived since it was last asked. Sources are merged in
+    before every render.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._sources = []
+
+    def _add(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: tuple = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, read, labels: tuple = ()) -> Gauge:
+        return self._add(Gauge(name, help, read, labels))
+
+    def histogram(self, name: str, help: str, buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, buckets))
+
+    def __getitem__(self, name):
+        return self._metrics[name]
+
+    def state(self) -> dict:
+        return {name: m._state() for name, m in self._metrics.items() if hasattr(m, "_state")}
+
+    def diff(self, before: dict) -> dict:
+        """What the counters and histograms gained since `before` was taken."""
+        diff = {}
+        for name, state in before.items():
+            d = self._metrics[name]._diff(state)
+            if d:
+                diff[name] = d
+        return diff
+
+    def merge(self, diff: dict):
+        for name, d in diff.items():
+            if name in self._metrics:
+                self._metrics[name]._merge(d)
+
+    def add_source(self, pull):
+        self._sources.append(pull)
+
+    def collect(self):
+        for pull in self._sources:
+            try:
+                for diff in pull():
+                    self.merge(diff)
+            except Exception:
+                logging.exception(f"Collecting metrics from {pull!r} failed")
+
+    def render(self) -> str:
+        self.collect()
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                lines.append(f"# {metric.name} failed: {e!r}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+route_seconds = metrics.histogram("openfahrplan_raptor_route_seconds", "Time spent in raptor_route.")
+search_seconds = metrics.histogram("openfahrplan_station_search_seconds", "Time spent in station searches.")
+route_map_seconds = metrics.histogram("openfahrplan_route_map_seconds", "Time spent in build_route_map_data.")
+realtime_fetch_seconds = metrics.histogram("openfahrplan_realtime_fetch_seconds",
+                                           "Time spent downloading or reading the GTFS-RT feed.",
+                                           buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30))
+realtime_decode_seconds = metrics.histogram("openfahrplan_realtime_decode_seconds",
+                                            "Time spent parsing and decoding a GTFS-RT feed.",
+                                            buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+realtime_fetches = metrics.counter("openfahrplan_realtime_fetches_total",
+                                   "GTFS-RT fetches by result: new, unchanged, timeout or error.", ("result",))
+partition_queries = metrics.counter("openfahrplan_raptor_partition_queries_total",
+                                    "Routes searched with arc flags: pruned, or full for queries they don't cover.",
+                                    ("result",))
+cache_requests = metrics.counter("openfahrplan_cache_requests_total",
+                                 "Lookups of the figure and snapshot index caches.", ("cache", "result"))
@@ -0,0 +1,138 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+
+class NetworkView:
+    """What one map view draws: line segments with NaN separators and stop markers."""
+
+    __slots__ = ("detail", "lat", "lon", "text", "stop_lat", "stop_lon", "stop_text", "stop_size")
+
+    def __init__(self, detail, lat, lon, text, stop_lat, stop_lon, stop_text, stop_size):
+        self.detail = detail
+        self.lat = lat
+        self.lon = lon
+        self.text = text
+        self.stop_lat = stop_lat
+        self.stop_lon = stop_lon
+        self.stop_text = stop_text
+        self.stop_size = stop_size
+
+    def __len__(self):
+        return len(self.lat) // 3 + len(self.stop_lat)
+
+
+def _segments(lat_a, lon_a, lat_b, lon_b, text):
+    # one segment per edge, NaN separators between them
+    n = len(lat_a)
+    lat = np.full(n * 3, np.nan)
+    lon = np.full(n * 3, np.nan)
+    lat[0::3], lat[1::3] = lat_a, lat_b
+    lon[0::3], lon[1::3] = lon_a, lon_b
+    labels = [None] * (n * 3)
+    labels[0::3] = labels[1::3] = list(text)
+    return lat.tolist(), lon.tolist(), labels
+
+
+class TransferNetwork:
+    """
+    Transfer edges between stops with a zoom dependent level of detail.
+
+    Zoomed out, stops are snapped to a grid of roughly `cells_per_tile` cells per map
+    tile and only edges between different cells are drawn, one per cell pair, so the
+    payload depends on the viewport, not on the size of the feed. Zoomed in, the edges
+    touching the visible bounding box are sent as they are, as long as there are at
+    most `max_edges` of them.
+    """
+
+    def __init__(self, feed, max_edges: int = 4000, cells_per_tile: int = 16):
+        self.max_edges = max_edges
+        self.cells_per_tile = cells_per_tile
+        stops = feed.stops[["stop_id", "stop_name", "stop_lat", "stop_lon"]].drop_duplicates("stop_id").set_index("stop_id")
+        tf = getattr(feed, "transfers", None)
+        tf = tf if tf is not None else pd.DataFrame(columns=["from_stop_id", "to_stop_id"])
+        a = stops.index.get_indexer(tf["from_stop_id"])
+        b = stops.index.get_indexer(tf["to_stop_id"])
+        lat = stops["stop_lat"].to_numpy(dtype=np.float64, na_value=np.nan)
+        lon = stops["stop_lon"].to_numpy(dtype=np.float64, na_value=np.nan)
+        ok = (a >= 0) & (b >= 0)
+        ok[ok] = np.isfinite(lat[a[ok]]) & np.isfinite(lat[b[ok]]) & (a[ok] != b[ok])
+        # a transfer and its way back are one edge on the map
+        a, b = np.minimum(a[ok], b[ok]), np.maximum(a[ok], b[ok])
+        edges = np.unique(np.stack([a, b], axis=1), axis=0) if len(a) else np.empty((0, 2), dtype=np.int64)
+        self.a, self.b = edges[:, 0], edges[:, 1]
+        # only stops that take part in a transfer are drawn
+        used = np.unique(edges)
+        self.stop_ids = stops.index[used].to_numpy(dtype=object)
+        self.stop_names = stops["stop_name"].to_numpy(dtype=object)[used]
+        self.lat, self.lon = lat[used], lon[used]
+        pos = np.full(len(stops), -1, dtype=np.int64)
+        pos[used] = np.arange(len(used))
+        self.a, self.b = pos[self.a], pos[self.b]
+
+    def __len__(self):
+        return len(self.a)
+
+    def bounds(self) -> tuple[float, float, float, float]:
+        """(min_lon, min_lat, max_lon, max_lat) of all drawn stops."""
+        if len(self.lat) == 0:
+            return 0.0, 0.0, 0.0, 0.0
+        return float(self.lon.min()), float(self.lat.min()), float(self.lon.max()), float(self.lat.max())
+
+    def cell_size(self, zoom: float) -> float:
+        """Grid cell size in degrees at a zoom level, map tiles span 360 / 2**zoom degrees."""
+        return 360.0 / 2 ** max(zoom, 0) / self.cells_per_tile
+
+    def view(self, zoom: float, bbox: tuple[float, float, float, float] | None = None) -> NetworkView:
+        """Edges and stops to draw at `zoom` for the (min_lon, min_lat, max_lon, max_lat) viewport."""
+        bbox = bbox or self.bounds()
+        inside = self._inside(bbox)
+        visible = inside[self.a] | inside[self.b]
+        if np.count_nonzero(visible) <= self.max_edges:
+            return self._detail(visible, inside)
+        return self._grid(self.cell_size(zoom), visible)
+
+    def _inside(self, bbox) -> np.ndarray:
+        min_lon, min_lat, max_lon, max_lat = bbox
+        return (self.lon >= min_lon) & (self.lon <= max_lon) & (self.lat >= min_lat) & (self.lat <= max_lat)
+
+    def _detail(self, visible, inside) -> NetworkView:
+        a, b = self.a[visible], self.b[visible]
+        text = [f"{x} ↔ {y}" for x, y in zip(self.stop_ids[a], self.stop_ids[b])]
+        lat, lon, labels = _segments(self.lat[a], self.lon[a], self.lat[b], self.lon[b], text)
+        stops = np.union1d(np.flatnonzero(inside), np.union1d(a, b))
+        return NetworkView(
+            True, lat, lon, labels,
+            self.lat[stops].tolist(), self.lon[stops].tolist(),
+            [f"{n} ({i})" for n, i in zip(self.stop_names[stops], self.stop_ids[stops])],
+            [6] * len(stops),
+        )
+
+    def _grid(self, cell: float, visible) -> NetworkView:
+        a, b = self.a[visible], self.b[visible]
+        used = np.union1d(a, b)
+        cx = np.floor(self.lon / cell).astype(np.int64)
+        cy = np.floor(self.lat / cell).astype(np.int64)
+        cells, code = np.unique(np.stack([cx[used], cy[used]], axis=1), axis=0, return_inverse=True)
+        code = code.ravel()
+        stop_cell = np.full(len(self.lat), -1, dtype=np.int64)
+        stop_cell[used] = code
+        # cell marker at the mean position of its stops, sized by their count
+        count = np.bincount(code, minlength=len(cells))
+        mlat = np.bincount(code, weights=self.lat[used], minlength=len(cells)) / count
+        mlon = np.bincount(code, weights=self.lon[used], minlength=len(cells)) / count
+
+        ca, cb = stop_cell[a], stop_cell[b]
+        between = ca != cb
+        pairs, n = np.unique(np.stack([np.minimum(ca, cb)[between], np.maximum(ca, cb)[between]], axis=1),
+                             axis=0, return_counts=True)
+        pairs = pairs.reshape(-1, 2)
+        lat, lon, labels = _segments(mlat[pairs[:, 0]], mlon[pairs[:, 0]], mlat[pairs[:, 1]], mlon[pairs[:, 1]],
+                                     [f"{k} Übergänge" for k in n.tolist()])
+        return NetworkView(
+            False, lat, lon, labels,
+            mlat.tolist(), mlon.tolist(),
+            [f"{k} Haltestellen" for k in count.tolist()],
+            [min(4 + 2 * math.log2(k), 20) for k in count.tolist()],
+        )
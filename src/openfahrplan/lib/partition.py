@@ -0,0 +1,391 @@
+"""
+Arc flags for RAPTOR on large networks, see RoutePartition. They are built offline
+per feed version, a server started with cells only loads them:
+
+    python -m openfahrplan.lib.partition build --cells 32 --jobs 8
+    python -m openfahrplan.lib.partition verify --cells 32 --queries 500
+    OPENFAHRPLAN_RAPTOR_CELLS=32 python -m openfahrplan
+"""
+import argparse
+import heapq
+import logging
+import math
+import multiprocessing
+import os
+import random
+import sys
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from openfahrplan.lib.raptor import DAY, RaptorIndex, raptor_route
+
+
+def _bisect(xy: np.ndarray, cells: int) -> np.ndarray:
+    """Cell per point: split along the wider axis at the point count quantile, recursively."""
+    cell_of = np.zeros(len(xy), dtype=np.int16)
+    stack = [(np.arange(len(xy)), 0, cells)]
+    while stack:
+        nodes, first, k = stack.pop()
+        if k == 1 or len(nodes) == 0:
+            cell_of[nodes] = first
+            continue
+        axis = int(np.argmax(np.ptp(xy[nodes], axis=0)))
+        ordered = nodes[np.argsort(xy[nodes, axis], kind="stable")]
+        left = k // 2
+        cut = len(ordered) * left // k
+        stack.append((ordered[:cut], first, left))
+        stack.append((ordered[cut:], first + left, k - left))
+    return cell_of
+
+
+def _positions(index: RaptorIndex, stops: pd.DataFrame) -> np.ndarray:
+    """Mean position of every routing node, lon scaled so both axes are roughly metric."""
+    node = stops["stop_id"].map(index.stop_to_idx)
+    known = node.notna()
+    pos = stops.loc[known, ["stop_lat", "stop_lon"]].groupby(node[known].astype(int)).mean()
+    pos = pos.reindex(range(index.nstops))
+    pos = pos.fillna(pos.mean())
+    lat = pos["stop_lat"].to_numpy()
+    return np.column_stack([lat, pos["stop_lon"].to_numpy() * np.cos(np.radians(np.nanmean(lat)))])
+
+
+def _routes(index: RaptorIndex) -> tuple[dict, int]:
+    """Route id per trip, trips with the same stop sequence share a route."""
+    ids = {}
+    route_of = {}
+    for tid, tp in index.trips.items():
+        route_of[tid] = ids.setdefault(tp["stops"].tobytes(), len(ids))
+    return route_of, len(ids)
+
+
+def _groups(index: RaptorIndex, route_of: dict) -> tuple[list, dict]:
+    """
+    The trips of every route split into groups in which no trip overtakes another,
+    sorted by departure, so the first trip caught at a stop is the first at every
+    later one. A group is (route, stops, departures per position, arrivals per trip,
+    whether a position is the stop's first, the one it's boarded at). Also returns
+    the (group, position) of every stop where the group can be boarded.
+    """
+    by_route = defaultdict(list)
+    for tid, tp in index.trips.items():
+        by_route[route_of[tid]].append(tp)
+    groups = []
+    for route, tps in by_route.items():
+        chains = []
+        for tp in sorted(tps, key=lambda tp: (int(tp["dep"][0]), int(tp["arr"][-1]))):
+            for chain in chains:
+                if (tp["dep"] >= chain[-1]["dep"]).all() and (tp["arr"] >= chain[-1]["arr"]).all():
+                    chain.append(tp)
+                    break
+            else:
+                chains.append([tp])
+        for chain in chains:
+            stops = chain[0]["stops"].tolist()
+            first = [stops.index(u) == pos for pos, u in enumerate(stops)]
+            groups.append((route, stops, np.array([tp["dep"] for tp in chain]).T.tolist(),
+                           [tp["arr"].tolist() for tp in chain], first))
+    board = defaultdict(list)
+    for g, (_, stops, _, _, first) in enumerate(groups):
+        for pos, u in enumerate(stops):
+            if first[pos]:
+                board[u].append((g, pos))
+    return groups, board
+
+
+def _walk(index: RaptorIndex, s_idx: int) -> dict:
+    """Walking time from `s_idx` to every stop its footpaths lead to."""
+    walk = {s_idx: 0}
+    pq = [(0, s_idx)]
+    while pq:
+        t, u = heapq.heappop(pq)
+        if t > walk[u]:
+            continue
+        for v, w in index.foot.get(u, ()):
+            if t + w < walk.get(v, math.inf):
+                walk[v] = t + w
+                heapq.heappush(pq, (t + w, v))
+    return walk
+
+
+def _profile(index: RaptorIndex, groups: list, board: dict, s_idx: int, max_rounds: int, cell_of: list,
+             masks: list):
+    """
+    rRAPTOR from `s_idx` over every departure of the service day. For every earliest
+    arrival per round and stop, the routes of the journey behind it get the stop's
+    cell bit in `masks`.
+
+    Departures are processed from the latest to the earliest, every one only adds the
+    trips first caught at it and keeps the arrivals of the later ones, which stay
+    reachable by waiting. The arrivals per round and stop are those of _search from
+    that departure, with the same service day cut.
+    """
+    INF = math.inf
+    walk = _walk(index, s_idx)
+    # departure from s_idx -> the trips caught by walking to their stop and leaving then
+    caught = defaultdict(list)
+    for u, w in walk.items():
+        for g, pos in board.get(u, ()):
+            for trip, dep in enumerate(groups[g][2][pos]):
+                if 0 <= dep - w < DAY:
+                    caught[dep - w].append((g, trip, pos))
+    # per round, at most that many trips: best arrival and its journey as a node
+    # [route or None for a walk, previous node, cell bits already passed on]
+    arrival = [dict() for _ in range(max_rounds + 1)]
+    label = [dict() for _ in range(max_rounds + 1)]
+
+    def improve(r, v, a, route, parent):
+        node = [route, parent, 0]
+        bit = 1 << cell_of[v]
+        n = node
+        while n is not None and not n[2] & bit:
+            n[2] |= bit
+            if n[0] is not None:
+                masks[n[0]] |= bit
+            n = n[1]
+        for rr in range(r, max_rounds + 1):
+            if a >= arrival[rr].get(v, INF):
+                break
+            arrival[rr][v] = a
+            label[rr][v] = node
+
+    for dep0 in sorted(caught, reverse=True):
+        for u, w in walk.items():
+            for rr in range(max_rounds + 1):
+                if dep0 + w >= arrival[rr].get(u, INF):
+                    break
+                arrival[rr][u] = dep0 + w
+                label[rr][u] = None
+        marked = set()
+        for r in range(1, max_rounds + 1):
+            improved = set()
+            if r == 1:
+                # the trips caught from earlier departures were scanned then
+                for g, trip, pos in caught[dep0]:
+                    route, stops, _, arr, _ = groups[g]
+                    times = arr[trip]
+                    for k in range(pos + 1, len(stops)):
+                        if times[k] < arrival[1].get(stops[k], INF):
+                            improve(1, stops[k], times[k], route, None)
+                            improved.add(stops[k])
+            else:
+                scan = {}
+                for u in marked:
+                    for g, pos in board.get(u, ()):
+                        if pos < scan.get(g, INF):
+                            scan[g] = pos
+                for g, pos in scan.items():
+                    route, stops, dep, arr, first = groups[g]
+                    trip = parent = None
+                    for k in range(pos, len(stops)):
+                        v = stops[k]
+                        if trip is not None and arr[trip][k] < arrival[r].get(v, INF):
+                            improve(r, v, arr[trip][k], route, parent)
+                            improved.add(v)
+                        if first[k] and v in marked:
+                            t = arrival[r - 1][v]
+                            i = bisect_left(dep[k], t)
+                            if i < len(dep[k]) and (t >= DAY or dep[k][i] < DAY) and (trip is None or i < trip):
+                                trip, parent = i, label[r - 1][v]
+            if not improved:
+                break
+            pq = [(arrival[r][u], u) for u in improved]
+            heapq.heapify(pq)
+            while pq:
+                t, u = heapq.heappop(pq)
+                if t > arrival[r][u]:
+                    continue
+                for v, w in index.foot.get(u, ()):
+                    if t + w < arrival[r].get(v, INF):
+                        improve(r, v, t + w, None, label[r][u])
+                        improved.add(v)
+                        heapq.heappush(pq, (t + w, v))
+            marked = improved
+
+
+# the index and groups a build's worker processes share, set before they fork
+_build_state = None
+
+
+def _flag_sources(sources: list) -> list:
+    index, groups, board, max_rounds, cell_of, nroutes = _build_state
+    masks = [0] * nroutes
+    for s_idx in sources:
+        _profile(index, groups, board, s_idx, max_rounds, cell_of, masks)
+    return masks
+
+
+class RoutePartition:
+    """
+    Arc flags for RAPTOR in the style of HypRAPTOR. The routing nodes are split into
+    geographic cells of about equal size, and every route (the trips with one stop
+    sequence) gets a flag per cell. A query only boards the routes flagged for its
+    target cell.
+
+    `build` runs a profile search from every node over the whole service day and
+    flags every route on the journey behind an earliest arrival with at most r trips
+    (r up to `rounds`) for the cell of the stop it reaches. The journey the full
+    search returns is one of those, so all its routes are flagged for the target's
+    cell, and RAPTOR on fewer routes neither arrives earlier nor in fewer rounds: the
+    pruned search arrives at the same time after as many trips, only among equally
+    fast journeys it may pick another one.
+
+    That holds for queries departing before 24:00 with at most `rounds` rounds,
+    raptor_route searches the whole network for the others, and for indexes without
+    a transfer penalty, whose arrivals don't depend on how a stop was reached. The
+    exception is _search's service day cut: a stop reached after 24:00 may board the
+    trips after 24:00 that an earlier arrival may not, so pruned journeys across
+    midnight can differ.
+    """
+
+    __slots__ = ("cells", "cell_of", "events_route", "flags", "rounds")
+
+    def __init__(self, index: RaptorIndex, cell_of: np.ndarray, flags: np.ndarray | None = None, rounds: int = 8):
+        route_of, nroutes = _routes(index)
+        self.cells = int(cell_of.max()) + 1 if len(cell_of) else 0
+        self.cell_of = cell_of
+        # route of every departure event, parallel to index.events_tid
+        self.events_route = [np.fromiter((route_of[t] for t in tids), dtype=np.int32, count=len(tids))
+                             for tids in index.events_tid]
+        self.flags = np.zeros((nroutes, self.cells), dtype=bool) if flags is None else flags
+        if self.flags.shape != (nroutes, self.cells):
+            raise ValueError(f"Flags for {self.flags.shape} routes x cells, the index has {(nroutes, self.cells)}")
+        self.rounds = rounds
+
+    @classmethod
+    def build(cls, index: RaptorIndex, stops: pd.DataFrame, cells: int = 16, max_rounds: int = 8,
+              jobs: int = 1) -> "RoutePartition":
+        """Flags for journeys of up to `max_rounds` trips, searched from the nodes in `jobs` processes."""
+        global _build_state
+        if index.transfer_penalty:
+            raise ValueError("Arc flags need an index without a transfer penalty")
+        start = time.perf_counter()
+        partition = cls(index, _bisect(_positions(index, stops), cells), rounds=max_rounds)
+        groups, board = _groups(index, _routes(index)[0])
+        _build_state = (index, groups, board, max_rounds, partition.cell_of.tolist(), len(partition.flags))
+        try:
+            sources = list(range(index.nstops))
+            if jobs > 1:
+                chunks = [sources[i::jobs * 8] for i in range(jobs * 8)]
+                with multiprocessing.get_context("fork").Pool(jobs) as pool:
+                    results = pool.map(_flag_sources, chunks)
+            else:
+                results = [_flag_sources(sources)]
+        finally:
+            _build_state = None
+        for route, masks in enumerate(zip(*results)):
+            mask = 0
+            for m in masks:
+                mask |= m
+            partition.flags[route] = [(mask >> c) & 1 for c in range(partition.cells)]
+        logging.info(f"Partitioned {index.nstops} stops into {partition.cells} cells, "
+                     f"{partition.flags.mean():.1%} of route flags set in {time.perf_counter() - start:.1f}s")
+        return partition
+
+    def allowed(self, t_idx: int) -> np.ndarray:
+        """Routes a query to `t_idx` may board."""
+        return self.flags[:, self.cell_of[t_idx]]
+
+    def save(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp.npz")
+        np.savez_compressed(tmp, cell_of=self.cell_of, flags=np.packbits(self.flags, axis=None),
+                            shape=np.array(self.flags.shape), rounds=np.array(self.rounds))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path, index: RaptorIndex) -> "RoutePartition":
+        with np.load(path) as f:
+            shape = tuple(f["shape"])
+            flags = np.unpackbits(f["flags"], count=shape[0] * shape[1]).astype(bool).reshape(shape)
+            cell_of = f["cell_of"]
+            # flags saved without it were sampled, not exact
+            rounds = int(f["rounds"])
+        if len(cell_of) != index.nstops:
+            raise ValueError(f"{path} partitions {len(cell_of)} stops, the index has {index.nstops}")
+        return cls(index, cell_of, flags, rounds)
+
+    def __repr__(self):
+        return f"<RoutePartition {self.cells} cells, {len(self.flags)} routes, {self.flags.mean():.1%} flagged>"
+
+
+def partition_path(data: Path, version: str, cells: int, prune_unserved: bool = False,
+                   collapse_stations: bool = False) -> Path:
+    """Where the flags of a feed version are kept, they depend on the nodes of its index."""
+    name = f"{version}-{cells}" + ("-pruned" if prune_unserved else "") + ("-collapsed" if collapse_stations else "")
+    return data / "partitions" / f"{name}.npz"
+
+
+def verify(index: RaptorIndex, queries: list[tuple]) -> dict:
+    """Run queries with and without the flags, count where the pruned search differs and time both."""
+    same = different = found = 0
+    full_time = pruned_time = 0.0
+    for a, b, t in queries:
+        start = time.perf_counter()
+        full = raptor_route(index, a, b, t, pruned=False)
+        full_time += time.perf_counter() - start
+        start = time.perf_counter()
+        pruned = raptor_route(index, a, b, t)
+        pruned_time += time.perf_counter() - start
+        found += full is not None
+        if (full is None) != (pruned is None) or (
+                full is not None and (full.arrival_sec, full.transfers) != (pruned.arrival_sec, pruned.transfers)):
+            different += 1
+        else:
+            same += 1
+    return {"queries": len(queries), "found": found, "same": same, "different": different,
+            "full_seconds": full_time, "pruned_seconds": pruned_time}
+
+
+def sample_queries(index: RaptorIndex, count: int, seed: int = 0) -> list[tuple]:
+    """Random origin/destination pairs among the served stops at random times of the day."""
+    rng = random.Random(seed)
+    served = [i for i, e in enumerate(index.events_dep) if e.size]
+    return [(index.stop_ids[rng.choice(served)], index.stop_ids[rng.choice(served)],
+             f"{rng.randint(5, 22):02d}:{rng.choice((0, 30)):02d}:00") for _ in range(count)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m openfahrplan.lib.partition", description=__doc__.splitlines()[1])
+    parser.add_argument("command", choices=("build", "verify"))
+    parser.add_argument("--data", type=Path, default=Path(os.getenv("OPENFAHRPLAN_DATA_DIR", "data")))
+    parser.add_argument("--name", default="vgn")
+    parser.add_argument("--cells", type=int, default=int(os.getenv("OPENFAHRPLAN_RAPTOR_CELLS", "16")))
+    parser.add_argument("--prune", action="store_true", help="index built with prune_unserved")
+    parser.add_argument("--collapse", action="store_true",
+                        help="index built with collapse_stations, served with OPENFAHRPLAN_RAPTOR_TRANSFER_PENALTY=0")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="processes to build with")
+    parser.add_argument("--queries", type=int, default=200, help="random queries to verify with")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    from openfahrplan.lib.registry import FeedVersion
+
+    logging.basicConfig(level=logging.INFO)
+    # the flags are exact without a transfer penalty only
+    options = {"prune_unserved": args.prune, "collapse_stations": args.collapse, "transfer_penalty": 0}
+    if args.command == "build":
+        version = FeedVersion(args.data, args.name, options)
+        path = partition_path(args.data, version.version, args.cells, args.prune, args.collapse)
+        partition = RoutePartition.build(version.raptor_index, version.feed.stops, args.cells, jobs=args.jobs)
+        partition.save(path)
+        print(f"{partition} written to {path}")
+        return 0
+
+    version = FeedVersion(args.data, args.name, {**options, "cells": args.cells})
+    if version.raptor_index.partition is None:
+        print("No flags for this feed version, build them first")
+        return 1
+    r = verify(version.raptor_index, sample_queries(version.raptor_index, args.queries, args.seed))
+    print(f"{version.raptor_index.partition}: {r['found']} of {r['queries']} queries routable, "
+          f"{r['same']} as with the full search, {r['different']} different; "
+          f"{r['full_seconds']:.2f}s full vs {r['pruned_seconds']:.2f}s pruned")
+    return 0 if r["different"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
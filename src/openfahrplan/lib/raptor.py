@@ -3,8 +3,11 @@ import math, re, heapq
 import numpy as np
 import pandas as pd
 
+from openfahrplan.lib.metrics import partition_queries, route_seconds
+
 
 _TIME = re.compile(r"^\d{1,2}:\d{2}:\d{2}$")
+DAY = 86400
 
 def _parse_gtfs_time(t) -> float:
     if t is None:
@@ -22,7 +25,16 @@ def _parse_gtfs_time(t) -> float:
 
 
 class RaptorIndex:
-    """Precompute arrays for RAPTOR."""
+    """
+    Precompute arrays for RAPTOR.
+
+    By default every stop in feed.stops is a routing node. With `prune_unserved`,
+    stops that no trip serves and no footpath connects to a served stop are dropped.
+    With `collapse_stations`, all platforms of a parent station are contracted into
+    one node, and changing trips there costs `transfer_penalty` seconds. The
+    platforms are kept per trip and footpath so journeys are expanded back to
+    platform level.
+    """
 
     __slots__ = (
         "stop_ids",
@@ -34,11 +46,19 @@ class RaptorIndex:
         "events_idx",
         "foot",
         "nstops",
+        "platform_ids",
+        "foot_platforms",
+        "transfer_penalty",
+        "partition",
     )
 
     @classmethod
-    def from_feed(cls, feed):
+    def from_feed(cls, feed, prune_unserved: bool = False, collapse_stations: bool = False, transfer_penalty: int = 120):
         idx = cls()
+        idx.platform_ids = None
+        idx.foot_platforms = None
+        idx.partition = None
+        idx.transfer_penalty = int(transfer_penalty) if collapse_stations else 0
         st = feed.stop_times[
             ["trip_id", "stop_id", "arrival_time", "departure_time", "stop_sequence"]
         ].copy()
@@ -59,12 +79,38 @@ class RaptorIndex:
             idx.nstops = 0
             return idx
 
+        tr = getattr(feed, "transfers", None)
+        if tr is not None and not tr.empty:
+            tr = tr[["from_stop_id", "to_stop_id", "transfer_type", "min_transfer_time"]].copy()
+            tr["transfer_type"] = tr["transfer_type"].fillna(0).astype(int)
+            tr = tr[tr["transfer_type"] != 3]  # disallow-only edges removed
+            tr["min_transfer_time"] = tr["min_transfer_time"].fillna(0).astype(int)
+
         # stable universe
-        idx.stop_ids = pd.Index(feed.stops["stop_id"].unique())
-        idx.stop_to_idx = {sid: i for i, sid in enumerate(idx.stop_ids)}
+        stops = feed.stops.drop_duplicates("stop_id")
+        if prune_unserved:
+            keep = set(st["stop_id"].unique())
+            if tr is not None and not tr.empty:
+                touches = tr["from_stop_id"].isin(keep) | tr["to_stop_id"].isin(keep)
+                keep |= set(tr.loc[touches, "from_stop_id"]) | set(tr.loc[touches, "to_stop_id"])
+            stops = stops[stops["stop_id"].isin(keep)]
+        if collapse_stations:
+            # one node per parent station (or per stop without one), reachable by every platform id
+            node_key = stops["parent_station"].where(stops["parent_station"].notna(), stops["stop_id"])
+            idx.stop_ids = pd.Index(node_key.unique())
+            key_to_idx = {k: i for i, k in enumerate(idx.stop_ids)}
+            idx.stop_to_idx = {sid: key_to_idx[k] for sid, k in zip(stops["stop_id"], node_key)}
+            idx.stop_to_idx.update(key_to_idx)
+            idx.platform_ids = pd.Index(stops["stop_id"])
+            idx.foot_platforms = {}
+        else:
+            idx.stop_ids = pd.Index(stops["stop_id"].unique())
+            idx.stop_to_idx = {sid: i for i, sid in enumerate(idx.stop_ids)}
         st["stop_sequence"] = st["stop_sequence"].astype(int)
         st = st.sort_values(["trip_id", "stop_sequence"])
         st["stop_i"] = st["stop_id"].map(idx.stop_to_idx)
+        if collapse_stations:
+            st["platform_i"] = idx.platform_ids.get_indexer(st["stop_id"])
 
         # trips as numpy
         trips = {}
@@ -74,6 +120,8 @@ class RaptorIndex:
                 "arr": g["arr_sec"].to_numpy(dtype=np.int64, copy=True),
                 "dep": g["dep_sec"].to_numpy(dtype=np.int64, copy=True),
             }
+            if collapse_stations:
+                trips[tid]["platforms"] = g["platform_i"].to_numpy(dtype=np.int32, copy=False)
         idx.trips = trips
 
         # stop -> first index in trip
@@ -111,46 +159,106 @@ class RaptorIndex:
 
         # footpaths from transfers.txt (+ zero-weight self-loop)
         foot = defaultdict(list)
-        for sid in feed.stops["stop_id"].drop_duplicates():
-            i = idx.stop_to_idx.get(sid)
-            if i is not None:
-                foot[i].append((i, 0))
-        tr = getattr(feed, "transfers", None)
+        for i in range(nstops):
+            foot[i].append((i, 0))
         if tr is not None and not tr.empty:
-            tr = tr[["from_stop_id", "to_stop_id", "transfer_type", "min_transfer_time"]].copy()
-            tr["transfer_type"] = tr["transfer_type"].fillna(0).astype(int)
-            tr = tr[tr["transfer_type"] != 3]  # disallow-only edges removed
-            tr["min_transfer_time"] = tr["min_transfer_time"].fillna(0).astype(int)
             for a, b, w in tr[["from_stop_id", "to_stop_id", "min_transfer_time"]].itertuples(
                     index=False, name=None
             ):
                 ia = idx.stop_to_idx.get(a)
                 ib = idx.stop_to_idx.get(b)
-                if ia is not None and ib is not None:
+                # transfers inside a contracted station are covered by the transfer penalty
+                if ia is not None and ib is not None and ia != ib:
                     foot[ia].append((ib, int(w)))
+                    if idx.foot_platforms is not None:
+                        # the platforms of the quickest transfer between two contracted stations
+                        known = idx.foot_platforms.get((ia, ib))
+                        if known is None or int(w) < known[2]:
+                            idx.foot_platforms[(ia, ib)] = (a, b, int(w))
         idx.foot = foot
         return idx
 
 
-def raptor_route(
-        index: RaptorIndex,
-        start_stop_id,
-        end_stop_id,
-        departure_time="08:00:00",
-        max_rounds=8,
-):
-    if index.nstops == 0:
-        return None
-    s_idx = index.stop_to_idx.get(start_stop_id)
-    t_idx = index.stop_to_idx.get(end_stop_id)
-    if s_idx is None or t_idx is None:
-        return None
+class Leg:
+    """
+    One part of a journey: riding `trip_id` from position `board` to `alight` of the
+    trip's stop arrays, or walking (no trip, no positions). `stops` and `times` list
+    every stop passed with its departure (first stop) or arrival time in seconds.
+    """
 
-    dep0 = _parse_gtfs_time(str(departure_time))
+    __slots__ = ("kind", "trip_id", "board", "alight", "dep", "arr", "stops", "times")
+
+    def __init__(self, kind, trip_id, board, alight, dep, arr, stops, times):
+        self.kind = kind
+        self.trip_id = trip_id
+        self.board = board
+        self.alight = alight
+        self.dep = dep
+        self.arr = arr
+        self.stops = stops
+        self.times = times
+
+    @property
+    def from_stop(self):
+        return self.stops[0]
+
+    @property
+    def to_stop(self):
+        return self.stops[-1]
+
+    @property
+    def duration(self) -> int:
+        return self.arr - self.dep
+
+    def to_dict(self) -> dict:
+        return {"kind": self.kind, "trip_id": self.trip_id, "board": self.board, "alight": self.alight,
+                "dep": self.dep, "arr": self.arr, "stops": list(self.stops), "times": list(self.times)}
+
+    def __repr__(self):
+        via = self.trip_id if self.kind == "trip" else f"{self.duration}s"
+        return f"<Leg {self.kind} {via} {self.from_stop} -> {self.to_stop}>"
+
+
+class Journey:
+    """A RAPTOR result: legs in travel order, every stop on the way and the arrival time."""
+
+    __slots__ = ("legs", "stops", "departure_sec", "arrival_sec")
+
+    def __init__(self, legs, stops, departure_sec, arrival_sec):
+        self.legs = legs
+        self.stops = stops
+        self.departure_sec = departure_sec
+        self.arrival_sec = arrival_sec
+
+    @property
+    def trips(self) -> list:
+        """The trip of every stop-to-stop hop ridden, so a trip shows up once per hop."""
+        return [leg.trip_id for leg in self.legs if leg.kind == "trip" for _ in range(leg.alight - leg.board)]
+
+    @property
+    def transfers(self) -> int:
+        return max(0, sum(leg.kind == "trip" for leg in self.legs) - 1)
+
+    def to_dict(self) -> dict:
+        return {"departure_sec": self.departure_sec, "arrival_sec": self.arrival_sec,
+                "stops": list(self.stops), "legs": [leg.to_dict() for leg in self.legs]}
+
+    def __repr__(self):
+        return f"<Journey {len(self.legs)} legs, {self.transfers} transfers, arrival {self.arrival_sec}>"
+
+
+def _search(index: RaptorIndex, s_idx: int, dep0: float, max_rounds: int, t_idx: int | None = None,
+            allowed: np.ndarray | None = None, rounds: list | None = None):
+    """
+    The RAPTOR rounds from `s_idx`: best arrival per stop and the parents per round.
+    Stops after the round that reaches `t_idx`, without one it searches every stop
+    (one-to-all). `allowed` masks the routes of index.partition that may be boarded.
+    """
     INF = math.inf
     best_prev = [INF] * index.nstops
     best_prev[s_idx] = dep0
     parents = [dict() for _ in range(max_rounds + 1)]
+    events_route = index.partition.events_route if allowed is not None else None
 
     def relax_footpaths(best, seeds):
         pq = []
@@ -177,11 +285,11 @@ def raptor_route(
 
     # initial walk
     marked, pred0 = relax_footpaths(best_prev, {s_idx})
+    # stops last reached by a trip, boarding another one there changes inside the station
+    rode = set()
     for v, u in pred0.items():
         if u is not None:
-            parents[1][v] = (u, None)
-
-    DAY = 86400
+            parents[1][v] = (u, None, None)
 
     for r in range(1, max_rounds + 1):
         best_cur = best_prev[:]  # copy
@@ -189,7 +297,8 @@ def raptor_route(
 
         # collect routes using per-stop departure events
         for si in marked:
-            t_arr = best_prev[si]
+            # changing trips inside a contracted station isn't free, a footpath already paid its time
+            t_arr = best_prev[si] + (index.transfer_penalty if si in rode else 0)
             dep_arr = index.events_dep[si]
             if dep_arr.size == 0 or t_arr >= INF:
                 continue
@@ -209,13 +318,19 @@ def raptor_route(
 
             tid_arr = index.events_tid[si]
             idx_arr = index.events_idx[si]
-            for k in range(lo, hi):
+            events = range(lo, hi)
+            if events_route is not None:
+                # only routes flagged for the target cell
+                events = (lo + np.flatnonzero(allowed[events_route[si][lo:hi]])).tolist()
+            for k in events:
                 tid = tid_arr[k]
                 j = int(idx_arr[k])
                 prev = route_queue.get(tid)
                 if prev is None or j < prev:
                     route_queue[tid] = j
 
+        if rounds is not None:
+            rounds.append({"marked": len(marked), "trips": len(route_queue), "improved": 0, "walked": 0})
         if not route_queue:
             break
 
@@ -230,7 +345,7 @@ def raptor_route(
                 av = int(arr[k])
                 if av < best_cur[v]:
                     best_cur[v] = av
-                    parents[r][v] = (prev_stop, tid)
+                    parents[r][v] = (prev_stop, tid, k)
                     new_marked.add(v)
                 prev_stop = v
 
@@ -239,58 +354,139 @@ def raptor_route(
             break
 
         fp_improved, pred = relax_footpaths(best_cur, new_marked)
+        if rounds is not None:
+            rounds[-1]["improved"] = len(new_marked)
+            rounds[-1]["walked"] = len(fp_improved) - len(new_marked & fp_improved)
         for v in fp_improved:
             if v in new_marked:
                 continue
             u = pred.get(v)
             if u is not None and v not in parents[r]:
-                parents[r][v] = (u, None)
+                parents[r][v] = (u, None, None)
 
         best_prev = best_cur
         marked = fp_improved
-        if best_prev[t_idx] < INF:
+        rode = {v for v in new_marked if pred.get(v) is None}
+        if t_idx is not None and best_prev[t_idx] < INF:
             break
 
-    if best_prev[t_idx] >= INF:
-        return None
+    return best_prev, parents
 
-    # reconstruct
-    stop_ids = index.stop_ids
+
+def _hops(parents: list, s_idx: int, t_idx: int, max_rounds: int) -> deque:
+    """(previous stop, trip or None for a walk, trip position, stop) of every hop to `t_idx`, in travel order."""
     final_r = 0
     for rr in range(max_rounds, 0, -1):
         if t_idx in parents[rr]:
             final_r = rr
             break
-    path = deque([t_idx])
-    legs = deque()
+    hops = deque()
     cur = t_idx
     rr = final_r
     while cur != s_idx and rr > 0:
         if cur not in parents[rr]:
             rr -= 1
             continue
-        prev, via = parents[rr][cur]
-        if via is None:
-            legs.appendleft(("walk", best_prev[cur] - best_prev[prev], stop_ids[prev], stop_ids[cur]))
-        else:
-            legs.appendleft(("trip", via, stop_ids[prev], stop_ids[cur]))
-        path.appendleft(prev)
+        prev, via, k = parents[rr][cur]
+        hops.appendleft((prev, via, k, cur))
         cur = prev
         if cur not in parents[rr]:
             rr -= 1
+    return hops
+
+
+@route_seconds.timed
+def raptor_route(
+        index: RaptorIndex,
+        start_stop_id,
+        end_stop_id,
+        departure_time="08:00:00",
+        max_rounds=8,
+        stats: dict | None = None,
+        pruned: bool = True,
+):
+    """
+    Earliest arrival journey from one stop to another, None if there is none.
+    With `stats`, per round counts of marked stops, scanned trips and improved stops
+    are collected into it (see lib/slowlog.py).
+
+    If the index has a partition, only the routes its arc flags allow are scanned
+    unless `pruned` is False. The flags cover journeys departing during the service
+    day with at most partition.rounds rounds, the others search the whole network.
+    """
+    if index.nstops == 0:
+        return None
+    s_idx = index.stop_to_idx.get(start_stop_id)
+    t_idx = index.stop_to_idx.get(end_stop_id)
+    if s_idx is None or t_idx is None:
+        return None
+
+    dep0 = _parse_gtfs_time(str(departure_time))
+    INF = math.inf
+    rounds = stats.setdefault("rounds", []) if stats is not None else None
+    partition = index.partition if pruned else None
+    allowed = None
+    if partition is not None and max_rounds <= partition.rounds and dep0 < DAY:
+        allowed = partition.allowed(t_idx)
+    best_prev, parents = _search(index, s_idx, dep0, max_rounds, t_idx, allowed, rounds)
+    if partition is not None:
+        result = "full" if allowed is None else "pruned"
+        partition_queries.inc(result)
+        if stats is not None:
+            stats["partition"] = result
 
-    # merge consecutive walks
-    merged = []
-    for leg in legs:
-        if merged and leg[0] == "walk" and merged[-1][0] == "walk" and merged[-1][3] == leg[2]:
-            _, t_old, a_old, b_old = merged.pop()
-            merged.append(("walk", t_old + leg[1], a_old, leg[3]))
+    if best_prev[t_idx] >= INF:
+        return None
+
+    # reconstruct
+    stop_ids = index.stop_ids
+    platform_ids = index.platform_ids
+    hops = deque()
+    for prev, via, k, cur in _hops(parents, s_idx, t_idx, max_rounds):
+        if via is None:
+            hops.append((None, best_prev[cur] - best_prev[prev], prev, cur))
+        else:
+            hops.append((via, k, prev, cur))
+    path = [stop_ids[hops[0][2]]] + [stop_ids[h[3]] for h in hops] if hops else [stop_ids[t_idx]]
+    if platform_ids is not None and not hops:
+        path = [end_stop_id]
+
+    # consecutive hops of one trip become one leg, consecutive walks are merged
+    legs = []
+    t = int(dep0)
+    for via, x, prev, cur in hops:
+        last = legs[-1] if legs else None
+        if via is None:
+            ends = (stop_ids[prev], stop_ids[cur]) if platform_ids is None else index.foot_platforms[prev, cur][:2]
+            if last is not None and last.kind == "walk":
+                last.arr += int(x)
+                last.stops = (last.stops[0], ends[1])
+                last.times = (last.dep, last.arr)
+            else:
+                legs.append(Leg("walk", None, None, None, t, t + int(x), ends, (t, t + int(x))))
+            t = legs[-1].arr
+            continue
+        tp = index.trips[via]
+        if last is not None and last.trip_id == via and last.alight == x - 1:
+            last.alight = x
         else:
-            merged.append(leg)
-
-    return {
-        "stops": [stop_ids[i] for i in path],
-        "trips": [x[1] for x in merged if x[0] == "trip"],
-        "legs": list(merged),
-        "arrival_time_sec": int(best_prev[t_idx]),
-    }
+            last = Leg("trip", via, x - 1, x, None, None, None, None)
+            legs.append(last)
+        # platforms of contracted stations are expanded back from the trip
+        nodes = tp["stops"] if platform_ids is None else tp["platforms"]
+        names = stop_ids if platform_ids is None else platform_ids
+        last.stops = tuple(names[nodes[last.board:last.alight + 1]])
+        last.times = (int(tp["dep"][last.board]), *tp["arr"][last.board + 1:last.alight + 1].tolist())
+        last.dep, last.arr = last.times[0], last.times[-1]
+        t = last.arr
+
+    if platform_ids is not None and legs:
+        for i, leg in enumerate(legs):
+            if leg.kind == "walk":
+                # from the platform the trip before arrives at to the one the trip after leaves from
+                leg.stops = (legs[i - 1].to_stop if i > 0 else leg.stops[0],
+                             legs[i + 1].from_stop if i + 1 < len(legs) else leg.stops[-1])
+        # the path follows the expanded legs
+        path = [legs[0].from_stop] + [sid for leg in legs for sid in leg.stops[1:]]
+
+    return Journey(legs, list(path), legs[0].dep if legs else int(dep0), int(best_prev[t_idx]))
@@ -0,0 +1,284 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+import pandas as pd
+import requests
+from google.transit import gtfs_realtime_pb2 as gtfs_rt
+
+from openfahrplan.lib.metrics import realtime_fetch_seconds, realtime_decode_seconds, realtime_fetches
+
+DEFAULT_REALTIME_URL = "https://realtime.gtfs.de/realtime-free.pb"
+
+ALERT_COLUMNS = ["entity_id", "stop_id", "route_id", "trip_id", "agency_id", "effect", "cause", "header"]
+TRIP_UPDATE_COLUMNS = ["entity_id", "trip_id", "route_id", "timestamp", "stop_id", "seq", "arr_time", "dep_time",
+                       "schedule_rel", "arr_delay", "dep_delay"]
+
+
+def local_path(url: str) -> Path | None:
+    """The file behind a plain path or file:// URL, None for remote sources."""
+    parsed = urlparse(url)
+    if parsed.scheme == "file":
+        return Path(url2pathname(parsed.path))
+    if parsed.scheme == "":
+        return Path(url)
+    return None
+
+
+def fetch_content(url: str = DEFAULT_REALTIME_URL, timeout: float = 15.0) -> bytes:
+    """One-off download of a GTFS-RT feed from an HTTP(S) URL, a file:// URL or a path."""
+    path = local_path(url)
+    if path is not None:
+        return path.read_bytes()
+    r = requests.get(url, timeout=timeout)
+    r.raise_for_status()
+    return r.content
+
+
+def parse_feed(content: bytes) -> gtfs_rt.FeedMessage:
+    f = gtfs_rt.FeedMessage()
+    f.ParseFromString(content)
+    return f
+
+
+def decode_feed(f: gtfs_rt.FeedMessage, stop_ids: frozenset | None = None, trip_ids: frozenset | None = None,
+                route_ids: frozenset | None = None) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Flatten a GTFS-RT FeedMessage into (trip_updates, alerts) frames.
+
+    With `stop_ids`, `trip_ids` or `route_ids` only what concerns them is kept: trip
+    updates of the given trips or routes in full, of other trips the stop time
+    updates at the given stops, and informed entities naming a given stop, trip or
+    route. A trip update is judged by its trip first: without `stop_ids` the stop
+    time updates of other trips are never read, with them only their stop ids are.
+    Columns are filled directly instead of going through one dict per row.
+    """
+    filtered = stop_ids is not None or trip_ids is not None or route_ids is not None
+    stops, trips, routes = stop_ids or frozenset(), trip_ids or frozenset(), route_ids or frozenset()
+    tu = {c: [] for c in TRIP_UPDATE_COLUMNS}
+    al = {c: [] for c in ALERT_COLUMNS}
+
+    for e in f.entity:
+        if e.HasField("trip_update"):
+            t = e.trip_update
+            updates = t.stop_time_update
+            if filtered and not ((trips or routes) and (t.trip.trip_id in trips or t.trip.route_id in routes)):
+                updates = [stu for stu in updates if stu.stop_id in stops] if stops else ()
+            n = len(updates)
+            trip, route = (t.trip.trip_id, t.trip.route_id) if n else (None, None)
+            ts = t.timestamp if n and t.HasField("timestamp") else None
+            tu["entity_id"] += [e.id] * n
+            tu["trip_id"] += [trip] * n
+            tu["route_id"] += [route] * n
+            tu["timestamp"] += [ts] * n
+            for stu in updates:
+                arr, dep = stu.arrival, stu.departure
+                tu["stop_id"].append(stu.stop_id)
+                tu["seq"].append(stu.stop_sequence)
+                # a time of 0 is the unix epoch, never a real arrival or departure
+                tu["arr_time"].append(arr.time or None)
+                tu["dep_time"].append(dep.time or None)
+                tu["schedule_rel"].append(stu.schedule_relationship)
+                tu["arr_delay"].append(arr.delay if arr.HasField("delay") else None)
+                tu["dep_delay"].append(dep.delay if dep.HasField("delay") else None)
+        if e.HasField("alert"):
+            a = e.alert
+            header = None
+            for ie in a.informed_entity:
+                if filtered and ie.stop_id not in stops and ie.route_id not in routes and ie.trip.trip_id not in trips:
+                    continue
+                if header is None:
+                    header = a.header_text.translation[0].text if a.header_text.translation else ""
+                al["entity_id"].append(e.id)
+                al["stop_id"].append(ie.stop_id or None)
+                al["route_id"].append(ie.route_id or None)
+                al["trip_id"].append(ie.trip.trip_id or None)
+                al["agency_id"].append(ie.agency_id or None)
+                al["effect"].append(int(a.effect))
+                al["cause"].append(int(a.cause))
+                al["header"].append(header)
+
+    trip_updates = pd.DataFrame(tu, columns=TRIP_UPDATE_COLUMNS)
+    alerts = pd.DataFrame(al, columns=ALERT_COLUMNS)
+    alerts["stop_id"] = alerts["stop_id"].astype("string")
+    return trip_updates, alerts
+
+
+class RealtimeSnapshot:
+    """
+    The decoded result of one GTFS-RT fetch. Snapshots are shared by all callbacks
+    and must be treated as read-only; a new fetch always produces a new snapshot.
+
+    `version` numbers the snapshots of one poller, so it only means something inside
+    one process. `content_id` is derived from the fetched feed itself and is the same
+    in every worker or pod that fetched it, which is what clients compare against.
+    """
+
+    __slots__ = ("version", "content_id", "fetched_at", "feed_timestamp", "trip_updates", "alerts")
+
+    def __init__(self, version: int, fetched_at: float, feed_timestamp: int | None,
+                 trip_updates: pd.DataFrame, alerts: pd.DataFrame, content_id: str = ""):
+        self.version = version
+        self.content_id = content_id
+        self.fetched_at = fetched_at
+        self.feed_timestamp = feed_timestamp
+        self.trip_updates = trip_updates
+        self.alerts = alerts
+
+    @classmethod
+    def empty(cls) -> "RealtimeSnapshot":
+        return cls(0, 0.0, None,
+                   pd.DataFrame(columns=TRIP_UPDATE_COLUMNS),
+                   pd.DataFrame(columns=ALERT_COLUMNS).astype({"stop_id": "string"}))
+
+    @classmethod
+    def from_content(cls, content: bytes, version: int = 1, stop_ids: frozenset | None = None,
+                     trip_ids: frozenset | None = None, route_ids: frozenset | None = None) -> "RealtimeSnapshot":
+        f = parse_feed(content)
+        trip_updates, alerts = decode_feed(f, stop_ids, trip_ids, route_ids)
+        ts = f.header.timestamp if f.header.HasField("timestamp") else None
+        content_id = f"{ts or 0}-{hashlib.blake2b(content, digest_size=8).hexdigest()}"
+        return cls(version, time.time(), ts, trip_updates, alerts, content_id)
+
+    @property
+    def disruptions(self) -> pd.DataFrame:
+        """Alerts that name a stop."""
+        return self.alerts[self.alerts["stop_id"].notna()][["stop_id", "header", "cause", "effect"]]
+
+    def age(self) -> float:
+        return time.time() - self.fetched_at if self.fetched_at else float("inf")
+
+    def __repr__(self):
+        return f"<RealtimeSnapshot v{self.version} alerts={len(self.alerts)} trip_updates={len(self.trip_updates)}>"
+
+
+class RealtimePoller:
+    """
+    Fetches the GTFS-RT feed on a schedule in a background thread and publishes
+    every change as a new RealtimeSnapshot.
+
+    HTTP sources are fetched over one keep-alive session with conditional requests
+    (ETag / If-Modified-Since), so an unchanged feed is neither downloaded nor parsed
+    again. A file:// URL or a plain path reads a local .pb instead, which is what
+    tests and offline runs use.
+
+    `stop_filter` returns the realtime stop ids relevant to the loaded feed (or None
+    for everything), `trip_filter` and `route_filter` likewise the trip and route ids;
+    they are asked on every fetch so feed reloads are picked up.
+    `listeners` are called with every new snapshot from the polling thread.
+    """
+
+    def __init__(self, url: str = DEFAULT_REALTIME_URL, interval: float = 60.0, timeout: float = 15.0,
+                 stop_filter=None, listeners=(), trip_filter=None, route_filter=None):
+        self.url = url
+        self.interval = interval
+        self.timeout = timeout
+        self.stop_filter = stop_filter
+        self.trip_filter = trip_filter
+        self.route_filter = route_filter
+        self.listeners = list(listeners)
+        self._session = requests.Session()
+        self._snapshot = RealtimeSnapshot.empty()
+        self._validators = {}
+        self._first = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._thread = None
+
+    def snapshot(self, wait: float = 0.0) -> RealtimeSnapshot:
+        """The latest snapshot. Starts polling on first use and optionally waits for the first fetch."""
+        if self._thread is None:
+            self.start()
+        if wait:
+            self._first.wait(wait)
+        return self._snapshot
+
+    def latest(self) -> RealtimeSnapshot:
+        """The latest snapshot without starting the poller."""
+        return self._snapshot
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._loop, name="gtfs-rt-poller", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    def refresh(self) -> bool:
+        """Fetch once. Returns True if a new snapshot was published."""
+        # the poll thread and manual refreshes share the validators and number the versions
+        with self._refresh_lock:
+            return self._refresh()
+
+    def _refresh(self) -> bool:
+        try:
+            with realtime_fetch_seconds.time():
+                content = self._fetch()
+        except requests.Timeout:
+            realtime_fetches.inc("timeout")
+            raise
+        except Exception:
+            realtime_fetches.inc("error")
+            raise
+        if content is None:
+            realtime_fetches.inc("unchanged")
+            return False
+        realtime_fetches.inc("new")
+        filters = {"stop_ids": self.stop_filter() if self.stop_filter else None,
+                   "trip_ids": self.trip_filter() if self.trip_filter else None,
+                   "route_ids": self.route_filter() if self.route_filter else None}
+        with realtime_decode_seconds.time():
+            snapshot = RealtimeSnapshot.from_content(content, version=self._snapshot.version + 1, **filters)
+        self._snapshot = snapshot
+        logging.info(f"Published realtime snapshot {snapshot}")
+        for listener in self.listeners:
+            try:
+                listener(snapshot)
+            except Exception:
+                logging.exception(f"Realtime listener {listener!r} failed for {snapshot}")
+        return True
+
+    def _fetch(self) -> bytes | None:
+        path = local_path(self.url)
+        if path is not None:
+            stamp = os.stat(path).st_mtime_ns
+            if self._validators.get("mtime") == stamp:
+                return None
+            self._validators["mtime"] = stamp
+            return path.read_bytes()
+
+        headers = {}
+        if "etag" in self._validators:
+            headers["If-None-Match"] = self._validators["etag"]
+        if "last_modified" in self._validators:
+            headers["If-Modified-Since"] = self._validators["last_modified"]
+        r = self._session.get(self.url, headers=headers, timeout=self.timeout)
+        if r.status_code == 304:
+            return None
+        r.raise_for_status()
+        self._validators = {k: v for k, v in (("etag", r.headers.get("ETag")),
+                                              ("last_modified", r.headers.get("Last-Modified"))) if v}
+        return r.content
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception:
+                logging.exception(f"Realtime fetch from {self.url} failed, keeping snapshot v{self._snapshot.version}")
+            finally:
+                self._first.set()
+            self._stop.wait(self.interval)
@@ -0,0 +1,285 @@
+import gc
+import gzip
+import hashlib
+import json
+import logging
+import threading
+import time
+import weakref
+from functools import cached_property
+from pathlib import Path
+
+from openfahrplan.lib.departures import DepartureBoard, DelayIndex
+from openfahrplan.lib.disruptions import DisruptionIndex
+from openfahrplan.lib.gtfs import GTFSFeed
+from openfahrplan.lib.lines import LineIndex
+from openfahrplan.lib.memory import check_budget, report
+from openfahrplan.lib.metrics import cache_requests
+from openfahrplan.lib.network import TransferNetwork
+from openfahrplan.lib.partition import RoutePartition, partition_path
+from openfahrplan.lib.raptor import RaptorIndex
+from openfahrplan.lib.realtime import DEFAULT_REALTIME_URL
+from openfahrplan.lib.startup import StartupReport
+
+
+def feed_fingerprint(data: Path, name: str = "vgn") -> str:
+    """
+    Cheap version id of a feed on disk, derived from the names, sizes and mtimes
+    of its parquet files. Changes whenever a new timetable is dropped in.
+    """
+    h = hashlib.sha1(name.encode())
+    for f in sorted((data / "parquet" / name).glob("*.parquet")):
+        st = f.stat()
+        h.update(f"{f.name}:{st.st_size}:{st.st_mtime_ns}".encode())
+    return h.hexdigest()[:12]
+
+
+class FeedVersion:
+    """One fully built version of the timetable and everything derived from it."""
+
+    def __init__(self, data: Path, name: str = "vgn", raptor_options: dict | None = None,
+                 realtime_url: str = DEFAULT_REALTIME_URL):
+        self.data = data
+        self.name = name
+        self.raptor_options = raptor_options or {}
+        self.version = feed_fingerprint(data, name)
+        self.loaded_at = time.time()
+        self._per_snapshot = {}
+        # build time per index in seconds, part of the startup report
+        self.timings = {}
+        self.feed = self._timed("feed", lambda: GTFSFeed(data, name, realtime_url))
+        options = dict(self.raptor_options)
+        cells = options.pop("cells", 0)
+        self.raptor_index = self._timed("raptor_index", lambda: RaptorIndex.from_feed(self.feed, **options))
+        if cells:
+            self.raptor_index.partition = self._timed("partition", lambda: self._load_partition(cells))
+        # warm up lazily built indexes so the first request doesn't pay for them
+        for attr in ("search_index", "stop_graph", "realtime_stop_ids", "trip_geometry"):
+            self._timed(attr, lambda: getattr(self.feed, attr))
+        for attr in ("departures", "lines"):
+            self._timed(attr, lambda: getattr(self, attr))
+
+    def _load_partition(self, cells: int) -> RoutePartition | None:
+        """The arc flags built for this version with python -m openfahrplan.lib.partition, if any."""
+        index = self.raptor_index
+        if index.transfer_penalty:
+            logging.warning("Arc flags need OPENFAHRPLAN_RAPTOR_TRANSFER_PENALTY=0, routing without them")
+            return None
+        path = partition_path(self.data, self.version, cells, self.raptor_options.get("prune_unserved", False),
+                              self.raptor_options.get("collapse_stations", False))
+        try:
+            return RoutePartition.load(path, index)
+        except FileNotFoundError:
+            logging.warning(f"No arc flags in {path} for feed version {self.version}, routing without them")
+        except (OSError, ValueError, KeyError):
+            logging.exception(f"Can't use the arc flags in {path}, routing without them")
+        return None
+
+    def _timed(self, phase: str, build):
+        start = time.perf_counter()
+        result = build()
+        self.timings[phase] = time.perf_counter() - start
+        return result
+
+    @cached_property
+    def station_bundle(self) -> bytes:
+        """Gzipped JSON of all searchable stations, served once to every browser."""
+        bundle = self.feed.search_index.bundle(self.version)
+        return gzip.compress(json.dumps(bundle, ensure_ascii=False, separators=(",", ":")).encode())
+
+    @cached_property
+    def departures(self) -> DepartureBoard:
+        return DepartureBoard(self.feed)
+
+    @cached_property
+    def lines(self) -> LineIndex:
+        return LineIndex(self.feed)
+
+    @cached_property
+    def transfer_network(self) -> TransferNetwork:
+        return TransferNetwork(self.feed)
+
+    def _snapshot_index(self, kind: str, snapshot, build):
+        # one index per kind, rebuilt only when a new snapshot arrives
+        version, index = self._per_snapshot.get(kind, (None, None))
+        if version != snapshot.version:
+            cache_requests.inc(kind, "miss")
+            index = build()
+            self._per_snapshot[kind] = (snapshot.version, index)
+        else:
+            cache_requests.inc(kind, "hit")
+        return index
+
+    def disruptions(self, snapshot) -> DisruptionIndex:
+        """Disruption index for a realtime snapshot."""
+        return self._snapshot_index("disruptions", snapshot,
+                                    lambda: DisruptionIndex(snapshot.alerts, self.feed.stop_mapping))
+
+    def delays(self, snapshot) -> DelayIndex:
+        """Departure delays of a realtime snapshot, matched to the stops of this feed."""
+        return self._snapshot_index("delays", snapshot, lambda: DelayIndex(
+            snapshot.trip_updates, self.feed.stop_mapping, self.feed.stop_graph.pos, self.departures.timezone))
+
+    def __repr__(self):
+        return f"<FeedVersion {self.name}@{self.version}>"
+
+
+class FeedRegistry:
+    """
+    Holds the feed version that is currently served and swaps in new ones.
+
+    Callers grab `current()` once per request and keep using that object, so a
+    swap never changes data under a running request. The old version is freed
+    as soon as the last request holding it returns.
+
+    `start()` builds the first version in the background so the server can come
+    up right away; `ready` tells the readiness probe when it is done.
+
+    With a `memory_budget` in bytes every new version is measured before it is
+    swapped in, one that doesn't fit is dropped (MemoryBudgetExceeded).
+    """
+
+    def __init__(self, data: Path, name: str = "vgn", raptor_options: dict | None = None,
+                 realtime_url: str = DEFAULT_REALTIME_URL, startup: StartupReport | None = None,
+                 memory_budget: int | None = None):
+        self.data = data
+        self.name = name
+        self.raptor_options = raptor_options or {}
+        self.realtime_url = realtime_url
+        self.startup = startup
+        self.memory_budget = memory_budget
+        # memory report of the served version, only measured with a budget
+        self.memory = None
+        # measured by memory_report when there is no budget, once per version
+        self._measured = None
+        self._measure_lock = threading.Lock()
+        self.error = None
+        self._current = None
+        # every version still referenced, by the registry or by a running request
+        self._live = weakref.WeakSet()
+        self._build_lock = threading.Lock()
+        self._first_load = None
+        self._loaded = threading.Event()
+        self._watcher = None
+
+    @property
+    def ready(self) -> bool:
+        return self._current is not None
+
+    def current(self, timeout: float | None = None) -> FeedVersion:
+        """
+        The version that is served right now. While the first version is still
+        being built by `start()`, waits for it up to `timeout` seconds.
+        """
+        version = self._current
+        # a forked worker has the thread object but not the thread, nothing to wait for there
+        if version is None and self._first_load is not None and self._first_load.is_alive():
+            self._loaded.wait(timeout)
+            version = self._current
+        if version is None:
+            if self.error is not None:
+                raise RuntimeError("Loading the feed failed") from self.error
+            raise RuntimeError("No feed version loaded yet")
+        return version
+
+    def start(self) -> threading.Thread:
+        """Build the first version in a background thread."""
+        if self._first_load is not None:
+            return self._first_load
+
+        def _load():
+            try:
+                self.load()
+            except Exception as e:
+                logging.exception("Loading the feed failed")
+                self.error = e
+            finally:
+                self._loaded.set()
+
+        self._first_load = threading.Thread(target=_load, name="feed-load", daemon=True)
+        self._first_load.start()
+        return self._first_load
+
+    def load(self) -> FeedVersion:
+        """Build a new version synchronously and swap it in."""
+        with self._build_lock:
+            start = time.perf_counter()
+            logging.info(f"Building feed version from {self.data}...")
+            version = FeedVersion(self.data, self.name, self.raptor_options, self.realtime_url)
+            memory = version._timed("memory", lambda: check_budget(version, self.memory_budget))
+            first = self._current is None
+            self._live.add(version)
+            self._swap(version)
+            self.memory = memory
+            logging.info(f"Feed version {version.version} ready after {time.perf_counter() - start:.1f}s")
+            if first and self.startup is not None:
+                for phase, seconds in version.timings.items():
+                    self.startup.record(f"feed.{phase}", seconds)
+                logging.info(f"Ready {self.startup.elapsed():.1f}s after start")
+            return version
+
+    def live_versions(self) -> set[str]:
+        """Ids of the versions this process still holds, the served one and any old one a request is using."""
+        return {v.version for v in list(self._live)}
+
+    def memory_report(self) -> dict:
+        """
+        Memory report of the served version: the one taken at load with a budget,
+        else measured on the first call and kept until the next version.
+        """
+        version = self.current()
+        memory = self.memory
+        if memory is not None and memory["feed"] == version.version:
+            return memory
+        with self._measure_lock:
+            if self._measured is None or self._measured["feed"] != version.version:
+                self._measured = report(version, self.memory_budget)
+            return self._measured
+
+    def reload(self, background: bool = True):
+        """
+        Build the next version while the current one keeps serving.
+        Returns the builder thread, or the new version if `background` is False.
+        """
+        if not background:
+            return self.load()
+        thread = threading.Thread(target=self._reload_safely, name="feed-reload", daemon=True)
+        thread.start()
+        return thread
+
+    def watch(self, interval: float = 60.0) -> threading.Thread:
+        """Poll the data folder and reload whenever its fingerprint changes."""
+        if self._watcher is not None:
+            return self._watcher
+
+        def _loop():
+            while True:
+                time.sleep(interval)
+                current = self._current
+                if current is None or self._build_lock.locked():
+                    continue
+                try:
+                    changed = feed_fingerprint(self.data, self.name) != current.version
+                except OSError:
+                    logging.exception("Failed to fingerprint feed data")
+                    continue
+                if changed:
+                    logging.info("Feed data changed on disk, reloading...")
+                    self._reload_safely()
+
+        self._watcher = threading.Thread(target=_loop, name="feed-watch", daemon=True)
+        self._watcher.start()
+        return self._watcher
+
+    def _reload_safely(self):
+        try:
+            self.load()
+        except Exception:
+            logging.exception("Feed reload failed, keeping current version")
+
+    def _swap(self, version: FeedVersion):
+        old, self._current = self._current, version
+        if old is not None:
+            logging.info(f"Swapped feed version {old.version} -> {version.version}")
+            del old
+            gc.collect()
@@ -0,0 +1,227 @@
+"""
+Replay recorded GTFS-RT snapshots over HTTP, so the whole realtime path can be
+load-tested and benchmarked without network access.
+
+    python -m openfahrplan.lib.replay record data/recordings --count 60
+    python -m openfahrplan.lib.replay serve data/recordings --rate 10 --latency 0.2 --pattern 200,200,503,timeout
+    OPENFAHRPLAN_REALTIME_URL=http://localhost:8060/realtime.pb python -m openfahrplan
+"""
+import argparse
+import bisect
+import hashlib
+import itertools
+import logging
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from openfahrplan.lib.realtime import DEFAULT_REALTIME_URL, fetch_content
+
+# outcomes of a request besides plain status codes
+OUTCOMES = ("ok", "timeout", "truncated", "reset")
+
+
+def record(url: str, folder: Path, interval: float = 60.0, count: int | None = None) -> list[Path]:
+    """Download the feed every `interval` seconds into <folder>/<unix time>.pb."""
+    folder.mkdir(parents=True, exist_ok=True)
+    written = []
+    for i in itertools.count():
+        if count is not None and i >= count:
+            break
+        started = time.time()
+        try:
+            path = folder / f"{int(started)}.pb"
+            path.write_bytes(fetch_content(url))
+            written.append(path)
+            logging.info(f"Recorded {path}")
+        except Exception:
+            logging.exception(f"Recording {url} failed")
+        time.sleep(max(0.0, interval - (time.time() - started)))
+    return written
+
+
+class ReplayServer:
+    """
+    Serves a directory of recorded .pb snapshots as if it was the live feed.
+
+    Snapshots are played back in file name order on their recorded timeline (file
+    names are unix times as written by `record`, otherwise their mtime is used),
+    `rate` times faster than real time, and start over at the end if `loop` is set.
+
+    Every request waits `latency` plus up to `jitter` seconds. Which requests fail is
+    controlled by `pattern`, a list of outcomes cycled per request (an HTTP status code
+    or one of "ok", "timeout", "truncated", "reset"), and/or `failure_rate`, the chance
+    that a request fails with a random code from `failure_codes`. ETag and
+    If-None-Match work like on the real server.
+    """
+
+    def __init__(self, folder: Path, rate: float = 1.0, latency: float = 0.0, jitter: float = 0.0,
+                 pattern: list[str | int] | None = None, failure_rate: float = 0.0,
+                 failure_codes: tuple[int, ...] = (500, 502, 503), loop: bool = True, timeout: float = 30.0,
+                 host: str = "127.0.0.1", port: int = 8060, seed: int | None = None):
+        self.files = sorted(Path(folder).glob("*.pb"))
+        if not self.files:
+            raise Exception(f"No .pb recordings found in {folder}")
+        stamps = [int(f.stem) if f.stem.isdigit() else f.stat().st_mtime for f in self.files]
+        self.offsets = [s - stamps[0] for s in stamps]
+        # the last snapshot is shown as long as the gap before it
+        last_gap = self.offsets[-1] - self.offsets[-2] if len(self.offsets) > 1 else 60.0
+        self.duration = self.offsets[-1] + max(1.0, last_gap)
+
+        self.rate = rate
+        self.latency = latency
+        self.jitter = jitter
+        self.pattern = [str(p) for p in pattern] if pattern else None
+        for p in self.pattern or ():
+            if p not in OUTCOMES and not p.isdigit():
+                raise ValueError(f"Unknown outcome {p!r} in pattern, expected a status code or one of {OUTCOMES}")
+        self.failure_rate = failure_rate
+        self.failure_codes = failure_codes
+        self.loop = loop
+        self.timeout = timeout
+
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._cache = {}
+        self._started = time.monotonic()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/realtime.pb"
+
+    def current(self) -> int:
+        """Index of the snapshot that is served right now."""
+        elapsed = (time.monotonic() - self._started) * self.rate
+        if self.loop:
+            elapsed %= self.duration
+        return bisect.bisect_right(self.offsets, elapsed) - 1
+
+    def _content(self, i: int) -> tuple[bytes, str]:
+        # only the snapshot being served is kept in memory
+        cached = self._cache.get(i)
+        if cached is None:
+            content = self.files[i].read_bytes()
+            cached = (content, f'"{hashlib.sha1(content).hexdigest()[:16]}"')
+            self._cache = {i: cached}
+        return cached
+
+    def _outcome(self) -> str:
+        with self._lock:
+            n = self.requests
+            self.requests += 1
+            failed = self.failure_rate and self._random.random() < self.failure_rate
+            code = self._random.choice(self.failure_codes) if failed else None
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay:
+            time.sleep(delay)
+        if code is not None:
+            return str(code)
+        return self.pattern[n % len(self.pattern)] if self.pattern else "ok"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                outcome = server._outcome()
+                if outcome == "reset":
+                    self.close_connection = True
+                    return
+                if outcome == "timeout":
+                    time.sleep(server.timeout)
+                    self.close_connection = True
+                    return
+                if outcome.isdigit() and outcome != "200":
+                    self.send_error(int(outcome))
+                    return
+
+                content, etag = server._content(server.current())
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(len(content)))
+                self.send_header("ETag", etag)
+                self.end_headers()
+                if outcome == "truncated":
+                    self.wfile.write(content[:len(content) // 2])
+                    self.close_connection = True
+                else:
+                    self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                logging.debug(f"replay: {format % args}")
+
+        return Handler
+
+    def start(self) -> "ReplayServer":
+        self._started = time.monotonic()
+        self._thread = threading.Thread(target=self._server.serve_forever, name="gtfs-rt-replay", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m openfahrplan.lib.replay", description=__doc__.splitlines()[1])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    rec = sub.add_parser("record", help="record snapshots of a live feed")
+    rec.add_argument("folder", type=Path)
+    rec.add_argument("--url", default=DEFAULT_REALTIME_URL)
+    rec.add_argument("--interval", type=float, default=60.0)
+    rec.add_argument("--count", type=int)
+
+    serve = sub.add_parser("serve", help="serve recorded snapshots")
+    serve.add_argument("folder", type=Path)
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8060)
+    serve.add_argument("--rate", type=float, default=1.0, help="playback speed, 10 = ten times real time")
+    serve.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    serve.add_argument("--jitter", type=float, default=0.0, help="up to this many extra seconds per request")
+    serve.add_argument("--pattern", type=lambda s: s.split(","),
+                       help=f"comma separated outcomes cycled per request: status codes or {', '.join(OUTCOMES)}")
+    serve.add_argument("--failure-rate", type=float, default=0.0)
+    serve.add_argument("--no-loop", dest="loop", action="store_false")
+    serve.add_argument("--seed", type=int)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "record":
+        record(args.url, args.folder, args.interval, args.count)
+        return
+
+    server = ReplayServer(args.folder, rate=args.rate, latency=args.latency, jitter=args.jitter,
+                          pattern=args.pattern, failure_rate=args.failure_rate, loop=args.loop,
+                          host=args.host, port=args.port, seed=args.seed)
+    logging.info(f"Replaying {len(server.files)} snapshots from {args.folder} on {server.url}")
+    try:
+        server.start()._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
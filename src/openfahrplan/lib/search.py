@@ -0,0 +1,174 @@
+import bisect
+import math
+import re
+import unicodedata
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+from rapidfuzz import process, fuzz
+
+from openfahrplan.lib.metrics import search_seconds
+
+
+def normalize_name(s: str) -> str:
+    s = s.casefold()
+    s = unicodedata.normalize("NFKD", s).encode("ascii", "ignore").decode("ascii")
+    s = s.replace("ß", "ss")
+    s = re.sub(r"[-_/.,]+", " ", s)
+    s = re.sub(r"\bstr\.\b|\bstr\b|\bstraße\b", "strasse", s)
+    return re.sub(r"\s+", " ", s).strip()
+
+
+def _round6(x: float) -> float:
+    return math.floor(x * 1e6 + 0.5) / 1e6
+
+
+def _trigrams(s: str) -> set[str]:
+    grams = set()
+    for token in s.split(" "):
+        padded = f" {token} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class StationSearchIndex:
+    """
+    Fuzzy station search over normalized stop names.
+
+    Names are normalized once when the index is built. A trigram inverted index
+    shortlists the most promising candidates per query, and only those are scored
+    with rapidfuzz, so a keystroke costs well under a millisecond even for
+    nationwide feeds. The last word of a query is often still being typed and
+    shares few trigrams with the word it becomes, so the `prefix` shortest names
+    with a word starting like it are scored as well. Only if the best of those
+    scores below `fallback_score`, which is hardly a match at all, are all names
+    scored like a full scan would.
+    """
+
+    def __init__(self, stops: pd.DataFrame, shortlist: int = 256, prefix: int = 64, fallback_score: float = 60.0):
+        self.stops = (stops.query("location_type == 0 or location_type.isna()")
+                      .drop_duplicates(subset=["stop_name"])
+                      .reset_index(drop=True))
+        self.stop_ids = self.stops["stop_id"].tolist()
+        self.names = self.stops["stop_name"].tolist()
+        self.normalized = [normalize_name(n) for n in self.names]
+        self.shortlist_size = shortlist
+        self.prefix_size = prefix
+        self.fallback_score = fallback_score
+
+        postings = defaultdict(list)
+        for i, name in enumerate(self.normalized):
+            for g in _trigrams(name):
+                postings[g].append(i)
+        self._postings = {g: np.asarray(ix, dtype=np.int32) for g, ix in postings.items()}
+        # rare trigrams say more about a name than the ones shared by a whole city, rounded
+        # so assets/stations.js gets bit-identical weights from its own log1p
+        self._weights = {g: _round6(math.log1p(len(self.names) / len(ix))) for g, ix in self._postings.items()}
+        # every word of every name, sorted, so the words starting with a prefix are one range
+        words = sorted((w, i) for i, name in enumerate(self.normalized) for w in set(name.split(" ")))
+        self._words = [w for w, _ in words]
+        self._word_pos = np.array([i for _, i in words], dtype=np.int32)
+        self._lengths = np.array([len(n) for n in self.normalized], dtype=np.int32)
+
+    def __len__(self):
+        return len(self.names)
+
+    def prefixed(self, query: str) -> np.ndarray:
+        """Positions of the shortest names with a word starting like the normalized query's last word."""
+        last = query.rsplit(" ", 1)[-1]
+        if not last:
+            return np.zeros(0, dtype=np.int32)
+        lo = bisect.bisect_left(self._words, last)
+        hi = bisect.bisect_left(self._words, last + "\x7f", lo)
+        cand = np.unique(self._word_pos[lo:hi])
+        # token_set_ratio of an unfinished word favours short names, ties go to the lower position
+        return cand[np.lexsort((cand, self._lengths[cand]))[:self.prefix_size]]
+
+    def shortlist(self, query: str) -> np.ndarray:
+        """
+        Positions of the names sharing the most trigrams with the normalized query plus
+        the `prefixed` ones, in index order. All names if there are none.
+        """
+        # sorted, so the weights add up in the same order as in the browser
+        grams = sorted(g for g in _trigrams(query) if g in self._postings)
+        prefixed = self.prefixed(query)
+        if not grams and not len(prefixed):
+            return np.arange(len(self.names), dtype=np.int32)
+        cand = np.zeros(0, dtype=np.int32)
+        if grams:
+            hits = [self._postings[g] for g in grams]
+            weights = np.repeat([self._weights[g] for g in grams], [len(h) for h in hits])
+            counts = np.bincount(np.concatenate(hits), weights=weights, minlength=len(self.names))
+            cand = np.flatnonzero(counts)
+            if len(cand) > self.shortlist_size:
+                # ties at the cut go to the lower position, like in the browser
+                top = np.argsort(-counts[cand], kind="stable")[:self.shortlist_size]
+                cand = cand[top]
+        return np.union1d(cand, prefixed).astype(np.int32)
+
+    def match_many(self, queries: list[str], limit: int = 10) -> list[list[tuple[int, float]]]:
+        """(position, score) pairs per query, best first."""
+        out = []
+        for q in queries:
+            q = normalize_name(q)
+            sl = self.shortlist(q)
+            if len(sl) == 0:
+                out.append([])
+                continue
+            # scoring the union of all shortlists in one call wastes more than it saves,
+            # so every query gets its own cdist row over its own shortlist
+            s = process.cdist([q], [self.normalized[i] for i in sl],
+                              scorer=fuzz.token_set_ratio, dtype=np.float64)[0]
+            if s.max() < self.fallback_score and len(sl) < len(self.names):
+                # nothing shortlisted is even close, a name outside the shortlist may be
+                sl = np.arange(len(self.names), dtype=np.int32)
+                s = process.cdist([q], self.normalized, scorer=fuzz.token_set_ratio, dtype=np.float64)[0]
+            # best score first, ties in index order like process.extract
+            order = np.lexsort((sl, -s))[:limit]
+            out.append([(int(sl[k]), float(s[k])) for k in order])
+        return out
+
+    @search_seconds.timed
+    def match(self, query: str, limit: int = 10) -> list[tuple[int, float]]:
+        return self.match_many([query], limit)[0]
+
+    def search_many(self, queries: list[str], limit: int = 10) -> list[pd.DataFrame]:
+        return [self._frame(m) for m in self.match_many(queries, limit)]
+
+    def search(self, query: str, limit: int = 10) -> pd.DataFrame:
+        """Same result structure as the stops table, plus a score column, best match first."""
+        return self._frame(self.match(query, limit))
+
+    def options(self, query: str, limit: int = 10) -> list[dict]:
+        """Dropdown options for a query, without building a DataFrame."""
+        return [{"value": self.stop_ids[i], "label": self.names[i]} for i, _ in self.match(query, limit)]
+
+    def bundle(self, version: str) -> dict:
+        """
+        Columnar export of the searchable stations for client-side autocomplete.
+        assets/stations.js ports normalize_name, the shortlist and token_set_ratio,
+        so with the normalized names and the parameters shipped here the dropdown
+        gets the same matches as `options`.
+        """
+        parents = self.stops["parent_station"]
+        return {
+            "version": version,
+            "ids": self.stop_ids,
+            "names": self.names,
+            "norm": self.normalized,
+            "parent": [None if pd.isna(p) else p for p in parents],
+            "platform": parents.notna().tolist(),
+            "shortlist": self.shortlist_size,
+            "prefix": self.prefix_size,
+            "fallback_score": self.fallback_score,
+        }
+
+    def _frame(self, matches: list[tuple[int, float]]) -> pd.DataFrame:
+        if not matches:
+            return self.stops.iloc[0:0].copy()
+        pos = [i for i, _ in matches]
+        result = self.stops.iloc[pos].copy()
+        result["score"] = [s for _, s in matches]
+        result = result.sort_values(["score", "stop_name"], ascending=[False, True]).reset_index(drop=True)
+        return result
@@ -0,0 +1,175 @@
+import argparse
+import cProfile
+import functools
+import json
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+from pathlib import Path
+
+from openfahrplan.lib.raptor import raptor_route
+from openfahrplan.lib.registry import FeedVersion
+
+
+class SlowQueryLog:
+    """
+    JSON lines log of queries slower than `threshold` seconds, with everything needed
+    to run them again: parameters, feed version, realtime snapshot version, timings
+    and RAPTOR round statistics. Only a `sample` fraction of slow queries is written,
+    so a bad minute doesn't flood the disk.
+
+    Lines are appended with a single write, so the job worker processes can share
+    the file. Replay with `python -m openfahrplan.lib.slowlog replay <log>`.
+    """
+
+    def __init__(self, path: Path | None, threshold: float = 0.5, sample: float = 1.0, context=None,
+                 seed: int | None = None):
+        self.path = Path(path) if path else None
+        self.threshold = threshold
+        self.sample = sample
+        self.context = context
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def record(self, kind: str, name: str, params: dict, seconds: float, feed: str | None = None,
+               realtime: int | None = None, **extra) -> bool:
+        """Write one entry if the query was slow enough and sampled. Returns True if written."""
+        if not self.enabled or seconds < self.threshold or self._random.random() >= self.sample:
+            return False
+        entry = {"ts": time.time(), "kind": kind, "name": name, "params": params, "seconds": round(seconds, 6),
+                 "feed": feed, "realtime": realtime, "pid": os.getpid(), **extra}
+        line = (json.dumps(entry, ensure_ascii=False, default=str) + "\n").encode()
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+        logging.warning(f"Slow {kind} {name} took {seconds:.3f}s: {params}")
+        return True
+
+    def route(self, version, stop_from, stop_to, departure_time="08:00:00", realtime: int | None = None, **kwargs):
+        """raptor_route on a feed version, logged with its round statistics when slow."""
+        stats = {} if self.enabled else None
+        start = time.perf_counter()
+        journey = raptor_route(version.raptor_index, stop_from, stop_to, departure_time=departure_time,
+                               stats=stats, **kwargs)
+        seconds = time.perf_counter() - start
+        if stats is not None:
+            self.record("route", "raptor_route",
+                        {"from": stop_from, "to": stop_to, "departure_time": departure_time, **kwargs},
+                        seconds, feed=version.version, realtime=realtime, stats=stats,
+                        raptor_options=version.raptor_options, found=journey is not None)
+        return journey
+
+    def callback(self, name: str):
+        """
+        Decorator for page callbacks, the callback arguments are logged as parameters.
+        `context()` given to the log returns the FeedVersion and the realtime snapshot
+        version at call time.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    seconds = time.perf_counter() - start
+                    if self.enabled and seconds >= self.threshold:
+                        version, rt = self.context() if self.context else (None, None)
+                        # set_progress of background callbacks isn't a parameter
+                        params = [a for a in args if not callable(a)]
+                        self.record("callback", name, {"args": params, **kwargs}, seconds,
+                                    feed=version.version if version else None, realtime=rt,
+                                    raptor_options=version.raptor_options if version else None)
+            return wrapper
+        return decorator
+
+
+def read(path: Path) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# callbacks that boil down to a route, so they can be replayed like one
+_ROUTE_CALLBACKS = {"connection": lambda args: {"from": args[0], "to": args[1], "departure_time": args[2]}}
+
+
+def replay(entries: list[dict], version, repeat: int = 1, profile: Path | None = None) -> list[dict]:
+    """
+    Run logged route queries again on a feed version. Realtime data doesn't change
+    routes, so the same feed version gives the same search. Returns one result per
+    replayed entry with the logged and the new timings.
+    """
+    profiler = cProfile.Profile() if profile else None
+    results = []
+    for entry in entries:
+        if entry["kind"] == "route":
+            params = dict(entry["params"])
+        elif entry["name"] in _ROUTE_CALLBACKS:
+            params = _ROUTE_CALLBACKS[entry["name"]](entry["params"]["args"])
+        else:
+            continue
+        if entry.get("feed") and entry["feed"] != version.version:
+            logging.warning(f"Logged on feed {entry['feed']}, replaying on {version.version}")
+        stop_from, stop_to = params.pop("from"), params.pop("to")
+        times = []
+        stats = {}
+        for _ in range(repeat):
+            stats = {}
+            if profiler:
+                profiler.enable()
+            start = time.perf_counter()
+            journey = raptor_route(version.raptor_index, stop_from, stop_to, stats=stats, **params)
+            times.append(time.perf_counter() - start)
+            if profiler:
+                profiler.disable()
+        results.append({"from": stop_from, "to": stop_to, **params, "logged": entry["seconds"],
+                        "best": min(times), "median": sorted(times)[len(times) // 2],
+                        "rounds": len(stats.get("rounds", [])), "found": journey is not None})
+    if profiler:
+        profiler.dump_stats(profile)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m openfahrplan.lib.slowlog",
+                                     description="Replay logged slow queries against a feed")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("replay", help="run the logged route queries again")
+    p.add_argument("log", type=Path)
+    p.add_argument("--data", type=Path, default=Path(os.getenv("OPENFAHRPLAN_DATA_DIR", "data")),
+                   help="data folder with the feed the queries were logged on")
+    p.add_argument("--name", default="vgn")
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--profile", type=Path, help="write cProfile stats of all replays here")
+    p.add_argument("--limit", type=int, help="only the N slowest entries")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    entries = sorted(read(args.log), key=lambda e: -e["seconds"])[:args.limit]
+    if not entries:
+        return
+    # the index has to be built like the one the queries were logged on
+    options = entries[0].get("raptor_options") or {}
+    if any((e.get("raptor_options") or {}) != options for e in entries):
+        logging.warning(f"Entries were logged with different raptor options, using {options}")
+    version = FeedVersion(args.data, args.name, options)
+    for r in replay(entries, version, repeat=args.repeat, profile=args.profile):
+        print(f"{r['from']} -> {r['to']} @ {r.get('departure_time')}: logged {r['logged']:.3f}s, "
+              f"now best {r['best']:.3f}s median {r['median']:.3f}s, {r['rounds']} rounds, found={r['found']}")
+    if args.profile:
+        pstats.Stats(str(args.profile)).sort_stats("cumulative").print_stats(25)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import logging
+import time
+from contextlib import contextmanager
+
+
+class StartupReport:
+    """
+    Wall clock timings of the startup phases, logged as they finish and served by
+    the readiness endpoint so a slow pod start can be pinned to a phase.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self._t0 = time.perf_counter()
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name: str, seconds: float):
+        self.phases[name] = seconds
+        logging.info(f"Startup phase {name} took {seconds:.2f}s")
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._t0
+
+    def as_dict(self) -> dict:
+        return {
+            "started": self.started,
+            "elapsed": round(self.elapsed(), 3),
+            "phases": {name: round(s, 3) for name, s in self.phases.items()},
+        }
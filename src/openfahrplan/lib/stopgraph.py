@@ -0,0 +1,121 @@
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+
+class _UnionFind:
+    def __init__(self, n: int):
+        self.parent = list(range(n))
+
+    def find(self, x: int) -> int:
+        root = x
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[x] != root:
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def union(self, a: int, b: int):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[max(ra, rb)] = min(ra, rb)
+
+
+class StopGraph:
+    """
+    Stop relations precomputed once per feed, so related-stop lookups cost O(result).
+
+    Every lookup works on row positions into `stops` (one row per stop_id, in feed order):
+      * transfer clusters: connected components of the transfer graph, via union-find
+      * parent_station -> child stops
+      * stop_name -> stops with that name
+    """
+
+    def __init__(self, stops: pd.DataFrame, transfers: pd.DataFrame | None = None):
+        self.stops = stops.drop_duplicates("stop_id").reset_index(drop=True)
+        ids = self.stops["stop_id"].tolist()
+        self.pos = {sid: i for i, sid in enumerate(ids)}
+
+        children = defaultdict(list)
+        for i, parent in enumerate(self.stops["parent_station"]):
+            if pd.notna(parent) and str(parent).strip() != "":
+                children[str(parent).strip()].append(i)
+        self._children = {k: np.asarray(v, dtype=np.int32) for k, v in children.items()}
+
+        names = defaultdict(list)
+        for i, name in enumerate(self.stops["stop_name"]):
+            names[name].append(i)
+        self._names = {k: np.asarray(v, dtype=np.int32) for k, v in names.items()}
+
+        # transfer edges as node ids; stops only known from transfers.txt get ids past the stops table
+        self._node = dict(self.pos)
+        a, b, w = [], [], []
+        if transfers is not None and not transfers.empty:
+            t = transfers[["from_stop_id", "to_stop_id", "transfer_type", "min_transfer_time"]]
+            t_type = t["transfer_type"].fillna(0).astype(int).to_numpy()
+            t_min = t["min_transfer_time"].fillna(0).astype(int).to_numpy()
+            for (x, y), tt, mt in zip(t[["from_stop_id", "to_stop_id"]].itertuples(index=False, name=None), t_type, t_min):
+                if tt in (1, 2):
+                    a.append(self._node.setdefault(x, len(self._node)))
+                    b.append(self._node.setdefault(y, len(self._node)))
+                    w.append(mt)
+        self._edges = (np.asarray(a, dtype=np.int32), np.asarray(b, dtype=np.int32), np.asarray(w, dtype=np.int64))
+        self._clusters = {}
+
+    def __len__(self):
+        return len(self.stops)
+
+    def _components(self, max_transfer_time: int):
+        """node -> component members (positions into stops), cached per transfer time limit."""
+        comps = self._clusters.get(max_transfer_time)
+        if comps is None:
+            a, b, w = self._edges
+            uf = _UnionFind(len(self._node))
+            for x, y in zip(a[w <= max_transfer_time].tolist(), b[w <= max_transfer_time].tolist()):
+                uf.union(x, y)
+            members = defaultdict(list)
+            for i in range(len(self.stops)):
+                members[uf.find(i)].append(i)
+            roots = [uf.find(n) for n in range(len(self._node))]
+            comps = (roots, {r: np.asarray(m, dtype=np.int32) for r, m in members.items()})
+            self._clusters[max_transfer_time] = comps
+        return comps
+
+    def reachable(self, stop_id: str, max_transfer_time: int = 300, include_origin: bool = False) -> np.ndarray:
+        node = self._node.get(stop_id)
+        if node is None:
+            return np.empty(0, dtype=np.int32)
+        roots, members = self._components(int(max_transfer_time))
+        out = members.get(roots[node], np.empty(0, dtype=np.int32))
+        if not include_origin and node < len(self.stops):
+            out = out[out != node]
+        return out
+
+    def siblings(self, stop_id: str, include_self: bool = False) -> np.ndarray:
+        i = self.pos.get(stop_id)
+        if i is None:
+            return np.empty(0, dtype=np.int32)
+        parent = self.stops.at[i, "parent_station"]
+        parent_id = str(stop_id) if pd.isna(parent) or str(parent).strip() == "" else str(parent).strip()
+        out = self._children.get(parent_id, np.empty(0, dtype=np.int32))
+        return out if include_self else out[out != i]
+
+    def same_name(self, stop_id: str, include_self: bool = False) -> np.ndarray:
+        i = self.pos.get(stop_id)
+        if i is None:
+            return np.empty(0, dtype=np.int32)
+        out = self._names[self.stops.at[i, "stop_name"]]
+        return out if include_self else out[out != i]
+
+    def related(self, stop_id: str) -> np.ndarray:
+        """The stop itself, then transfer cluster, siblings and same-name stops, without duplicates."""
+        i = self.pos.get(stop_id)
+        parts = [] if i is None else [np.asarray([i], dtype=np.int32)]
+        parts += [self.reachable(stop_id), self.siblings(stop_id), self.same_name(stop_id)]
+        pos = np.concatenate(parts)
+        _, first = np.unique(pos, return_index=True)
+        return pos[np.sort(first)]
+
+    def frame(self, positions: np.ndarray) -> pd.DataFrame:
+        return self.stops.iloc[positions].reset_index(drop=True)
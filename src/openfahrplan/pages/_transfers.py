@@ -1,54 +1,93 @@
-from dash import html, dcc, register_page
+import dash
+from dash import html, dcc, register_page, Output, Input, ClientsideFunction, Patch
+from dash.exceptions import PreventUpdate
 import plotly.graph_objects as go
-from openfahrplan import feed
-import numpy as np
+from openfahrplan import figures, registry
+from openfahrplan.lib.display import zoom_from_bounds
 #
 # You found a secret page. Keep it a secret!
 #
 register_page(__name__, path="/transfers")
-st = feed.stops[["stop_id","stop_lat","stop_lon"]].rename(
-    columns={"stop_lat":"lat","stop_lon":"lon"}
+
+
+@figures.register("transfers")
+def transfers_figure(version):
+    # the overview only, zooming in asks update_detail below for the visible part
+    network = version.transfer_network
+    if len(network.lat):
+        zoom, center = zoom_from_bounds({"stop_lat": network.lat, "stop_lon": network.lon})
+    else:
+        # a feed without transfers gets an empty world map
+        zoom, center = 0, {"lat": 0.0, "lon": 0.0}
+    view = network.view(zoom)
+
+    fig = go.Figure()
+    fig.add_trace(go.Scattermap(
+        lat=view.lat, lon=view.lon, mode="lines",
+        name="Transfers",
+        text=view.text, hoverinfo="text"
+    ))
+    fig.add_trace(go.Scattermap(
+        lat=view.stop_lat,
+        lon=view.stop_lon,
+        mode="markers",
+        name="Stops",
+        text=view.stop_text,
+        marker=dict(size=view.stop_size),
+        hoverinfo="text"
+    ))
+
+    fig.update_layout(map=dict(zoom=zoom, center=dict(lat=float(center["lat"]), lon=float(center["lon"]))),
+                      map_style="carto-positron", margin=dict(l=0,r=0,t=0,b=0), uirevision="transfers")
+    return fig
+
+
+def layout(**kwargs):
+    return html.Div(
+        style={"height": "100vh"},
+        children=[
+            dcc.Store(id="transfers-figure-url", data=figures.url("transfers")),
+            dcc.Graph(id="transfers-map", style={"height": "100%"}, config={"displayModeBar": False})
+        ]
+    )
+
+
+dash.clientside_callback(
+    ClientsideFunction(namespace="openfahrplan", function_name="loadFigure"),
+    Output("transfers-map", "figure"),
+    Input("transfers-figure-url", "data"),
 )
 
-tf = (feed.transfers
-      .merge(st.add_suffix("_from"), left_on="from_stop_id", right_on="stop_id_from", how="left")
-      .merge(st.add_suffix("_to"),   left_on="to_stop_id",   right_on="stop_id_to",   how="left")
-      .dropna(subset=["lat_from","lon_from","lat_to","lon_to"])
-      )
-
-# build polyline arrays with NaN separators (one segment per transfer)
-n = len(tf)
-lats = np.empty(n*3); lons = np.empty(n*3); texts = np.empty(n*3, dtype=object)
-lats[0::3] = tf["lat_from"].to_numpy()
-lats[1::3] = tf["lat_to"].to_numpy()
-lats[2::3] = np.nan
-lons[0::3] = tf["lon_from"].to_numpy()
-lons[1::3] = tf["lon_to"].to_numpy()
-lons[2::3] = np.nan
-texts[0::3] = (tf["from_stop_id"] + " → " + tf["to_stop_id"]).to_numpy()
-texts[1::3] = texts[0::3]
-texts[2::3] = None
-
-fig = go.Figure()
-fig.add_trace(go.Scattermap(
-    lat=lats, lon=lons, mode="lines",
-    name="Transfers",
-    text=texts, hoverinfo="text"
-))
-# optional: draw endpoints
-fig.add_trace(go.Scattermap(
-    lat=np.r_[tf["lat_from"], tf["lat_to"]],
-    lon=np.r_[tf["lon_from"], tf["lon_to"]],
-    mode="markers",
-    name="Stops",
-    text=np.r_[tf["from_stop_id"], tf["to_stop_id"]],
-    hoverinfo="text"
-))
-
-fig.update_layout(map_style="carto-positron", margin=dict(l=0,r=0,t=0,b=0))
-layout = html.Div(
-    style={"height": "100vh"},
-    children=[
-        dcc.Graph(figure=fig, style={"height": "100%"}, config={"displayModeBar": False})
-    ]
+
+def _viewport(relayout):
+    """(zoom, (min_lon, min_lat, max_lon, max_lat)) of a map relayout event, None if it didn't move the map."""
+    if not relayout or "map.zoom" not in relayout:
+        return None
+    zoom = relayout["map.zoom"]
+    corners = (relayout.get("map._derived") or {}).get("coordinates")
+    if not corners:
+        # no derived corners, assume a viewport about two tiles wide around the center
+        center = relayout.get("map.center")
+        if not center:
+            return None
+        half = 360.0 / 2 ** zoom
+        return zoom, (center["lon"] - half, center["lat"] - half / 2, center["lon"] + half, center["lat"] + half / 2)
+    lons = [c[0] for c in corners]
+    lats = [c[1] for c in corners]
+    return zoom, (min(lons), min(lats), max(lons), max(lats))
+
+
+@dash.callback(
+    Output("transfers-map", "figure", allow_duplicate=True),
+    Input("transfers-map", "relayoutData"),
+    prevent_initial_call=True,
 )
+def update_detail(relayout):
+    viewport = _viewport(relayout)
+    if viewport is None:
+        raise PreventUpdate
+    view = registry.current().transfer_network.view(*viewport)
+    patched = Patch()
+    patched["data"][0].update(lat=view.lat, lon=view.lon, text=view.text)
+    patched["data"][1].update(lat=view.stop_lat, lon=view.stop_lon, text=view.stop_text, marker={"size": view.stop_size})
+    return patched
@@ -1,15 +1,13 @@
 import logging
 
 import dash
-from dash import html, dcc, register_page, Output, Input
+from dash import html, dcc, register_page, Output, Input, State, ClientsideFunction
 import plotly.graph_objects as go
 from dash.exceptions import PreventUpdate
 
 from openfahrplan.lib.display import zoom_from_bounds, build_route_map_data
-from openfahrplan.lib.raptor import raptor_route
-from openfahrplan import feed, raptor_index, data_folder
+from openfahrplan import registry, realtime, slowlog
 from openfahrplan.lib.display import map_style
-from openfahrplan.lib.gtfs import map_disruptions
 
 register_page(__name__, path="/connection")
 times = [
@@ -43,7 +41,10 @@ layout = html.Div(
                     value="08:00:00",
                     clearable=False,
                     style={"width": 100}
-                )
+                ),
+                html.Button(id="connection-cancel", children="Abbrechen", disabled=True,
+                            className="rounded-md px-2 py-1 border"),
+                html.Span(id="connection-progress", className="text-gray-500"),
             ], ),
 
         dcc.Loading(
@@ -57,34 +58,45 @@ layout = html.Div(
 )
 
 
-@dash.callback(
+# station search runs in the browser against the station bundle, see assets/stations.js
+dash.clientside_callback(
+    ClientsideFunction(namespace="openfahrplan", function_name="filterStations"),
     Output({"type": "station", "key": dash.MATCH}, "options"),
     Input({"type": "station", "key": dash.MATCH}, "search_value"),
+    State({"type": "station", "key": dash.MATCH}, "value"),
 )
-def update_stop_options(search_value):
-    if not search_value:
-        raise PreventUpdate
-    res = (feed.gtfs_find_station(search_value)[
-        ["stop_id", "stop_name", "location_type", "parent_station", "score"]].rename(
-        columns={"stop_name": "label", "stop_id": "value"}))
-    return res[["value", "label"]].to_dict("records")
 
 
+# Runs in a worker process (see WorkerPoolManager), changing an input or pressing
+# "Abbrechen" cancels the job, a search already running only loses its result.
 @dash.callback(
     Output("connection-loading", "children"),
     Input({"type": "station", "key": "from"}, "value"),
     Input({"type": "station", "key": "to"}, "value"),
     Input("time_dropdown", "value"),
+    background=True,
+    interval=250,
+    progress=Output("connection-progress", "children"),
+    progress_default="",
+    running=[(Output("connection-cancel", "disabled"), False, True)],
+    cancel=[Input("connection-cancel", "n_clicks")],
 )
-def update_output(stop_from, stop_to,time):
+# not wrapped in slowlog.callback, the search below is logged by slowlog.route with its round statistics
+def update_output(set_progress, stop_from, stop_to,time):
     if not stop_from or not stop_to:
         raise PreventUpdate
+    if not registry.ready:
+        return html.P(className="m-4", children="Der Fahrplan wird noch geladen, bitte gleich noch einmal versuchen.")
 
-    res = raptor_route(raptor_index, stop_from, stop_to,departure_time=time)
+    set_progress("Suche Verbindung...")
+    version = registry.current()
+    feed = version.feed
+    res = slowlog.route(version, stop_from, stop_to, departure_time=time, realtime=realtime.latest().version)
 
     if res is None:
         logging.warning("connections callbacked prevented update because raptor didnt return a result")
         raise PreventUpdate
+    set_progress("Zeichne Karte...")
     data = build_route_map_data(feed, res)
     zoom, center = zoom_from_bounds(data["stops"])
     fig = go.Figure()
@@ -110,8 +122,7 @@ def update_output(stop_from, stop_to,time):
             ))
 
     all_stops = data["stops"]
-    alerts = feed.gtfs_get_disruptions()
-    affected_stops = map_disruptions(data_folder, all_stops, alerts)
+    affected_stops = version.disruptions(realtime.snapshot()).annotate(all_stops)
     if not all_stops.empty:
         fig.add_trace(go.Scattermap(
             lat=all_stops["stop_lat"], lon=all_stops["stop_lon"],
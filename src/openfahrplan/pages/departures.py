@@ -0,0 +1,96 @@
+import logging
+
+import dash
+from dash import html, dcc, register_page, Output, Input, State, ClientsideFunction
+from dash.exceptions import PreventUpdate
+
+from openfahrplan import registry, realtime, slowlog
+from openfahrplan.lib.departures import seconds_of_day
+from openfahrplan.lib.display import get_route_color
+from openfahrplan.lib.raptor import _parse_gtfs_time
+
+register_page(__name__, path="/departures")
+times = [{"label": "Jetzt", "value": "now"}] + [
+    {"label": f"{h:02d}:{m:02d}", "value": f"{h:02d}:{m:02d}:00"}
+    for h in range(24)
+    for m in (0, 30)
+]
+layout = html.Div(
+    className="h-full",
+    children=[
+        html.Div(
+            className="flex gap-3 items-end flex-wrap p-2",
+            children=[
+                dcc.Dropdown(
+                    id="departures-station",
+                    value="de:09564:510:1:1",
+                    search_value="Nürnberg Hbf",
+                    placeholder="Haltestelle...",
+                    style={"minWidth": 400},
+                ),
+                dcc.Dropdown(
+                    id="departures-time",
+                    options=times,
+                    value="now",
+                    clearable=False,
+                    style={"width": 100}
+                ),
+            ],
+        ),
+        # refresh with the realtime feed, a board for "now" also moves on
+        dcc.Interval(id="departures-interval", interval=realtime.interval * 1000),
+        dcc.Loading(id="departures-loading", className="m-4"),
+    ]
+)
+
+
+# station search runs in the browser against the station bundle, see assets/stations.js
+dash.clientside_callback(
+    ClientsideFunction(namespace="openfahrplan", function_name="filterStations"),
+    Output("departures-station", "options"),
+    Input("departures-station", "search_value"),
+    State("departures-station", "value"),
+)
+
+
+def _delay_label(d):
+    if d["delay"] is None:
+        return html.Span()
+    minutes = round(d["delay"] / 60)
+    color = "text-green-700" if minutes <= 1 else "text-red-700"
+    return html.Span(className=color, children=f"{d['expected']} ({minutes:+d})")
+
+
+@dash.callback(
+    Output("departures-loading", "children"),
+    Input("departures-station", "value"),
+    Input("departures-time", "value"),
+    Input("departures-interval", "n_intervals"),
+)
+@slowlog.callback("departures")
+def update_output(station, time, _):
+    if not station:
+        logging.warning("departures update prevented update because station is empty")
+        raise PreventUpdate
+    version = registry.current()
+    board = version.departures
+    after = seconds_of_day(tz=board.timezone) if time == "now" else int(_parse_gtfs_time(time))
+    rows = board.departures(station, after, 20, version.delays(realtime.snapshot()))
+    if not rows:
+        return html.P("Keine Abfahrten gefunden.")
+    return html.Table(className="table-auto", children=[
+        html.Thead(html.Tr([html.Th(className="px-2 text-left", children=c)
+                            for c in ("Zeit", "Prognose", "Linie", "Richtung", "Steig")])),
+        html.Tbody([
+            html.Tr([
+                html.Td(className="px-2", children=d["time"]),
+                html.Td(className="px-2", children=_delay_label(d)),
+                html.Td(className="px-2", children=html.Span(
+                    className="rounded-md px-2 py-1 text-white",
+                    style={"background-color": get_route_color(d["line"] or "")},
+                    children=d["line"])),
+                html.Td(className="px-2", children=d["headsign"]),
+                html.Td(className="px-2 text-gray-500", children=d["stop_id"]),
+            ]) for d in rows
+        ]),
+    ])
@@ -1,64 +1,95 @@
-from dash import html, dcc, register_page
+import dash
+from dash import html, dcc, register_page, Output, Input, State, Patch
+from dash.exceptions import PreventUpdate
 from openfahrplan.lib.display import zoom_from_bounds, map_style
-from openfahrplan import feed, data_folder
+from openfahrplan import registry, realtime
 
 import plotly.graph_objects as go
 
 register_page(__name__, path="/disruptions")
-def map_disruptions(stops, alerts):
-    import pandas as pd
-    mapping = pd.read_parquet(data_folder / "mapping" / "mapping.parquet")
-    # normalize dtypes to string (preserves <NA>)
-    stops = stops.copy()
-    mapping = mapping.copy()
-    stops["stop_id"] = stops["stop_id"].astype("string")
-    mapping["vgn_id"] = mapping["vgn_id"].astype("string")
-    mapping["de_id"]  = mapping["de_id"].astype("string")
-    alerts["stop_id"] = alerts["stop_id"].astype("string")
-
-    agg = (
-        alerts.groupby("stop_id", dropna=True).agg(
-            disruption_text = ("header", lambda s: " | ".join(pd.unique(s.dropna()))),
-            disruption_type = ("cause",  lambda s: sorted(set(s.dropna()))),
-            disruption_effect = ("effect", lambda s: sorted(set(s.dropna()))),
-        )
-        .rename_axis("de_id")
-        .reset_index()
-    )
-    agg["de_id"] = agg["de_id"].astype("string")
 
-    out = (
-        stops.merge(mapping, left_on="stop_id", right_on="vgn_id", how="left")
-        .merge(agg, on="de_id", how="left")
+
+def _affected_stops():
+    version = registry.current()
+    snapshot = realtime.snapshot()
+    stops = version.disruptions(snapshot).annotate(version.feed.stops)
+    # compared with whichever worker serves the next refresh, so nothing process-local
+    state = {"snapshot": snapshot.content_id, "feed": version.version, "stop_ids": stops["stop_id"].tolist()}
+    return stops, state
+
+
+def _marker_text(stops):
+    return (stops["stop_name"] + " (" + stops["stop_id"] + ")").tolist()
+
+
+def layout(**kwargs):
+    # render whatever snapshot is there right now, the interval below fills in later fetches
+    stops, state = _affected_stops()
+    zoom, center = zoom_from_bounds(stops if not stops.empty else registry.current().feed.stops, padding=0.3)
+
+    fig = go.Figure()
+    fig.add_trace(go.Scattermap(
+        lat=stops["stop_lat"].tolist(),
+        lon=stops["stop_lon"].tolist(),
+        mode="markers",
+        text=_marker_text(stops),
+        hoverinfo="text",
+        marker=dict(size=map_style["marker_size"]*1.3, color="#f73c00"),
+    ))
+
+    fig.update_layout(
+        map=dict(zoom=zoom, center=center),
+        margin=dict(l=0, r=0, t=0, b=0),
+        map_style=map_style["layer_style"],
+        uirevision="disruptions",
     )
-    return out[out[["disruption_text", "disruption_type", "disruption_effect"]].notna().any(axis=1)]
-
-alerts = feed.gtfs_get_disruptions()
-stops = map_disruptions(feed.stops, alerts)
-
-zoom,center=zoom_from_bounds(stops,padding=0.3)
-
-fig = go.Figure()
-fig.add_trace(go.Scattermap(
-    lat=stops["stop_lat"],
-    lon=stops["stop_lon"],
-    mode="markers",
-    text=stops["stop_name"] + " (" + stops["stop_id"] + ")",
-    hoverinfo="text",
-    marker=dict(size=map_style["marker_size"]*1.3, color="#f73c00"),
-))
-
-fig.update_layout(
-    map=dict(zoom=zoom, center=center),
-    margin=dict(l=0, r=0, t=0, b=0),
-    map_style=map_style["layer_style"],
+
+    return html.Div([
+        dcc.Store(id="disruptions-state", data=state),
+        dcc.Interval(id="disruptions-interval", interval=realtime.interval * 1000),
+        html.Div(
+            style={"height": "100vh"},
+            children=[
+                dcc.Graph(id="disruptions-map", figure=fig, style={"height": "100%"}, config={"displayModeBar": False})
+            ]
+        )
+    ])
+
+
+@dash.callback(
+    Output("disruptions-map", "figure"),
+    Output("disruptions-state", "data"),
+    Input("disruptions-interval", "n_intervals"),
+    State("disruptions-state", "data"),
+    prevent_initial_call=True,
 )
+def refresh_disruptions(_, shown):
+    """Push only the markers that appeared or disappeared since the client's last snapshot."""
+    if shown and (shown["snapshot"], shown["feed"]) == (realtime.snapshot().content_id, registry.current().version):
+        raise PreventUpdate
 
-layout = html.Div([
-    html.Div(
-        style={"height": "100vh"},
-        children=[
-            dcc.Graph(figure=fig, style={"height": "100%"},config={"displayModeBar": False})
-        ]
-    )
-])
+    stops, state = _affected_stops()
+    shown_ids = shown["stop_ids"] if shown else []
+    current = set(state["stop_ids"])
+    removed = [i for i, sid in enumerate(shown_ids) if sid not in current]
+    kept = [sid for sid in shown_ids if sid in current]
+    added = stops[~stops["stop_id"].isin(set(kept))]
+    if not removed and added.empty:
+        # nothing moved on the map, just remember the new snapshot
+        state["stop_ids"] = shown_ids
+        return dash.no_update, state
+
+    patched = Patch()
+    trace = patched["data"][0]
+    # delete from the back so the remaining positions stay valid
+    for i in reversed(removed):
+        del trace["lat"][i]
+        del trace["lon"][i]
+        del trace["text"][i]
+    trace["lat"].extend(added["stop_lat"].tolist())
+    trace["lon"].extend(added["stop_lon"].tolist())
+    trace["text"].extend(_marker_text(added))
+
+    # the client's marker order: what survived, then what was appended
+    state["stop_ids"] = kept + added["stop_id"].tolist()
+    return patched, state
@@ -1,22 +1,37 @@
+import dash
+import numpy as np
 import plotly.graph_objects as go
-from dash import html, dcc, register_page
+from dash import html, dcc, register_page, Output, Input, ClientsideFunction
 
-from openfahrplan import timetable
-from urllib.parse import unquote
-import pandas as pd
+from openfahrplan import registry, figures
+from urllib.parse import unquote, quote
+from openfahrplan.lib.departures import format_gtfs_time
 from openfahrplan.lib.display import zoom_from_bounds, get_route_color, map_style
 
 register_page(__name__, path_template="/lines/<route_short_name>")
 
 
-def layout(route_short_name=None, **kwargs):
+def _header(route_short_name, direction, view, lines):
+    href = f"/lines/{quote(route_short_name)}"
+    links = []
+    for d in lines.directions(route_short_name):
+        patterns = lines.patterns(route_short_name, d)
+        label = f"Richtung {patterns[0].headsign}"
+        links.append(html.Strong(label) if d == direction else dcc.Link(label, href=f"{href}?direction={d}&view={view}"))
+    for v, label in (("map", "Karte"), ("timetable", "Fahrplan")):
+        links.append(html.Strong(label) if v == view else dcc.Link(label, href=f"{href}?direction={direction}&view={v}"))
+    return html.Div(className="flex gap-4 m-2", children=links)
+
+
+@figures.register("line")
+def line_figure(version, line, direction):
+    lines = version.lines
+    # lines without direction_id are linked with direction=None, that is all directions
+    direction = None if direction in (None, "None", "") else int(direction)
+    if line not in lines or (direction is not None and direction not in lines.directions(line)):
+        raise KeyError((line, direction))
     fig = go.Figure()
-    route_short_name = unquote(route_short_name)
-    route = (
-        timetable.query("route_short_name == @route_short_name and direction_id == 1")
-        .sort_values(["trip_id", "stop_sequence"])
-    )
-    stops = route.drop_duplicates("stop_id")
+    stops = lines.stops(line, direction)
     zoom, center = zoom_from_bounds(stops)
 
     fig.add_trace(go.Scattermap(
@@ -36,57 +51,69 @@ def layout(route_short_name=None, **kwargs):
         map_style=map_style["layer_style"],
     )
 
-    route["dep_td"] = pd.to_timedelta(route["departure_time"], errors="coerce")
-    trip_order = route.groupby("trip_id")["dep_td"].min().sort_values().index
-
-    # pattern hash -> {stop_ids, trip_ids}
-    patterns = {}
-
-    for tid, g in (
-            route.set_index("trip_id")
-                    .loc[trip_order]
-                    .reset_index()
-                    .groupby("trip_id", sort=False)
-    ):
-        stop_ids = tuple(g["stop_id"].tolist())
-        key = hash(stop_ids)
-        if key not in patterns:
-            patterns[key] = {"stop_ids": stop_ids, "trip_ids": []}
-        patterns[key]["trip_ids"].append(tid)
-
-    for pattern in patterns.values():
-        g = route[route["trip_id"].isin(pattern["trip_ids"])].sort_values("stop_sequence").drop_duplicates("stop_id")
-
-        dep = g["departure_time"].iloc[0]
-        arr = g["arrival_time"].iloc[-1]
-        dep_td = pd.to_timedelta(dep)
-        arr_td = pd.to_timedelta(arr)
-        dep_wrapped = f"{int((dep_td.total_seconds() % 86400) // 3600):02}:{int((dep_td.total_seconds() % 3600) // 60):02}"
-        arr_wrapped = f"{int((arr_td.total_seconds() % 86400) // 3600):02}:{int((arr_td.total_seconds() % 3600) // 60):02}"
-        diff = pd.to_timedelta(arr) - pd.to_timedelta(dep)
-        trip_ids = ", ".join(pattern["trip_ids"])
-        name = f"{dep_wrapped} - {arr_wrapped} ({(pd.to_datetime('2262-04-11') + diff).strftime('%H:%M')}) [{trip_ids}]"
-
+    for pattern in lines.patterns(line, direction):
+        # every stop once, a loop line doesn't draw back to its first stop
+        _, first = np.unique(pattern.stop_ids, return_index=True)
+        keep = np.sort(first)
         fig.add_trace(go.Scattermap(
-            lat=g["stop_lat"],
-            lon=g["stop_lon"],
+            lat=pattern.lat[keep],
+            lon=pattern.lon[keep],
             mode="lines",
-            # name=name,
-            line=dict(color=get_route_color(route_short_name), width=map_style["line_width"]),
+            line=dict(color=get_route_color(line), width=map_style["line_width"]),
             hoverinfo="skip",
             showlegend=False
         ))
+    return fig
 
-    return dcc.Loading(
-        overlay_style={"height": "100%"},
-        parent_style={"height": "100%"},
-        style={"height": "100%"},
-        id="loading",
-        children=[
-            dcc.Graph(
-                figure=fig,
-                className="h-full",
-                config={"displayModeBar": False},
-            )
-        ],
-    )
+
+def _map(route_short_name, direction):
+    # the figure itself is loaded from the figure cache by the callback below
+    return html.Div(className="h-full", children=[
+        dcc.Store(id="line-figure-url", data=figures.url("line", line=route_short_name, direction=direction)),
+        dcc.Graph(id="line-map", className="h-full", config={"displayModeBar": False}),
+    ])
+
+
+dash.clientside_callback(
+    ClientsideFunction(namespace="openfahrplan", function_name="loadFigure"),
+    Output("line-map", "figure"),
+    Input("line-figure-url", "data"),
+)
+
+
+def _timetable(route_short_name, direction, lines):
+    tables = []
+    for pattern in lines.patterns(route_short_name, direction):
+        tables.append(html.Div(className="m-4 overflow-x-auto", children=[
+            html.Strong(f"{pattern.stop_names[0]} → {pattern.headsign} ({len(pattern)} Fahrten)"),
+            html.Table(className="table-auto text-sm", children=html.Tbody([
+                html.Tr([html.Td(className="pr-4 whitespace-nowrap", children=name)]
+                        + [html.Td(className="px-1", children=format_gtfs_time(t) if t >= 0 else "") for t in pattern.dep[:, i].tolist()])
+                for i, name in enumerate(pattern.stop_names)
+            ])),
+        ]))
+    return html.Div(className="overflow-y-auto h-full", children=tables)
+
+
+def layout(route_short_name=None, direction="1", view="map", **kwargs):
+    route_short_name = unquote(route_short_name)
+    lines = registry.current().lines
+    if route_short_name not in lines:
+        return html.P(className="m-4", children=f"Linie {route_short_name} nicht gefunden.")
+    direction = int(direction) if str(direction).isdigit() else None
+    if direction not in lines.directions(route_short_name):
+        direction = lines.directions(route_short_name)[-1]
+    view = "timetable" if view == "timetable" else "map"
+
+    content = _timetable(route_short_name, direction, lines) if view == "timetable" else _map(route_short_name, direction)
+    return html.Div(className="h-full flex flex-col", children=[
+        _header(route_short_name, direction, view, lines),
+        dcc.Loading(
+            overlay_style={"height": "100%"},
+            parent_style={"height": "100%"},
+            style={"height": "100%"},
+            className="grow",
+            id="loading",
+            children=[content],
+        ),
+    ])
@@ -1,11 +1,11 @@
 import logging
 
 import dash
-from dash import html, dcc, register_page, Output, Input
+from dash import html, dcc, register_page, Output, Input, State, ClientsideFunction
 import plotly.graph_objects as go
 from dash.exceptions import PreventUpdate
 from openfahrplan.lib.display import zoom_from_bounds, map_style
-from openfahrplan import feed
+from openfahrplan import registry
 
 register_page(__name__, path="/stations")
 layout = html.Div(
@@ -34,17 +34,13 @@ layout = html.Div(
 )
 
 
-@dash.callback(
+# station search runs in the browser against the station bundle, see assets/stations.js
+dash.clientside_callback(
+    ClientsideFunction(namespace="openfahrplan", function_name="filterStations"),
     Output("station", "options"),
     Input("station", "search_value"),
+    State("station", "value"),
 )
-def update_stop_options(search_value):
-    if not search_value:
-        raise PreventUpdate
-    res = (feed.gtfs_find_station(search_value)[
-        ["stop_id", "stop_name", "location_type", "parent_station", "score"]].rename(
-        columns={"stop_name": "label", "stop_id": "value"}))
-    return res[["value", "label"]].to_dict("records")
 
 
 @dash.callback(
@@ -55,7 +51,7 @@ def update_output(station):
     if not station:
         logging.warning("stations update prevented update because stations is empty")
         raise PreventUpdate
-    stops = feed.gtfs_find_related_stops(station)
+    stops = registry.current().feed.gtfs_find_related_stops(station)
     fig = go.Figure()
     zoom, center = zoom_from_bounds(stops)
     fig.add_trace(go.Scattermap(
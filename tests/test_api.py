@@ -0,0 +1,65 @@
+import pytest
+from flask import Flask
+
+from openfahrplan import registry
+from openfahrplan.api import api, ORJSONProvider
+
+
+@pytest.fixture(scope="module")
+def client():
+    app = Flask(__name__)
+    app.json = ORJSONProvider(app)
+    app.register_blueprint(api)
+    return app.test_client()
+
+
+def _u1_ends():
+    pattern = registry.current().lines.patterns("U1", 1)[0]
+    return pattern.stop_ids[0], pattern.stop_ids[-1]
+
+
+def test_route(client):
+    a, b = _u1_ends()
+    resp = client.get("/api/route", query_string={"from": a, "to": b, "time": "08:00"})
+    assert resp.status_code == 200
+    body = resp.json
+    assert body["feed"] == registry.current().version
+    journey = body["journey"]
+    assert journey["stops"][0] == a and journey["stops"][-1] == b
+    assert journey["departure_sec"] >= 8 * 3600
+    assert {s["stop_id"] for s in body["map"]["stops"]} == set(journey["stops"])
+
+
+@pytest.mark.parametrize("url, status", [
+    ("/api/route?from=nope&to=nope", 404),
+    ("/api/route?from=de:09564:510:1:1&to=de:09564:510:1:1&time=25h", 400),
+    ("/api/departures?stop=de:09564:510:1:1&limit=x", 400),
+    ("/api/related?stop=nope", 404),
+])
+def test_errors(client, url, status):
+    assert client.get(url).status_code == status
+
+
+def test_stations_and_related(client):
+    stations = client.get("/api/stations?q=Hauptbahnhof&limit=3").json["stations"]
+    assert 0 < len(stations) <= 3
+    related = client.get("/api/related", query_string={"stop": stations[0]["stop_id"]}).json
+    assert stations[0]["stop_id"] in {s["stop_id"] for s in related["stops"]}
+
+
+def test_batch_answers_every_query(client):
+    a, b = _u1_ends()
+    queries = [
+        {"type": "route", "from": a, "to": b, "time": "08:00"},
+        {"type": "departures", "stop": a, "time": "08:00", "limit": 3},
+        {"type": "route", "from": "nope", "to": b},
+        {"type": "teleport"},
+    ]
+    resp = client.post("/api/batch", json={"queries": queries})
+    assert resp.status_code == 200
+    results = resp.json["results"]
+    assert [r["status"] for r in results] == [200, 200, 404, 400]
+    single = client.get("/api/route", query_string={"from": a, "to": b, "time": "08:00"}).json
+    assert results[0]["result"]["journey"] == single["journey"]
+    assert len(results[1]["result"]["departures"]) == 3
+    assert client.post("/api/batch", json={"queries": [{}] * 101}).status_code == 413
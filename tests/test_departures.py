@@ -0,0 +1,53 @@
+import datetime as dt
+from zoneinfo import ZoneInfo
+
+import pandas as pd
+import pytest
+
+from openfahrplan import registry
+from openfahrplan.lib.departures import DelayIndex
+from openfahrplan.lib.realtime import TRIP_UPDATE_COLUMNS
+
+
+@pytest.mark.parametrize(
+    "stop_id, after",
+    [
+        ("de:09564:510:1:1", 8 * 3600),
+        ("de:09564:510:1:1", 23 * 3600 + 50 * 60),
+        ("de:09564:704:10:2", 12 * 3600),
+    ],
+)
+def test_next_departures(stop_id, after):
+    board = registry.current().departures
+    rows = board.departures(stop_id, after, 10)
+    assert 0 < len(rows) <= 10
+    seconds = [d["seconds"] for d in rows]
+    assert seconds == sorted(seconds)
+    assert seconds[0] >= after
+    names = {board.graph.stops.set_index("stop_id").at[stop_id, "stop_name"]}
+    assert {d["stop_name"] for d in rows} == names
+
+
+def test_realtime_delay_is_matched_by_stop_and_schedule():
+    version = registry.current()
+    board = version.departures
+    first = board.departures("de:09564:510:1:1", 8 * 3600, 1)[0]
+    mapping = version.feed.stop_mapping
+    de_id = mapping.loc[mapping["vgn_id"] == first["stop_id"], "de_id"].iloc[0]
+
+    day = dt.datetime(2025, 10, 9, tzinfo=ZoneInfo(board.timezone))
+    scheduled = int((day + dt.timedelta(seconds=first["seconds"] % 86400)).timestamp())
+    updates = pd.DataFrame([dict.fromkeys(TRIP_UPDATE_COLUMNS)])
+    updates[["stop_id", "dep_time", "dep_delay"]] = [[de_id, scheduled + 120, 120]]
+
+    delays = DelayIndex(updates, mapping, version.feed.stop_graph.pos, board.timezone)
+    delayed = board.departures("de:09564:510:1:1", 8 * 3600, 1, delays)[0]
+    assert delayed["trip_id"] == first["trip_id"]
+    assert delayed["delay"] == 120
+
+
+def test_station_keeps_same_name_stops_of_other_towns_apart():
+    board = registry.current().departures
+    # two villages called Meierhof, 125 km apart
+    ids = {board.graph.stops.at[p, "stop_id"] for p in board.station_positions("de:09373:17675:0:1")}
+    assert ids == {"de:09373:17675:0:1", "de:09373:17675:0:2"}
@@ -18,3 +18,10 @@ def test_zoom_from_bounds():
     assert np.isclose(zoom,7,atol=0.1)
     assert np.isclose(center["lat"],49.648876412452594)
     assert np.isclose(center["lon"],11.211199666403003)
+
+
+
+def test_trip_geometry_coords():
+    stop = feed.stops.iloc[0]
+    assert feed.trip_geometry.coords(stop["stop_id"]) == (stop["stop_lat"], stop["stop_lon"])
+    assert feed.trip_geometry.coords("nope") is None
@@ -0,0 +1,47 @@
+import sys
+
+import pandas as pd
+from google.transit import gtfs_realtime_pb2 as gtfs_rt
+
+from openfahrplan.lib.disruptions import DisruptionIndex
+from openfahrplan.lib.realtime import RealtimePoller, RealtimeSnapshot
+from tests.test_realtime import _feed_message
+
+
+def test_index_maps_realtime_ids_to_local_stops():
+    alerts = RealtimeSnapshot.from_content(_feed_message(["123", "456"])).alerts
+    mapping = pd.DataFrame({"vgn_id": ["a", "a", "b"], "de_id": ["123", "456", "999"]}, dtype="string")
+    index = DisruptionIndex(alerts, mapping)
+    # both realtime ids of "a" collapse into one entry, "b" has no alert
+    assert len(index) == 1
+    assert "a" in index and "b" not in index
+
+    stops = pd.DataFrame({"stop_id": ["a", "b"], "stop_name": ["A", "B"]})
+    affected = index.annotate(stops)
+    assert affected["stop_id"].tolist() == ["a"]
+    assert affected["disruption_text"].tolist() == ["Aufzug defekt"]
+    assert affected["disruption_effect"].tolist() == [[int(gtfs_rt.Alert.ACCESSIBILITY_ISSUE)]]
+
+
+def test_page_refreshes_when_another_worker_has_other_data_under_the_same_version(tmp_path, monkeypatch):
+    from openfahrplan.__main__ import app  # noqa: F401
+
+    # the page as dash loaded it, importing it again would register its path twice
+    disruptions = sys.modules["pages.disruptions"]
+
+    pollers = []
+    for name, header in (("a", "Aufzug defekt"), ("b", "Bauarbeiten")):
+        (tmp_path / f"{name}.pb").write_bytes(_feed_message(["123"], header))
+        poller = RealtimePoller(str(tmp_path / f"{name}.pb"))
+        poller.refresh()
+        pollers.append(poller)
+    first, second = (p.latest() for p in pollers)
+    # each worker numbers its own snapshots
+    assert first.version == second.version == 1
+    assert first.content_id != second.content_id
+
+    monkeypatch.setattr(disruptions, "realtime", pollers[0])
+    _, shown = disruptions._affected_stops()
+    monkeypatch.setattr(disruptions, "realtime", pollers[1])
+    _, state = disruptions.refresh_disruptions(1, shown)
+    assert state["snapshot"] == second.content_id
@@ -0,0 +1,80 @@
+import gzip
+import json
+import os
+import time
+
+import plotly.graph_objects as go
+import pytest
+from flask import Flask
+
+from openfahrplan import registry, figures
+from openfahrplan.api import api
+from openfahrplan.lib.figures import FigureCache
+
+
+class _Version:
+    def __init__(self, version):
+        self.version = version
+
+
+def test_figures_are_built_once_per_version(tmp_path):
+    cache = FigureCache(tmp_path)
+    calls = []
+
+    @cache.register("points")
+    def points(version, n):
+        calls.append(version.version)
+        return go.Figure(go.Scatter(y=list(range(int(n)))))
+
+    body, path = cache.get(_Version("a"), "points", {"n": "3"})
+    assert json.loads(gzip.decompress(body))["data"][0]["y"] == [0, 1, 2]
+    assert cache.get(_Version("a"), "points", {"n": "3"})[0] == body
+    assert calls == ["a"]
+
+    cache.get(_Version("b"), "points", {"n": "3"})
+    assert calls == ["a", "b"]
+    with pytest.raises(KeyError):
+        cache.get(_Version("b"), "nope")
+
+
+def test_prune_keeps_live_and_recently_used_versions(tmp_path):
+    live = {"served"}
+    cache = FigureCache(tmp_path, max_age=60, live=lambda: live)
+    cache.register("points")(lambda version: go.Figure(go.Scatter(y=[1])))
+    hour_ago = time.time() - 3600
+    for name in ("served", "other-worker", "old"):
+        cache.get(_Version(name), "points")
+        if name != "other-worker":
+            os.utime(tmp_path / name, (hour_ago, hour_ago))
+
+    cache.get(_Version("new"), "points")
+    assert sorted(d.name for d in tmp_path.iterdir()) == ["new", "other-worker", "served"]
+
+    # once the last request on it returned, the old served version goes too
+    live.clear()
+    cache.prune()
+    assert sorted(d.name for d in tmp_path.iterdir()) == ["new", "other-worker"]
+
+
+def test_registry_lists_live_versions():
+    version = registry.current()
+    assert version.version in registry.live_versions()
+
+
+def test_figure_endpoint_revalidates_with_etag():
+    @figures.register("test-stops")
+    def stops(version, limit):
+        s = version.feed.stops.head(int(limit))
+        return go.Figure(go.Scattermap(lat=s["stop_lat"].tolist(), lon=s["stop_lon"].tolist()))
+
+    app = Flask(__name__)
+    app.register_blueprint(api)
+    client = app.test_client()
+    url = figures.url("test-stops", limit=5)
+    resp = client.get(url)
+    assert resp.status_code == 200
+    assert len(resp.json["data"][0]["lat"]) == 5
+    assert registry.current().version in resp.headers["ETag"]
+    assert client.get(url, headers={"If-None-Match": resp.headers["ETag"]}).status_code == 304
+    assert client.get("/api/figures/missing").status_code == 404
+    assert client.get(figures.url("test-stops", limit=5, color="red")).status_code == 400
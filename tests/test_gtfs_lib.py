@@ -45,3 +45,16 @@ def test_gtfs_find_siblings(inp,expected):
 def test_gtfs_find_matching_name_stops(inp,expected):
     actual = feed.gtfs_find_matching_name_stops(inp)
     assert actual["stop_id"].tolist() == expected
+
+@pytest.mark.parametrize(
+    "inp,expected",
+    [
+        ("de:09574:7670:1:1",["de:09574:7670:1:1","de:09574:7670:2:2"]),
+        ("de:09574:7450:3:1",["de:09574:7450:3:1","de:09574:7450:2:2"]),
+    ],
+)
+def test_gtfs_find_related_stops(inp,expected):
+    actual = feed.gtfs_find_related_stops(inp)["stop_id"].tolist()
+    assert actual[0] == inp
+    assert set(expected) <= set(actual)
+    assert len(actual) == len(set(actual))
@@ -0,0 +1,64 @@
+import pandas as pd
+
+from openfahrplan.lib.history import RealtimeHistory
+from openfahrplan.lib.realtime import RealtimeSnapshot
+from tests.test_realtime import _feed_message
+
+
+def _snapshot(stop_ids, fetched_at, version=1, header="Aufzug defekt"):
+    snapshot = RealtimeSnapshot.from_content(_feed_message(stop_ids, header), version=version)
+    snapshot.fetched_at = fetched_at
+    return snapshot
+
+
+def test_append_skips_unchanged_rows(tmp_path):
+    history = RealtimeHistory(tmp_path)
+    day = pd.Timestamp("2025-10-09 08:00", tz="UTC").timestamp()
+    assert history.append(_snapshot(["123", "456"], day)) == {"alerts": 3, "trip_updates": 1}
+    assert history.append(_snapshot(["123", "456"], day + 60, 2)) == {"alerts": 0, "trip_updates": 0}
+    assert history.append(_snapshot(["123", "789"], day + 86400, 3)) == {"alerts": 1, "trip_updates": 0}
+    assert history.days() == ["2025-10-09", "2025-10-10"]
+
+    alerts = history.query("alerts")
+    assert len(alerts) == 4
+    assert alerts["stop_id"].dropna().tolist() == ["123", "456", "789"]
+
+
+def test_query_prunes_by_time_and_stop(tmp_path):
+    history = RealtimeHistory(tmp_path, auto_compact=False)
+    day = pd.Timestamp("2025-10-09 08:00", tz="UTC").timestamp()
+    history.append(_snapshot(["123"], day))
+    history.append(_snapshot(["123"], day + 3600, 2, header="Bauarbeiten"))
+    history.append(_snapshot(["456"], day + 86400, 3))
+
+    hour = history.query("alerts", start="2025-10-09 08:30", end="2025-10-09 10:00", stop_ids=["123"])
+    assert hour["header"].tolist() == ["Bauarbeiten"]
+    assert history.query("alerts", start="2025-10-10", stop_ids=["123"]).empty
+    assert history.query("trip_updates", stop_ids=["123"])["dep_time"].tolist() == [1760000060]
+
+    history.compact("alerts", "2025-10-09")
+    assert len(list((tmp_path / "alerts" / "date=2025-10-09").glob("*.parquet"))) == 1
+    assert history.query("alerts", end="2025-10-10", stop_ids=["123"])["header"].tolist() == ["Aufzug defekt", "Bauarbeiten"]
+
+
+def test_trip_update_timestamp_is_not_a_change(tmp_path):
+    history = RealtimeHistory(tmp_path, auto_compact=False)
+    day = pd.Timestamp("2025-10-09 08:00", tz="UTC").timestamp()
+    first, second = _snapshot(["123"], day), _snapshot(["123"], day + 60, 2)
+    first.trip_updates = first.trip_updates.assign(timestamp=1760000000)
+    second.trip_updates = second.trip_updates.assign(timestamp=1760000060)
+    assert history.append(first)["trip_updates"] == 1
+    assert history.append(second)["trip_updates"] == 0
+
+
+def test_first_snapshot_of_a_day_compacts_the_days_before(tmp_path):
+    history = RealtimeHistory(tmp_path)
+    day = pd.Timestamp("2025-10-09 08:00", tz="UTC").timestamp()
+    history.append(_snapshot(["123"], day))
+    history.append(_snapshot(["456"], day + 60, 2))
+    history._compactor.join()
+    assert len(list((tmp_path / "alerts" / "date=2025-10-09").glob("*.parquet"))) == 2
+    history.append(_snapshot(["789"], day + 86400, 3))
+    history._compactor.join()
+    assert len(list((tmp_path / "alerts" / "date=2025-10-09").glob("*.parquet"))) == 1
+    assert history.query("alerts", end="2025-10-10")["stop_id"].dropna().tolist() == ["123", "456"]
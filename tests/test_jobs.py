@@ -0,0 +1,120 @@
+import os
+import time
+
+import psutil
+import pytest
+
+from openfahrplan import registry
+from openfahrplan.lib.jobs import WorkerPoolManager
+from openfahrplan.lib.metrics import MetricsRegistry
+
+_job_metrics = MetricsRegistry()
+_job_seconds = _job_metrics.histogram("job_seconds", "Time spent in a job.", buckets=(0.1, 1))
+
+
+@pytest.fixture
+def managers():
+    started = []
+
+    def make(*args, **kwargs):
+        started.append(WorkerPoolManager(*args, **kwargs))
+        return started[-1]
+
+    yield make
+    for manager in started:
+        manager.shutdown()
+
+
+def _wait(condition, timeout=60):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.05)
+    return condition()
+
+
+def _load_feed():
+    registry.current()
+
+
+def _route_job(stop_from, stop_to):
+    # runs in the worker, on the feed it loaded while warming up
+    time.sleep(0.2)
+    return registry.current().version, time.time(), os.getpid()
+
+
+def test_jobs_run_in_warm_workers_with_at_most_workers_at_once(tmp_path, managers):
+    manager = managers(tmp_path, workers=1, warm_up=_load_feed)
+    job_fn = manager.make_job_fn(_route_job, progress=False)
+    keys = [f"job-{i}" for i in range(3)]
+    for key in keys:
+        manager.call_job_fn(key, job_fn, ["a", "b"], {})
+    assert _wait(lambda: all(manager.result_ready(k) for k in keys), timeout=120)
+    results = [manager.handle.get(k) for k in keys]
+    assert all(version == registry.current().version for version, _, _ in results)
+    # one long-lived worker, not a process per job
+    assert len({pid for _, _, pid in results}) == 1 and results[0][2] != os.getpid()
+    # one worker: the three jobs ran one after the other
+    done = sorted(t for _, t, _ in results)
+    assert done[1] - done[0] >= 0.2 and done[2] - done[1] >= 0.2
+
+
+def _sleep_job(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+def test_cancelled_jobs_are_dropped(tmp_path, managers):
+    manager = managers(tmp_path, workers=1)
+    job_fn = manager.make_job_fn(_sleep_job, progress=False)
+    running = manager.call_job_fn("running", job_fn, [1], {})
+    queued = manager.call_job_fn("queued", job_fn, [0], {})
+    assert _wait(lambda: isinstance(manager.handle.get(running), int))
+    assert manager.job_running(running) and manager.job_running(queued)
+    # dash cancels when the inputs change or "Abbrechen" is pressed
+    manager.terminate_job(running)
+    manager.terminate_job(queued)
+    assert not manager.job_running(running) and not manager.job_running(queued)
+
+    manager.call_job_fn("next", job_fn, [0], {})
+    assert _wait(lambda: manager.result_ready("next"))
+    assert not manager.result_ready("running") and not manager.result_ready("queued")
+
+
+def _pid_job():
+    return os.getpid()
+
+
+def test_workers_are_replaced_for_a_new_feed_version(tmp_path, managers):
+    version = ["a"]
+    manager = managers(tmp_path, workers=1, version=lambda: version[0])
+    job_fn = manager.make_job_fn(_pid_job, progress=False)
+
+    def run(key):
+        manager.call_job_fn(key, job_fn, [], {})
+        assert _wait(lambda: manager.result_ready(key))
+        return manager.handle.get(key)
+
+    first = run("first")
+    assert run("again") == first
+    version[0] = "b"
+    # the old worker serves until the new one is up
+    n = 0
+    while (pid := run(f"after-{n}")) == first and n < 600:
+        n += 1
+        time.sleep(0.1)
+    assert pid != first
+    assert _wait(lambda: not psutil.pid_exists(first) or psutil.Process(first).status() == psutil.STATUS_ZOMBIE)
+
+
+def _observing_job(seconds):
+    _job_seconds.observe(seconds)
+    return seconds
+
+
+def test_metrics_observed_in_jobs_reach_the_server(tmp_path, managers):
+    manager = managers(tmp_path, workers=1, metrics=_job_metrics)
+    job_fn = manager.make_job_fn(_observing_job, progress=False)
+    manager.call_job_fn("observe", job_fn, [0.5], {})
+    assert _wait(lambda: "job_seconds_count 1" in _job_metrics.render())
+    rendered = _job_metrics.render()
+    assert "job_seconds_count 1" in rendered and 'job_seconds_bucket{le="1"} 1' in rendered
@@ -0,0 +1,69 @@
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from openfahrplan import registry
+
+
+@pytest.mark.parametrize("line", ["U1", "U2"])
+def test_line_patterns_match_stop_times(line):
+    version = registry.current()
+    lines = version.lines
+    assert line in lines
+    st = version.feed.stop_times.set_index("trip_id")
+    for direction in lines.directions(line):
+        patterns = lines.patterns(line, direction)
+        assert patterns
+        for p in patterns:
+            assert p.dep.shape == p.arr.shape == (len(p.trip_ids), len(p.stop_ids))
+            # trips ordered by their first departure
+            first = np.where(p.dep >= 0, p.dep, np.iinfo(np.int32).max).min(axis=1)
+            assert (np.diff(first) >= 0).all()
+            trip = st.loc[[p.trip_ids[0]]].sort_values("stop_sequence")
+            assert trip["stop_id"].tolist() == p.stop_ids
+
+
+def test_line_stops_cover_all_patterns():
+    lines = registry.current().lines
+    stops = lines.stops("U1", 1)
+    assert stops["stop_id"].is_unique
+    assert set(stops["stop_id"]) == {s for p in lines.patterns("U1", 1) for s in p.stop_ids}
+    assert stops[["stop_lat", "stop_lon"]].notna().all().all()
+
+
+def test_lines_without_direction_id():
+    from openfahrplan.__main__ import app  # noqa: F401
+    from openfahrplan.lib.lines import LineIndex
+
+    # the page as dash loaded it, importing it again would register its path twice
+    line_figure = sys.modules["pages.line"].line_figure
+
+    feed = SimpleNamespace(
+        stops=pd.DataFrame({"stop_id": ["a", "b", "c"], "stop_name": ["A", "B", "C"],
+                            "stop_lat": [49.4, 49.5, 49.6], "stop_lon": [11.0, 11.1, 11.2]}),
+        routes=pd.DataFrame({"route_id": ["r"], "route_short_name": ["X1"]}),
+        trips=pd.DataFrame({"trip_id": ["t1", "t2", "t3"], "route_id": ["r"] * 3,
+                            "direction_id": [np.nan] * 3}),
+        stop_times=pd.DataFrame({
+            "trip_id": ["t1", "t1", "t2", "t2", "t3", "t3", "t3"],
+            "stop_id": ["a", "b", "a", "b", "a", "b", "c"],
+            "stop_sequence": [1, 2, 1, 2, 1, 2, 3],
+            "arrival_time": ["08:00:00", "08:05:00", "09:00:00", "09:05:00", "07:00:00", "07:05:00", "07:10:00"],
+            "departure_time": ["08:00:00", "08:05:00", "09:00:00", "09:05:00", "07:00:00", "07:05:00", "07:10:00"],
+        }),
+    )
+    lines = LineIndex(feed)
+    assert lines.directions("X1") == [None]
+    # both stop patterns of the line, not one group per trip
+    assert [p.trip_ids for p in lines.patterns("X1", None)] == [["t3"], ["t1", "t2"]]
+
+    version = SimpleNamespace(lines=lines)
+    for direction in (None, "None"):
+        fig = line_figure(version, "X1", direction)
+        assert list(fig.data[0].text) == ["A", "B", "C"]
+        assert len(fig.data) == 3
+    with pytest.raises(KeyError):
+        line_figure(version, "X1", "0")
@@ -0,0 +1,67 @@
+import threading
+import time
+
+import pytest
+from werkzeug.serving import make_server
+
+from openfahrplan import registry, realtime
+from openfahrplan.lib.loadtest import Stats, Targets, _find, parse_mix, run
+from openfahrplan.lib.replay import ReplayServer
+from tests.test_realtime import _feed_message
+
+
+@pytest.fixture(scope="module")
+def server(tmp_path_factory):
+    from openfahrplan.__main__ import app, jobs
+
+    recordings = tmp_path_factory.mktemp("recordings")
+    (recordings / "1760000000.pb").write_bytes(_feed_message(["de:09564:510"]))
+    with ReplayServer(recordings, port=0) as replay, pytest.MonkeyPatch.context() as mp:
+        mp.setattr(realtime, "url", replay.url)
+        # the job workers are spawned, they read the url on import
+        mp.setenv("OPENFAHRPLAN_REALTIME_URL", replay.url)
+        jobs.start()
+        deadline = time.time() + 120
+        while not jobs.ready and time.time() < deadline:
+            time.sleep(0.1)
+        srv = make_server("127.0.0.1", 0, app.server, threaded=True)
+        thread = threading.Thread(target=srv.serve_forever, daemon=True)
+        thread.start()
+        yield f"http://127.0.0.1:{srv.server_port}"
+        srv.shutdown()
+        jobs.shutdown()
+
+
+def test_stats_summary():
+    stats = Stats()
+    for ms in range(1, 101):
+        stats.record("callback stations", ms / 1000)
+    stats.record("callback stations", 2.0, "HTTP 500")
+    stats.session("station", True)
+    summary = stats.summary()
+    e = summary["endpoints"]["callback stations"]
+    assert e["count"] == 101 and e["errors"] == {"HTTP 500": 1}
+    assert e["p50"] == pytest.approx(0.051) and e["max"] == 2.0
+    assert summary["error_rate"] == pytest.approx(1 / 101)
+    assert summary["sessions"] == {"station": {"completed": 1, "failed": 0}}
+
+
+def test_parse_mix_and_find():
+    assert parse_mix("station=3,line") == {"station": 3.0, "line": 1.0}
+    with pytest.raises(ValueError):
+        parse_mix("checkout=1")
+    tree = {"props": {"children": [{"props": {"id": "a", "value": 1}}, {"props": {"id": "b", "data": 2}}]}}
+    assert _find(tree, "b") == {"id": "b", "data": 2}
+    assert _find(tree, "c") is None
+
+
+def test_sessions_run_against_the_app(server):
+    pattern = registry.current().lines.patterns("U1", 1)[0]
+    targets = Targets([pattern.stop_ids[0], pattern.stop_ids[-1]], ["U1"])
+    stats = run(server, users=2, duration=3, think=0, seed=1, targets=targets)
+    summary = stats.summary()
+    assert summary["errors"] == 0
+    assert all(s["failed"] == 0 for s in summary["sessions"].values())
+    endpoints = summary["endpoints"]
+    assert "job connection" in endpoints and "callback stations" in endpoints
+    assert "GET /api/figures/line" in endpoints and "callback page /disruptions" in endpoints
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from openfahrplan import registry
+from openfahrplan.lib.memory import MemoryBudgetExceeded, account, check_budget, deep_size, parse_size
+
+
+def test_parse_size():
+    assert parse_size("512M") == 512 * 1024 ** 2
+    assert parse_size("1.5GiB") == int(1.5 * 1024 ** 3)
+    assert parse_size("1000") == 1000
+    assert parse_size(None) is None
+    with pytest.raises(ValueError):
+        parse_size("lots")
+
+
+def test_deep_size_counts_shared_objects_once():
+    arr = np.zeros(1000, dtype=np.int64)
+    view = arr[10:20]
+    seen = set()
+    first = deep_size({"a": arr, "b": view}, seen)
+    assert first >= arr.nbytes
+    assert deep_size(view, seen) == 0
+    assert deep_size([["x" * 100] * 3], set()) < deep_size([["x" * 100 + str(i) for i in range(3)]], set())
+
+
+def test_account_covers_tables_and_indexes():
+    version = registry.current()
+    rows = account(version)
+    parts = {(r["component"], r["part"]) for r in rows}
+    assert ("feed", "stop_times") in parts
+    assert ("raptor_index", "trips") in parts and ("raptor_index", "foot") in parts
+    assert ("departures", "") in parts and ("lines", "") in parts
+    assert all(r["bytes"] >= 0 for r in rows)
+    stop_times = next(r["bytes"] for r in rows if r["part"] == "stop_times")
+    assert stop_times >= version.feed.stop_times.memory_usage().sum()
+
+
+def test_budget():
+    version = registry.current()
+    assert check_budget(version, None) is None
+    assert not check_budget(version, parse_size("100G"))["over_budget"]
+    with pytest.raises(MemoryBudgetExceeded, match="stop_times"):
+        check_budget(version, 1024)
@@ -0,0 +1,39 @@
+from flask import Flask
+
+from openfahrplan import registry
+from openfahrplan.api import api
+from openfahrplan.lib.metrics import MetricsRegistry, route_seconds
+from openfahrplan.lib.raptor import raptor_route
+
+
+def test_histogram_and_counter_render():
+    m = MetricsRegistry()
+    h = m.histogram("t_seconds", "test", buckets=(0.1, 1.0))
+    for s in (0.05, 0.5, 5):
+        h.observe(s)
+    c = m.counter("t_total", "test", ("result",))
+    c.inc("ok")
+    c.inc("ok")
+    c.inc('we"ird')
+    text = m.render()
+    assert 't_seconds_bucket{le="0.1"} 1' in text
+    assert 't_seconds_bucket{le="1.0"} 2' in text
+    assert 't_seconds_bucket{le="+Inf"} 3' in text
+    assert "t_seconds_count 3" in text
+    assert 't_total{result="ok"} 2' in text
+    assert 't_total{result="we\\"ird"} 1' in text
+
+
+def test_metrics_endpoint():
+    before = route_seconds.count
+    raptor_route(registry.current().raptor_index, "de:09564:510:1:1", "de:09564:704:10:2")
+    assert route_seconds.count == before + 1
+
+    app = Flask(__name__)
+    app.register_blueprint(api)
+    resp = app.test_client().get("/metrics")
+    assert resp.status_code == 200
+    text = resp.get_data(as_text=True)
+    assert "openfahrplan_raptor_route_seconds_count" in text
+    assert f'openfahrplan_feed_info{{version="{registry.current().version}"}} 1' in text
+    assert 'openfahrplan_index_entries{index="raptor_stops"}' in text
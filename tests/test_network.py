@@ -0,0 +1,39 @@
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+from openfahrplan import registry
+from openfahrplan.lib.network import TransferNetwork
+
+
+def test_overview_is_bounded_by_the_grid():
+    network = registry.current().transfer_network
+    network_view = network.view(7)
+    assert not network_view.detail
+    assert len(network_view.lat) // 3 < len(network)
+    assert len(network_view.stop_lat) < len(network.lat)
+
+
+@pytest.mark.parametrize("bbox", [(11.05, 49.43, 11.11, 49.47), (11.07, 49.44, 11.09, 49.45)])
+def test_zoomed_in_view_has_every_visible_edge(bbox):
+    network = registry.current().transfer_network
+    network_view = network.view(14, bbox)
+    assert network_view.detail
+    min_lon, min_lat, max_lon, max_lat = bbox
+    inside = {i for i, (la, lo) in enumerate(zip(network.lat, network.lon))
+              if min_lon <= lo <= max_lon and min_lat <= la <= max_lat}
+    expected = sum(1 for a, b in zip(network.a, network.b) if a in inside or b in inside)
+    assert expected > 0
+    assert len(network_view.lat) // 3 == expected
+
+
+def test_feed_without_transfers_has_an_empty_figure():
+    # pages can only be imported by the app that registers them
+    from openfahrplan.__main__ import app  # noqa: F401
+    from openfahrplan.pages._transfers import transfers_figure
+
+    stops = pd.DataFrame({"stop_id": ["a"], "stop_name": ["A"], "stop_lat": [49.45], "stop_lon": [11.08]})
+    feed = SimpleNamespace(stops=stops, transfers=pd.DataFrame(columns=["from_stop_id", "to_stop_id"]))
+    fig = transfers_figure(SimpleNamespace(transfer_network=TransferNetwork(feed)))
+    assert [len(trace.lat) for trace in fig.data] == [0, 0]
@@ -0,0 +1,144 @@
+import copy
+import math
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from openfahrplan import registry
+from openfahrplan.lib.partition import RoutePartition, _bisect, _routes, partition_path
+from openfahrplan.lib.raptor import RaptorIndex, _hops, _parse_gtfs_time, _search, raptor_route
+
+
+def _hhmm(sec: int) -> str:
+    return f"{sec // 3600:02d}:{sec % 3600 // 60:02d}:00"
+
+
+def _feed():
+    # the local L stops everywhere from A to E, the express X runs A -> E only around 7:00,
+    # Y goes from B to G, north of the line, and A and G are a walk apart
+    stops = pd.DataFrame({
+        "stop_id": ["A", "G", "B", "C", "D", "E"],
+        "stop_lat": [49.45, 49.455, 49.45, 49.45, 49.45, 49.45],
+        "stop_lon": [11.0, 11.005, 11.01, 11.02, 11.03, 11.04],
+    })
+    rows = []
+    for n, dep in enumerate(range(5 * 3600, 23 * 3600, 600)):
+        rows += [(f"L{n}", stop, _hhmm(dep + 300 * i), _hhmm(dep + 300 * i), i + 1) for i, stop in enumerate("ABCDE")]
+    for n, dep in enumerate((6 * 3600 + 3000, 7 * 3600)):
+        rows += [(f"X{n}", "A", _hhmm(dep), _hhmm(dep), 1), (f"X{n}", "E", _hhmm(dep + 480), _hhmm(dep + 480), 2)]
+    for n, dep in enumerate(range(5 * 3600, 23 * 3600, 1800)):
+        rows += [(f"Y{n}", "B", _hhmm(dep), _hhmm(dep), 1), (f"Y{n}", "G", _hhmm(dep + 180), _hhmm(dep + 180), 2)]
+    stop_times = pd.DataFrame(rows, columns=["trip_id", "stop_id", "arrival_time", "departure_time", "stop_sequence"])
+    transfers = pd.DataFrame({"from_stop_id": ["A", "G"], "to_stop_id": ["G", "A"], "transfer_type": [2, 2],
+                              "min_transfer_time": [240, 240]})
+    return SimpleNamespace(stops=stops, stop_times=stop_times, transfers=transfers)
+
+
+@pytest.fixture(scope="module")
+def partitioned():
+    feed = _feed()
+    index = RaptorIndex.from_feed(feed)
+    index.partition = RoutePartition.build(index, feed.stops, cells=2)
+    return index
+
+
+def _sampled_flags(index: RaptorIndex, times: tuple) -> np.ndarray:
+    # flags from one-to-all searches at a few departure times only
+    route_of, _ = _routes(index)
+    partition = index.partition
+    flags = np.zeros_like(partition.flags)
+    for s_idx in range(index.nstops):
+        for t in times:
+            best, parents = _search(index, s_idx, _parse_gtfs_time(t), 8)
+            for v, arrival in enumerate(best):
+                if arrival < math.inf and v != s_idx:
+                    for _, via, _, _ in _hops(parents, s_idx, v, 8):
+                        if via is not None:
+                            flags[route_of[via], partition.cell_of[v]] = True
+    return flags
+
+
+def test_bisect_balances_cells():
+    xy = np.random.default_rng(0).random((1000, 2))
+    cell_of = _bisect(xy, 6)
+    sizes = np.bincount(cell_of)
+    assert len(sizes) == 6 and sizes.max() - sizes.min() <= 2
+
+
+def test_pruned_searches_match_full_searches(partitioned):
+    stop_ids = list(partitioned.stop_ids)
+    for dep in range(4 * 3600, 24 * 3600, 600):
+        for a in stop_ids:
+            for b in stop_ids:
+                stats = {}
+                pruned = raptor_route(partitioned, a, b, _hhmm(dep), stats=stats)
+                full = raptor_route(partitioned, a, b, _hhmm(dep), pruned=False)
+                assert stats["partition"] == "pruned"
+                assert (pruned is None) == (full is None)
+                if full is not None:
+                    assert (pruned.arrival_sec, pruned.transfers) == (full.arrival_sec, full.transfers)
+    # Y only leads to G, a query into the cell of C, D and E doesn't board it
+    east = partitioned.partition.cell_of[partitioned.stop_to_idx["E"]]
+    assert partitioned.partition.cell_of[partitioned.stop_to_idx["G"]] != east
+    assert 0 < partitioned.partition.allowed(partitioned.stop_to_idx["E"]).sum() < len(partitioned.partition.flags)
+
+
+def test_flags_keep_routes_that_are_only_faster_at_some_times(partitioned):
+    full = raptor_route(partitioned, "A", "E", "06:45:00", pruned=False)
+    assert [leg.trip_id for leg in full.legs if leg.kind == "trip"] == ["X0"]
+    assert raptor_route(partitioned, "A", "E", "06:45:00").to_dict() == full.to_dict()
+
+    # searches at fixed times never take the express, flags from them would lose it
+    partition = partitioned.partition
+    flags = partition.flags
+    partition.flags = _sampled_flags(partitioned, ("06:00:00", "08:00:00", "12:00:00", "17:00:00"))
+    try:
+        sampled = raptor_route(partitioned, "A", "E", "06:45:00")
+    finally:
+        partition.flags = flags
+    assert sampled.arrival_sec > full.arrival_sec
+
+
+def test_queries_the_flags_dont_cover_search_the_whole_network(partitioned):
+    for departure_time, max_rounds in (("08:00:00", 9), ("24:30:00", 8)):
+        stats = {}
+        raptor_route(partitioned, "A", "E", departure_time, max_rounds=max_rounds, stats=stats)
+        assert stats["partition"] == "full"
+
+
+def test_flags_need_an_index_without_transfer_penalty():
+    feed = _feed()
+    feed.stops["parent_station"] = None
+    with pytest.raises(ValueError, match="transfer penalty"):
+        RoutePartition.build(RaptorIndex.from_feed(feed, collapse_stations=True, transfer_penalty=120), feed.stops)
+    index = RaptorIndex.from_feed(feed, collapse_stations=True, transfer_penalty=0)
+    assert RoutePartition.build(index, feed.stops, cells=2).flags.any()
+
+
+def test_save_and_load(partitioned, tmp_path):
+    path = partition_path(tmp_path, "v", 2, prune_unserved=True)
+    assert path.name == "v-2-pruned.npz"
+    partitioned.partition.save(path)
+    loaded = RoutePartition.load(path, partitioned)
+    assert np.array_equal(loaded.flags, partitioned.partition.flags)
+    assert np.array_equal(loaded.cell_of, partitioned.partition.cell_of)
+    assert loaded.rounds == 8
+
+
+def test_feed_version_only_loads_flags(tmp_path):
+    version = copy.copy(registry.current())
+    version.data = tmp_path
+    index = version.raptor_index
+    # none built for this version, routing goes on without them
+    assert version._load_partition(2) is None
+    assert not (tmp_path / "partitions").exists()
+
+    path = partition_path(tmp_path, version.version, 2)
+    RoutePartition(index, _bisect(np.zeros((index.nstops, 2)), 2), rounds=8).save(path)
+    assert version._load_partition(2).cells == 2
+    # flags saved before they were exact have no rounds
+    with np.load(path) as f:
+        np.savez(path, cell_of=f["cell_of"], flags=f["flags"], shape=f["shape"])
+    assert version._load_partition(2) is None
@@ -0,0 +1,111 @@
+import os
+import threading
+import time
+
+import pytest
+from google.transit import gtfs_realtime_pb2 as gtfs_rt
+
+from openfahrplan.lib.realtime import RealtimePoller, RealtimeSnapshot, decode_feed
+
+
+def _feed_message(stop_ids, header="Aufzug defekt"):
+    f = gtfs_rt.FeedMessage()
+    f.header.gtfs_realtime_version = "2.0"
+    f.header.timestamp = 1760000000
+    e = f.entity.add()
+    e.id = "alert-1"
+    e.alert.cause = gtfs_rt.Alert.TECHNICAL_PROBLEM
+    e.alert.effect = gtfs_rt.Alert.ACCESSIBILITY_ISSUE
+    e.alert.header_text.translation.add(text=header, language="de")
+    for stop_id in stop_ids:
+        e.alert.informed_entity.add(stop_id=stop_id)
+    e.alert.informed_entity.add(route_id="U1")
+    e = f.entity.add()
+    e.id = "trip-1"
+    e.trip_update.trip.trip_id = "t1"
+    e.trip_update.timestamp = 1760000030
+    stu = e.trip_update.stop_time_update.add(stop_id="123", stop_sequence=1)
+    stu.departure.time = 1760000060
+    return f.SerializeToString()
+
+
+@pytest.fixture
+def pb(tmp_path):
+    path = tmp_path / "feed.pb"
+    path.write_bytes(_feed_message(["123", "456"]))
+    return path
+
+
+def test_snapshot_from_content(pb):
+    snapshot = RealtimeSnapshot.from_content(pb.read_bytes())
+    assert snapshot.feed_timestamp == 1760000000
+    assert len(snapshot.trip_updates) == 1
+    assert snapshot.disruptions["stop_id"].tolist() == ["123", "456"]
+    assert snapshot.disruptions["header"].unique().tolist() == ["Aufzug defekt"]
+
+
+def test_decode_selects_stops_trips_and_routes():
+    f = gtfs_rt.FeedMessage()
+    f.ParseFromString(_feed_message(["123"]))
+    e = f.entity.add(id="trip-2")
+    e.trip_update.trip.trip_id, e.trip_update.trip.route_id = "t2", "U2"
+    e.trip_update.stop_time_update.add(stop_id="900", stop_sequence=1)
+    e.trip_update.stop_time_update.add(stop_id="123", stop_sequence=2)
+
+    trip_updates, alerts = decode_feed(f, stop_ids=frozenset(["123"]))
+    assert trip_updates["stop_id"].tolist() == ["123", "123"]
+    assert alerts["stop_id"].tolist() == ["123"]
+    # a selected trip or route comes in full, its stops outside the filter too
+    trip_updates, _ = decode_feed(f, stop_ids=frozenset(["123"]), trip_ids=frozenset(["t2"]))
+    assert trip_updates["stop_id"].tolist() == ["123", "900", "123"]
+    trip_updates, alerts = decode_feed(f, route_ids=frozenset(["U2", "U1"]))
+    assert trip_updates["trip_id"].tolist() == ["t2", "t2"]
+    assert alerts["route_id"].tolist() == ["U1"]
+
+
+def test_trip_updates_keep_timestamp_and_schedule_relationship():
+    f = gtfs_rt.FeedMessage()
+    f.ParseFromString(_feed_message([]))
+    skipped = gtfs_rt.TripUpdate.StopTimeUpdate.SKIPPED
+    f.entity[1].trip_update.stop_time_update.add(stop_id="124", stop_sequence=2, schedule_relationship=skipped)
+    trip_updates = RealtimeSnapshot.from_content(f.SerializeToString()).trip_updates
+    assert trip_updates["timestamp"].tolist() == [1760000030, 1760000030]
+    assert trip_updates["schedule_rel"].tolist() == [gtfs_rt.TripUpdate.StopTimeUpdate.SCHEDULED, skipped]
+
+
+def test_poller_publishes_only_changes(pb):
+    poller = RealtimePoller(pb.as_uri())
+    assert poller.refresh()
+    first = poller.snapshot(wait=1)
+    assert first.version == 1
+    assert not poller.refresh()
+    pb.write_bytes(_feed_message(["789"]))
+    os.utime(pb, ns=(0, os.stat(pb).st_mtime_ns + 1))
+    assert poller.refresh()
+    second = poller.snapshot()
+    assert second.version == 2
+    assert second.disruptions["stop_id"].tolist() == ["789"]
+    # the old snapshot is untouched for callbacks still holding it
+    assert first.disruptions["stop_id"].tolist() == ["123", "456"]
+    poller.stop()
+
+
+def test_concurrent_refreshes_publish_distinct_versions(pb):
+    # every fetch sees new content and is slow to decode, so two refreshes overlap
+    poller = RealtimePoller(pb.as_uri(), stop_filter=lambda: time.sleep(0.05))
+    poller._fetch = pb.read_bytes
+    versions = []
+    poller.listeners.append(lambda snapshot: versions.append(snapshot.version))
+    threads = [threading.Thread(target=poller.refresh) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(versions) == [1, 2, 3, 4]
+    assert poller.latest().version == 4
+
+
+def test_decode_filters_to_relevant_stops(pb):
+    snapshot = RealtimeSnapshot.from_content(pb.read_bytes(), stop_ids=frozenset({"456"}))
+    assert snapshot.disruptions["stop_id"].tolist() == ["456"]
+    assert snapshot.trip_updates.empty
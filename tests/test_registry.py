@@ -0,0 +1,50 @@
+from flask import Flask
+
+from openfahrplan import registry, data_folder
+from openfahrplan.api import api
+from openfahrplan.lib.raptor import raptor_route
+from openfahrplan.lib.registry import FeedRegistry, feed_fingerprint
+from openfahrplan.lib.startup import StartupReport
+
+
+def test_current_version_matches_disk():
+    assert registry.current().version == feed_fingerprint(data_folder)
+
+
+def test_reload_swaps_version_atomically():
+    reg = FeedRegistry(data_folder)
+    old = reg.load()
+    reg.reload(background=True).join()
+    new = reg.current()
+    assert new is not old
+    assert new.version == old.version
+    # requests that started on the old version can still finish on it
+    res = raptor_route(old.raptor_index, "de:09564:654:11:1", "de:09564:704:10:2")
+    assert res.trips == raptor_route(new.raptor_index, "de:09564:654:11:1", "de:09564:704:10:2").trips
+
+
+def test_background_start_reports_readiness():
+    reg = FeedRegistry(data_folder, startup=StartupReport())
+    assert not reg.ready
+    reg.start().join()
+    assert reg.ready and reg.error is None
+    assert reg.current().version == feed_fingerprint(data_folder)
+    assert {"feed.feed", "feed.raptor_index", "feed.departures"} <= set(reg.startup.phases)
+
+
+def test_readyz():
+    app = Flask(__name__)
+    app.register_blueprint(api)
+    client = app.test_client()
+    assert client.get("/healthz").status_code == 200
+    resp = client.get("/readyz")
+    assert resp.status_code == 200
+    assert resp.json["feed"] == registry.current().version
+
+
+def test_memory_report_is_measured_once_per_version():
+    reg = FeedRegistry(data_folder)
+    version = reg.load()
+    assert reg.memory is None
+    first = reg.memory_report()
+    assert first["feed"] == version.version and first is reg.memory_report()
@@ -0,0 +1,36 @@
+import pytest
+
+from openfahrplan.lib.realtime import RealtimePoller
+from openfahrplan.lib.replay import ReplayServer
+from tests.test_realtime import _feed_message
+
+
+@pytest.fixture
+def recordings(tmp_path):
+    (tmp_path / "1760000000.pb").write_bytes(_feed_message(["123"]))
+    (tmp_path / "1760000060.pb").write_bytes(_feed_message(["456"]))
+    return tmp_path
+
+
+def test_replay_follows_recorded_timeline(recordings):
+    with ReplayServer(recordings, port=0, rate=60) as server:
+        seen = []
+        poller = RealtimePoller(server.url, listeners=[seen.append])
+        assert poller.refresh()
+        assert seen[-1].disruptions["stop_id"].tolist() == ["123"]
+        # unchanged snapshot: 304 via ETag
+        assert not poller.refresh()
+        server._started -= 1.5
+        assert poller.refresh()
+        assert seen[-1].disruptions["stop_id"].tolist() == ["456"]
+
+
+def test_replay_failure_pattern(recordings):
+    with ReplayServer(recordings, port=0, pattern=["503", "truncated", "ok"], loop=False) as server:
+        poller = RealtimePoller(server.url)
+        with pytest.raises(Exception):
+            poller.refresh()
+        with pytest.raises(Exception):
+            poller.refresh()
+        assert poller.refresh()
+        assert server.requests == 3
@@ -1,6 +1,9 @@
+from types import SimpleNamespace
+
+import pandas as pd
 import pytest
 
-from openfahrplan.lib.raptor import raptor_route
+from openfahrplan.lib.raptor import raptor_route, RaptorIndex
 from openfahrplan import feed, raptor_index
 
 
@@ -114,4 +117,64 @@ from openfahrplan import feed, raptor_index
 
 def test_routing(src, dst, expected):
     res = raptor_route(raptor_index,feed.gtfs_find_station(src,limit=1)["stop_id"].squeeze() , feed.gtfs_find_station(dst,limit=1)["stop_id"].squeeze())
-    assert res["trips"] == expected
+    assert res.trips == expected
+
+
+@pytest.fixture(scope="module")
+def collapsed_index():
+    return RaptorIndex.from_feed(feed, prune_unserved=True, collapse_stations=True)
+
+
+def test_pruned_index_routes_like_full_index():
+    pruned = RaptorIndex.from_feed(feed, prune_unserved=True)
+    assert pruned.nstops < raptor_index.nstops
+    res = raptor_route(pruned, "de:09564:654:11:1", "de:09564:704:10:2")
+    assert res.trips == raptor_route(raptor_index, "de:09564:654:11:1", "de:09564:704:10:2").trips
+
+
+def test_collapsed_index_expands_platforms(collapsed_index):
+    res = raptor_route(collapsed_index, "de:09564:654:11:1", "de:09564:704:10:2")
+    stop_ids = set(feed.stops["stop_id"])
+    assert collapsed_index.nstops < raptor_index.nstops
+    assert all(sid in stop_ids for leg in res.legs if leg.kind == "trip" for sid in leg.stops)
+
+
+def test_journey_legs_carry_positions_and_times():
+    res = raptor_route(raptor_index, "de:09564:654:11:1", "de:09564:704:10:2", departure_time="08:00:00")
+    assert res.departure_sec >= 8 * 3600
+    rides = [leg for leg in res.legs if leg.kind == "trip"]
+    assert rides
+    for leg in rides:
+        trip = raptor_index.trips[leg.trip_id]
+        assert leg.dep == trip["dep"][leg.board] and leg.arr == trip["arr"][leg.alight]
+        assert len(leg.stops) == len(leg.times) == leg.alight - leg.board + 1
+    assert res.legs[-1].arr <= res.arrival_sec
+    assert res.to_dict()["legs"][0]["stops"] == list(res.legs[0].stops)
+
+
+def _station_feed():
+    # A1 -T1-> B1, then either T2 from B2 (same station B) or a walk to C1 and T3
+    stops = pd.DataFrame({
+        "stop_id": ["A1", "B", "B1", "B2", "C", "C1", "D1"],
+        "parent_station": [None, None, "B", "B", None, "C", None],
+    })
+    stop_times = pd.DataFrame([
+        ("T1", "A1", "08:00:00", "08:00:00", 1), ("T1", "B1", "08:10:00", "08:10:00", 2),
+        ("T2", "B2", "08:11:00", "08:11:00", 1), ("T2", "D1", "08:18:00", "08:18:00", 2),
+        ("T3", "C1", "08:11:00", "08:11:00", 1), ("T3", "D1", "08:20:00", "08:20:00", 2),
+    ], columns=["trip_id", "stop_id", "arrival_time", "departure_time", "stop_sequence"])
+    transfers = pd.DataFrame({"from_stop_id": ["B1", "B1"], "to_stop_id": ["B2", "C1"], "transfer_type": [2, 2],
+                              "min_transfer_time": [30, 60]})
+    return SimpleNamespace(stops=stops, stop_times=stop_times, transfers=transfers)
+
+
+def test_transfer_penalty_only_when_reboarding_in_the_station():
+    index = RaptorIndex.from_feed(_station_feed(), collapse_stations=True, transfer_penalty=120)
+    res = raptor_route(index, "A1", "D1")
+    # T2 leaves B 60s after T1 arrives, the walk to C already paid its 60s for T3
+    assert res.arrival_sec == 8 * 3600 + 20 * 60
+    assert [(leg.kind, leg.stops) for leg in res.legs] == [
+        ("trip", ("A1", "B1")), ("walk", ("B1", "C1")), ("trip", ("C1", "D1"))]
+    assert res.stops == ["A1", "B1", "C1", "D1"]
+    # without contraction B1 -> B2 takes 30s and T2 is caught
+    assert raptor_route(RaptorIndex.from_feed(_station_feed()), "A1", "D1").arrival_sec == 8 * 3600 + 18 * 60
@@ -0,0 +1,124 @@
+import json
+import random
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+from rapidfuzz import fuzz, process
+
+import openfahrplan
+from openfahrplan import feed
+from openfahrplan.lib import search
+from openfahrplan.lib.search import normalize_name
+
+
+@pytest.mark.parametrize(
+    "inp,expected",
+    [
+        ("Nürnberg Gustav-Adolf-Str.", "nurnberg gustav adolf strasse"),
+        ("Deichslerstraße", "deichslerstrasse"),
+        ("  Fürth   Hbf ", "furth hbf"),
+    ],
+)
+def test_normalize_name(inp, expected):
+    assert normalize_name(inp) == expected
+
+
+def test_search_many_matches_single_queries():
+    queries = ["Nürnberg Hbf", "Plärrer", "Reichenschwand Rathaus"]
+    batch = feed.search_index.search_many(queries, limit=3)
+    for q, res in zip(queries, batch):
+        assert res["stop_id"].tolist() == feed.search_index.search(q, limit=3)["stop_id"].tolist()
+
+
+def test_options():
+    assert feed.search_index.options("Nürnberg Hbf", limit=1) == [{"value": "de:09564:510:1:1", "label": "Nürnberg Hbf"}]
+
+
+def test_bundle_is_columnar():
+    bundle = feed.search_index.bundle("test")
+    assert bundle["version"] == "test"
+    assert len(bundle["ids"]) == len(bundle["names"]) == len(bundle["norm"]) == len(bundle["parent"]) == len(feed.search_index)
+    assert bundle["norm"][bundle["ids"].index("de:09564:510:1:1")] == "nurnberg hbf"
+
+
+def _scored(monkeypatch) -> list[int]:
+    """Number of names scored per cdist call of the search."""
+    scored = []
+    cdist = process.cdist
+
+    def counting(queries, choices, **kwargs):
+        scored.append(len(choices))
+        return cdist(queries, choices, **kwargs)
+
+    monkeypatch.setattr(search.process, "cdist", counting)
+    return scored
+
+
+@pytest.mark.parametrize("query", ["Nü", "Nürnberg Hb", "Fürth Hauptb", "Reichenschw"])
+def test_unfinished_words_are_matched_from_the_shortlist(query, monkeypatch):
+    index = feed.search_index
+    scored = _scored(monkeypatch)
+    name = index.names[index.match(query, limit=1)[0][0]]
+    assert normalize_name(name).split(" ")[-1].startswith(normalize_name(query).split(" ")[-1])
+    # one cdist over the shortlist, no rescan of all names
+    assert len(scored) == 1 and scored[0] <= index.shortlist_size + index.prefix_size
+
+
+@pytest.mark.parametrize("query", ["pe", "un", "x"])
+def test_weak_shortlist_falls_back_to_all_names(query, monkeypatch):
+    index = feed.search_index
+    full = process.cdist([normalize_name(query)], index.normalized, scorer=fuzz.token_set_ratio)[0]
+    scored = _scored(monkeypatch)
+    assert index.match(query, limit=1)[0][1] == pytest.approx(full.max())
+    assert scored[-1] == len(index)
+
+
+_NODE_PARITY = """
+const fs = require("fs");
+const [bundle, queries, dropdowns] = JSON.parse(fs.readFileSync(process.argv[2], "utf8"));
+globalThis.window = {dash_clientside: {no_update: null}};
+globalThis.fetch = async () => ({json: async () => bundle});
+require(process.argv[3]);
+// keystrokes in one dropdown are debounced
+const filter = (q, i) => {
+    window.dash_clientside.callback_context = {triggered_id: {type: "station", key: dropdowns[i]}};
+    const result = window.dash_clientside.openfahrplan.filterStations(q, null);
+    delete window.dash_clientside.callback_context;
+    return result;
+};
+Promise.all(queries.map(filter))
+    .then(results => console.log(JSON.stringify(results.map(r => r && r.map(o => o.value)))));
+"""
+
+
+def _run_in_node(tmp_path, queries, dropdowns):
+    """filterStations of assets/stations.js for the queries typed into the dropdowns at once."""
+    bundle = json.loads(json.dumps(feed.search_index.bundle("test")))
+    (tmp_path / "input.json").write_text(json.dumps([bundle, queries, dropdowns]))
+    (tmp_path / "parity.js").write_text(_NODE_PARITY)
+    script = Path(openfahrplan.__file__).parent / "assets" / "stations.js"
+    out = subprocess.run(["node", tmp_path / "parity.js", tmp_path / "input.json", script],
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out)
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="needs node")
+def test_browser_matches_like_the_server(tmp_path):
+    index = feed.search_index
+    rng = random.Random(0)
+    names = rng.sample(index.names, 60)
+    queries = ["Nürnberg Hbf", "nbg hbf", "Fürth", "Gustav-Adolf-Str.", "Straße", "Plärrer", "Nür", "We", "x"]
+    queries += names + [n[:rng.randint(1, len(n))] for n in names]
+    queries += [n[:i] + n[i + 1:] for n in names for i in [rng.randrange(len(n))]]
+    # every query in its own dropdown, so none is debounced away
+    for q, browser in zip(queries, _run_in_node(tmp_path, queries, list(range(len(queries))))):
+        assert browser == [o["value"] for o in index.options(q, limit=10)], q
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="needs node")
+def test_browser_matches_only_the_last_keystroke(tmp_path):
+    results = _run_in_node(tmp_path, ["N", "Nü", "Nürnberg Hbf"], ["from"] * 3)
+    # the first two keystrokes are superseded before they are matched
+    assert results == [None, None, [o["value"] for o in feed.search_index.options("Nürnberg Hbf")]]
@@ -0,0 +1,48 @@
+from openfahrplan import registry
+from openfahrplan.lib.slowlog import SlowQueryLog, read, replay
+
+
+def _u1_ends():
+    pattern = registry.current().lines.patterns("U1", 1)[0]
+    return pattern.stop_ids[0], pattern.stop_ids[-1]
+
+
+def test_slow_routes_are_logged_and_replayed(tmp_path):
+    version = registry.current()
+    log = SlowQueryLog(tmp_path / "slow.jsonl", threshold=0.0)
+    a, b = _u1_ends()
+    journey = log.route(version, a, b, departure_time="08:00:00", realtime=3)
+    entries = read(log.path)
+    assert len(entries) == 1
+    entry = entries[0]
+    assert entry["params"] == {"from": a, "to": b, "departure_time": "08:00:00"}
+    assert entry["feed"] == version.version and entry["realtime"] == 3
+    assert entry["stats"]["rounds"][0]["trips"] > 0
+
+    [result] = replay(entries, version, repeat=2)
+    assert result["found"] and journey is not None
+    assert result["rounds"] == len(entry["stats"]["rounds"])
+
+
+def test_callbacks_are_logged_with_context(tmp_path):
+    version = registry.current()
+    log = SlowQueryLog(tmp_path / "slow.jsonl", threshold=0.0, context=lambda: (version, 7))
+
+    @log.callback("connection")
+    def update(set_progress, stop_from, stop_to, time):
+        return stop_from
+
+    a, b = _u1_ends()
+    update(lambda _: None, a, b, "08:00:00")
+    [entry] = read(log.path)
+    assert entry["kind"] == "callback" and entry["params"]["args"] == [a, b, "08:00:00"]
+    assert entry["realtime"] == 7
+    assert replay([entry], version)[0]["found"]
+
+
+def test_threshold_and_sampling(tmp_path):
+    fast = SlowQueryLog(tmp_path / "a.jsonl", threshold=10.0)
+    none_sampled = SlowQueryLog(tmp_path / "b.jsonl", threshold=0.0, sample=0.0)
+    assert not fast.record("route", "x", {}, 1.0)
+    assert not none_sampled.record("route", "x", {}, 1.0)
+    assert not (tmp_path / "a.jsonl").exists() and not (tmp_path / "b.jsonl").exists()